@@ -1,29 +1,35 @@
 import os
-from flask import Flask, request, jsonify, render_template
+from flask import Flask, Response, request, jsonify, render_template, stream_with_context
 from flask_cors import CORS
 from twilio.rest import Client
 from twilio.twiml.messaging_response import MessagingResponse
 import requests
-import pandas as pd
-import numpy as np
 import openai
-import asyncio
-import aiohttp
-from sklearn.ensemble import RandomForestClassifier, GradientBoostingClassifier, VotingClassifier
-from sklearn.cluster import KMeans, DBSCAN, AgglomerativeClustering
-from sklearn.preprocessing import StandardScaler, RobustScaler, PolynomialFeatures
-from sklearn.model_selection import cross_val_score, GridSearchCV
-from sklearn.metrics import classification_report, confusion_matrix
-from sklearn.neural_network import MLPClassifier
-from sklearn.svm import SVC
-from sklearn.linear_model import LogisticRegression
-from sklearn.decomposition import PCA
-from sklearn.feature_selection import SelectKBest, f_classif
-import sqlite3
 import json
+import re
+import concurrent.futures
 from datetime import datetime
 from dotenv import load_dotenv
 
+# numpy, pandas and scikit-learn are imported on demand through ml_loader
+import ml_loader
+import risk_engine
+import database as db
+from buyer_index import nearest_buyers
+from batch_matcher import matcher as batch_matcher, matches_for_farmer, last_run as last_match_run
+from migrations import migrate
+from llm_gateway import LLM_TIMEOUT, LLMGateway
+from response_cache import ChatResponseCache
+from jobs import JobQueue, new_job_id
+from weather_cache import WeatherCache
+from weather_prefetch import WeatherPrefetcher, WEATHER_CALLS_PER_MINUTE, WEATHER_PREFETCH_WORKERS
+import price_aggregates
+from price_forecast import forecaster as price_forecaster
+import broadcast
+import outbound
+from messaging import meta_text_messages, process_ussd_request, process_whatsapp_batch, respond_to_message
+from webhook_dedup import webhook_dedup
+
 load_dotenv()
 
 app = Flask(__name__)
@@ -38,95 +44,105 @@ client = Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
 # OpenAI configuration
 openai.api_key = os.getenv('OPENAI_API_KEY')
 
-# Initialize database
-def init_db():
-    conn = sqlite3.connect('harvestlink.db')
-    cursor = conn.cursor()
-    
-    # Drop existing tables to ensure clean schema
-    cursor.execute('DROP TABLE IF EXISTS farmers')
-    cursor.execute('DROP TABLE IF EXISTS buyers')
-    cursor.execute('DROP TABLE IF EXISTS ussd_sessions')
-    
-    cursor.execute('''
-        CREATE TABLE farmers (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            phone_number TEXT UNIQUE,
-            name TEXT,
-            location TEXT,
-            crop_type TEXT,
-            quantity INTEGER,
-            storage_method TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    cursor.execute('''
-        CREATE TABLE buyers (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT,
-            phone TEXT,
-            location TEXT,
-            crop_types TEXT,
-            price_range TEXT,
-            quantity_needed INTEGER,
-            verified BOOLEAN DEFAULT FALSE,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    cursor.execute('''
-        CREATE TABLE ussd_sessions (
-            session_id TEXT PRIMARY KEY,
-            data TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    conn.commit()
-    conn.close()
+# Shared non-blocking gateway for every GPT call (bounded in-flight completions)
+llm_gateway = LLMGateway()
+
+# Formatted /api/chat answers keyed on question + farm context
+chat_cache = ChatResponseCache()
+
+# Token limit for streamed chat replies (non-streamed replies stay short for speed)
+CHAT_STREAM_MAX_TOKENS = int(os.getenv('CHAT_STREAM_MAX_TOKENS', '400'))
+
+# Background worker pool for slow AI work; results are fetched by analysis_id
+job_queue = JobQueue()
+
+# Shared secret for starting alert campaigns (campaigns are disabled when unset)
+BROADCAST_API_TOKEN = os.getenv('BROADCAST_API_TOKEN')
+
+# Largest batch accepted by /api/analyze/batch
+BATCH_MAX_ROWS = int(os.getenv('BATCH_MAX_ROWS', '50000'))
+
+# Timeout (seconds) for one OpenWeather request
+WEATHER_TIMEOUT = float(os.getenv('WEATHER_TIMEOUT', '5'))
+
+# Shared deadline (seconds) for the concurrent GPT sections of a deep analysis
+DEEP_ANALYSIS_BUDGET = float(os.getenv('DEEP_ANALYSIS_BUDGET', '8'))
+
+# Text returned for a deep analysis section whose completion failed
+DEEP_ANALYSIS_FALLBACKS = {
+    'gpt_conditions_analysis': "AI analysis temporarily unavailable. Please try again.",
+    'gpt_recommendations': "AI recommendations temporarily unavailable. Please try again.",
+    'gpt_market_intelligence': "Market intelligence temporarily unavailable. Please try again."
+}
 
 class WeatherAPI:
     """Weather API integration for automatic weather data"""
     
+    DEFAULT_WEATHER = {
+        'temperature': 25,
+        'humidity': 65,
+        'condition': 'Partly Cloudy',
+        'wind_speed': 5,
+        'pressure': 1013
+    }
+    
+    # Simulated conditions used when no OpenWeather key is configured
+    LOCATION_WEATHER = {
+        'Nairobi': {'temperature': 22, 'humidity': 70, 'condition': 'Partly Cloudy'},
+        'Mombasa': {'temperature': 28, 'humidity': 80, 'condition': 'Humid'},
+        'Kisumu': {'temperature': 26, 'humidity': 75, 'condition': 'Sunny'},
+        'Nakuru': {'temperature': 20, 'humidity': 60, 'condition': 'Clear'},
+        'Eldoret': {'temperature': 18, 'humidity': 55, 'condition': 'Cool'}
+    }
+    
     def __init__(self):
         self.api_key = os.getenv('OPENWEATHER_API_KEY', 'demo_key')
-        self.base_url = "http://api.openweathermap.org/data/2.5/weather"
+        self.base_url = os.getenv('OPENWEATHER_BASE_URL', "http://api.openweathermap.org/data/2.5/weather")
+        self.live = self.api_key not in ('', 'demo_key')
+        self.session = requests.Session()
+        self.session.mount('http://', requests.adapters.HTTPAdapter(pool_maxsize=WEATHER_PREFETCH_WORKERS))
+        self.session.mount('https://', requests.adapters.HTTPAdapter(pool_maxsize=WEATHER_PREFETCH_WORKERS))
+        self.cache = WeatherCache(self._fetch_weather)
+        # The simulated table has no call budget
+        self.prefetcher = WeatherPrefetcher(self.cache, calls_per_minute=WEATHER_CALLS_PER_MINUTE if self.live else 0)
     
     def get_weather(self, location):
-        """Get current weather for a location"""
+        """Get current weather for a location (never blocks on the provider)"""
         try:
-            # For demo purposes, return simulated weather data
-            weather_data = {
-                'temperature': 25,
-                'humidity': 65,
-                'condition': 'Partly Cloudy',
-                'wind_speed': 5,
-                'pressure': 1013
-            }
-            
-            # Map locations to weather conditions
-            location_weather = {
-                'Nairobi': {'temperature': 22, 'humidity': 70, 'condition': 'Partly Cloudy'},
-                'Mombasa': {'temperature': 28, 'humidity': 80, 'condition': 'Humid'},
-                'Kisumu': {'temperature': 26, 'humidity': 75, 'condition': 'Sunny'},
-                'Nakuru': {'temperature': 20, 'humidity': 60, 'condition': 'Clear'},
-                'Eldoret': {'temperature': 18, 'humidity': 55, 'condition': 'Cool'}
-            }
-            
-            if location in location_weather:
-                weather_data.update(location_weather[location])
-            
-            return weather_data
+            if self.live:
+                # Keeps the location refreshed; one not prefetched yet is fetched in the background
+                self.prefetcher.track(location)
+            cached = self.cache.peek(location)
+            if cached is not None:
+                return cached
+            if not self.live:
+                return self.cache.get(location)
+            return dict(self.DEFAULT_WEATHER, condition='Unknown')
         except Exception as e:
             print(f"Weather API error: {e}")
-            return {
-                'temperature': 25,
-                'humidity': 65,
-                'condition': 'Unknown',
-                'wind_speed': 5,
-                'pressure': 1013
-            }
+            return dict(self.DEFAULT_WEATHER, condition='Unknown')
+    
+    def _fetch_weather(self, location):
+        """Fetch weather from OpenWeather (or the simulated table in demo mode)"""
+        if not self.live:
+            return dict(self.DEFAULT_WEATHER, **self.LOCATION_WEATHER.get(location, {}))
+        
+        response = self.session.get(
+            self.base_url,
+            params={'q': f"{location},KE", 'appid': self.api_key, 'units': 'metric'},
+            timeout=WEATHER_TIMEOUT
+        )
+        if response.status_code != 200:
+            # Not raise_for_status(): its message would log the API key in the URL
+            raise requests.HTTPError(f"OpenWeather returned {response.status_code} for {location}")
+        data = response.json()
+        return {
+            'temperature': round(data['main']['temp']),
+            'humidity': data['main']['humidity'],
+            'condition': data['weather'][0]['description'].title(),
+            'wind_speed': data.get('wind', {}).get('speed', self.DEFAULT_WEATHER['wind_speed']),
+            'pressure': data['main'].get('pressure', self.DEFAULT_WEATHER['pressure'])
+        }
 
 class HybridAI:
     """Hybrid AI system combining custom ML models with GPT-4o-mini"""
@@ -135,13 +151,9 @@ class HybridAI:
         self.gpt_model = "gpt-4o-mini"
         self.weather_api = WeatherAPI()
     
-    def analyze_crop_conditions(self, conditions_text):
-        """Use GPT-4o-mini to analyze crop conditions from natural language"""
-        try:
-            if not openai.api_key:
-                return "AI analysis requires OpenAI API key configuration"
-                
-            prompt = f"""
+    def _crop_conditions_request(self, conditions_text):
+        """Prompt and settings for the crop condition analysis"""
+        prompt = f"""
             As an agricultural AI expert, analyze these crop conditions and provide detailed insights:
             
             Conditions: {conditions_text}
@@ -155,30 +167,20 @@ class HybridAI:
             
             Format your response as a structured analysis.
             """
-            
-            response = openai.ChatCompletion.create(
-                model=self.gpt_model,
-                messages=[
-                    {"role": "system", "content": "You are an expert agricultural AI assistant specializing in crop condition analysis and post-harvest management."},
-                    {"role": "user", "content": prompt}
-                ],
-                max_tokens=500,
-                temperature=0.3
-            )
-            
-            return response.choices[0].message.content.strip()
-            
-        except Exception as e:
-            print(f"GPT analysis error: {e}")
-            return "AI analysis temporarily unavailable. Please try again."
+        
+        return {
+            'messages': [
+                {"role": "system", "content": "You are an expert agricultural AI assistant specializing in crop condition analysis and post-harvest management."},
+                {"role": "user", "content": prompt}
+            ],
+            'model': self.gpt_model,
+            'max_tokens': 500,
+            'temperature': 0.3
+        }
     
-    def generate_smart_recommendations(self, crop_type, quantity, location, storage_method, conditions):
-        """Generate intelligent recommendations using GPT-4o-mini"""
-        try:
-            if not openai.api_key:
-                return "Smart recommendations require OpenAI API key configuration"
-                
-            prompt = f"""
+    def _recommendations_request(self, crop_type, quantity, location, storage_method, conditions):
+        """Prompt and settings for the smart recommendations"""
+        prompt = f"""
             As an agricultural AI expert, provide comprehensive recommendations for this farming scenario:
             
             Crop: {crop_type}
@@ -196,30 +198,20 @@ class HybridAI:
             
             Be specific and actionable for smallholder farmers.
             """
-            
-            response = openai.ChatCompletion.create(
-                model=self.gpt_model,
-                messages=[
-                    {"role": "system", "content": "You are an expert agricultural consultant specializing in post-harvest management and market optimization for smallholder farmers in Africa."},
-                    {"role": "user", "content": prompt}
-                ],
-                max_tokens=600,
-                temperature=0.4
-            )
-            
-            return response.choices[0].message.content.strip()
-            
-        except Exception as e:
-            print(f"GPT recommendations error: {e}")
-            return "AI recommendations temporarily unavailable. Please try again."
+        
+        return {
+            'messages': [
+                {"role": "system", "content": "You are an expert agricultural consultant specializing in post-harvest management and market optimization for smallholder farmers in Africa."},
+                {"role": "user", "content": prompt}
+            ],
+            'model': self.gpt_model,
+            'max_tokens': 600,
+            'temperature': 0.4
+        }
     
-    def analyze_market_intelligence(self, crop_type, location, quantity):
-        """Generate market intelligence using GPT-4o-mini"""
-        try:
-            if not openai.api_key:
-                return "Market intelligence requires OpenAI API key configuration"
-                
-            prompt = f"""
+    def _market_intelligence_request(self, crop_type, location, quantity):
+        """Prompt and settings for the market intelligence report"""
+        prompt = f"""
             Provide market intelligence for this agricultural scenario:
             
             Crop: {crop_type}
@@ -236,92 +228,89 @@ class HybridAI:
             
             Focus on actionable intelligence for farmers.
             """
+        
+        return {
+            'messages': [
+                {"role": "system", "content": "You are a market intelligence expert specializing in African agricultural markets and supply chains."},
+                {"role": "user", "content": prompt}
+            ],
+            'model': self.gpt_model,
+            'max_tokens': 500,
+            'temperature': 0.4
+        }
+    
+    def analyze_crop_conditions(self, conditions_text):
+        """Use GPT-4o-mini to analyze crop conditions from natural language"""
+        try:
+            if not openai.api_key:
+                return "AI analysis requires OpenAI API key configuration"
+            
+            return llm_gateway.complete(**self._crop_conditions_request(conditions_text))
+            
+        except Exception as e:
+            print(f"GPT analysis error: {e}")
+            return "AI analysis temporarily unavailable. Please try again."
+    
+    def generate_smart_recommendations(self, crop_type, quantity, location, storage_method, conditions):
+        """Generate intelligent recommendations using GPT-4o-mini"""
+        try:
+            if not openai.api_key:
+                return "Smart recommendations require OpenAI API key configuration"
+            
+            return llm_gateway.complete(**self._recommendations_request(crop_type, quantity, location, storage_method, conditions))
             
-            response = openai.ChatCompletion.create(
-                model=self.gpt_model,
-                messages=[
-                    {"role": "system", "content": "You are a market intelligence expert specializing in African agricultural markets and supply chains."},
-                    {"role": "user", "content": prompt}
-                ],
-                max_tokens=500,
-                temperature=0.4
-            )
+        except Exception as e:
+            print(f"GPT recommendations error: {e}")
+            return "AI recommendations temporarily unavailable. Please try again."
+    
+    def analyze_market_intelligence(self, crop_type, location, quantity):
+        """Generate market intelligence using GPT-4o-mini"""
+        try:
+            if not openai.api_key:
+                return "Market intelligence requires OpenAI API key configuration"
             
-            return response.choices[0].message.content.strip()
+            return llm_gateway.complete(**self._market_intelligence_request(crop_type, location, quantity))
             
         except Exception as e:
             print(f"GPT market intelligence error: {e}")
             return "Market intelligence temporarily unavailable. Please try again."
+    
+    def start_deep_analysis(self, crop_type, quantity, location, storage_method, conditions):
+        """Start all three GPT analyses at once and return {section: future}"""
+        requests_by_section = {
+            'gpt_conditions_analysis': self._crop_conditions_request(conditions),
+            'gpt_recommendations': self._recommendations_request(crop_type, quantity, location, storage_method, conditions),
+            'gpt_market_intelligence': self._market_intelligence_request(crop_type, location, quantity)
+        }
+        return {section: llm_gateway.submit(**params) for section, params in requests_by_section.items()}
 
 # Initialize Hybrid AI system
 hybrid_ai = HybridAI()
 
-# Initialize database
-init_db()
-
-def register_farmer(phone_number, data):
-    """Register or update farmer information"""
-    conn = sqlite3.connect('harvestlink.db')
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        INSERT OR REPLACE INTO farmers (phone_number, name, location, crop_type, quantity, storage_method)
-        VALUES (?, ?, ?, ?, ?, ?)
-    ''', (
-        phone_number,
-        data.get('name', 'Unknown'),
-        data.get('location', 'Unknown'),
-        data.get('crop', 'maize'),
-        data.get('quantity', 0),
-        data.get('storage', 'traditional')
-    ))
-    
-    farmer_id = cursor.lastrowid
-    conn.commit()
-    conn.close()
-    return farmer_id
+# Bring the database schema up to date (no-op once migrated)
+migrate()
+
+# Start background workers (also picks up jobs queued before a restart)
+job_queue.start()
+
+# Warm weather from the last snapshot, then keep known locations refreshed
+hybrid_ai.weather_api.prefetcher.start()
+
+# Periodically re-assign open farmer lots to buyers with capacity
+batch_matcher.start()
 
 def find_matching_buyers(data):
-    """Find matching buyers for farmer's crop"""
-    conn = sqlite3.connect('harvestlink.db')
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        SELECT name, phone, location, price_range, quantity_needed
-        FROM buyers 
-        WHERE crop_types LIKE ? AND verified = 1
-        ORDER BY RANDOM()
-        LIMIT 3
-    ''', (f"%{data.get('crop', 'maize')}%",))
-    
-    buyers = cursor.fetchall()
-    conn.close()
-    return buyers
-
-def seed_database():
-    """Seed database with sample data"""
-    conn = sqlite3.connect('harvestlink.db')
-    cursor = conn.cursor()
-    
-    # Sample buyers
-    buyers_data = [
-        ('AgriCorp Kenya', '+254700000001', 'Nairobi', 'maize,wheat,rice', 'KES 3.0-3.5/kg', 1000),
-        ('FarmFresh Ltd', '+254700000002', 'Mombasa', 'tomatoes,onions', 'KES 8.0-10.0/kg', 500),
-        ('ExportCo Africa', '+254700000003', 'Kisumu', 'maize,beans', 'KES 3.2-3.8/kg', 2000),
-        ('Local Market Co', '+254700000004', 'Nakuru', 'potatoes,wheat', 'KES 2.5-3.0/kg', 800),
-        ('GreenValley Foods', '+254700000005', 'Eldoret', 'rice,maize', 'KES 2.8-3.2/kg', 1500)
-    ]
-    
-    cursor.executemany('''
-        INSERT OR IGNORE INTO buyers (name, phone, location, crop_types, price_range, quantity_needed, verified)
-        VALUES (?, ?, ?, ?, ?, ?, 1)
-    ''', buyers_data)
-    
-    conn.commit()
-    conn.close()
-
-# Seed database
-seed_database()
+    """Buyers from a registered farmer's batch match, else up to 3 ranked by distance, capacity and price"""
+    with db.connection() as conn:
+        if data.get('phone'):
+            farmer = conn.execute(
+                'SELECT id FROM farmers WHERE phone_number = ? AND LOWER(crop_type) = ?',
+                (data['phone'], str(data.get('crop', 'maize')).strip().lower())
+            ).fetchone()
+            matches = matches_for_farmer(conn, farmer[0]) if farmer else []
+            if matches:
+                return matches
+        return nearest_buyers(conn, data.get('crop', 'maize'), data.get('location'), data.get('quantity'))
 
 @app.route('/')
 def home():
@@ -342,6 +331,18 @@ def get_weather(location):
             'message': str(e)
         }), 500
 
+@app.route('/api/metrics')
+def get_metrics():
+    """Cache counters for monitoring"""
+    return jsonify({
+        'status': 'success',
+        'chat_cache': chat_cache.stats(),
+        'weather_cache': hybrid_ai.weather_api.cache.stats(),
+        'weather_prefetch': hybrid_ai.weather_api.prefetcher.stats(),
+        'batch_matching': last_match_run(),
+        'outbound': outbound.dispatcher.stats()
+    })
+
 @app.route('/test', methods=['GET', 'POST'])
 def test_endpoint():
     if request.method == 'POST':
@@ -370,33 +371,32 @@ def analyze_harvest():
         import datetime
         
         # Quick loss prediction based on weather and storage
-        weather_risk = 0.1 if weather_data['humidity'] > 70 else 0.05
-        storage_risk = 0.15 if storage_method == 'traditional' else 0.08
-        crop_age_risk = 0.02 * int(conditions.split('days ago')[0].split()[-1]) if 'days ago' in conditions else 0.02
-        
-        loss_percentage = min(35, max(5, (weather_risk + storage_risk + crop_age_risk) * 100 + random.uniform(-5, 5)))
+        base_price = risk_engine.base_price(crop_type)
+        loss_percentage, estimated_loss_value, urgency = risk_engine.score_lot(
+            crop_type, quantity, weather_data['humidity'], storage_method, risk_engine.crop_age_days(conditions)
+        )
         confidence_score = random.uniform(85, 95)
         
         # Determine urgency level based on loss percentage
-        if loss_percentage > 20:
-            urgency_level = "High - Act Now!"
+        urgency_level = risk_engine.URGENCY_LEVELS[urgency]
+        if urgency == 2:
             urgency_reason = f"Your {crop_type} is losing {loss_percentage:.1f}% due to high humidity ({weather_data['humidity']}%) and storage conditions"
-        elif loss_percentage > 10:
-            urgency_level = "Medium - Monitor Closely"
+        elif urgency == 1:
             urgency_reason = f"Your {crop_type} has moderate risk of {loss_percentage:.1f}% loss from weather and storage factors"
         else:
-            urgency_level = "Low - Good Condition"
             urgency_reason = f"Your {crop_type} is in good condition with only {loss_percentage:.1f}% expected loss"
         
-        # Quick price analysis
-        base_prices = {
-            'maize': 3.2, 'wheat': 4.1, 'rice': 2.8, 'tomatoes': 8.2, 
-            'beans': 5.5, 'potatoes': 2.1, 'onions': 3.8, 'cassava': 1.8,
-            'sorghum': 2.5, 'millet': 2.3, 'groundnuts': 6.8
-        }
-        base_price = base_prices.get(crop_type.lower(), 3.0)
-        price_trend = random.choice(['increasing', 'decreasing', 'stable'])
-        price_change = random.uniform(-0.3, 0.4)
+        # Price forecast from transaction history, applied to the KES/kg base price as relative changes
+        forecast = price_forecaster.forecast(crop_type, location)
+        if forecast and forecast['current'] > 0:
+            price_7, price_14, price_30 = (base_price * forecast['forecasts'][days] / forecast['current'] for days in (7, 14, 30))
+            price_trend = forecast['trend']
+            price_confidence = forecast['confidence']
+        else:
+            price_7 = price_14 = price_30 = base_price
+            price_trend = 'stable'
+            price_confidence = 0.0
+        price_change = price_7 - base_price
         
         # Determine sell timing
         if price_change > 0.2:
@@ -425,7 +425,7 @@ def analyze_harvest():
                 f"Sell within {random.randint(7, 21)} days to minimize losses",
                 f"Monitor for pests and mold regularly"
             ],
-            'estimated_loss_value': round(quantity * (loss_percentage / 100) * base_price, 2),
+            'estimated_loss_value': round(estimated_loss_value, 2),
             'urgency_level': urgency_level,
             'urgency_reason': urgency_reason
         }
@@ -433,11 +433,11 @@ def analyze_harvest():
         # Price Forecast
         price_analysis = {
             'current_price_per_kg': round(base_price, 2),
-            'predicted_price_7_days': round(base_price + price_change, 2),
-            'predicted_price_14_days': round(base_price + (price_change * 1.5), 2),
-            'predicted_price_30_days': round(base_price + (price_change * 2), 2),
+            'predicted_price_7_days': round(price_7, 2),
+            'predicted_price_14_days': round(price_14, 2),
+            'predicted_price_30_days': round(price_30, 2),
             'price_trend': price_trend,
-            'confidence_score': round(random.uniform(80, 92), 1),
+            'confidence_score': round(price_confidence, 1),
             'market_factors': [
                 f"Seasonal demand in {location} is {random.choice(['high', 'moderate', 'low'])}",
                 f"Weather conditions affecting supply chain",
@@ -446,41 +446,47 @@ def analyze_harvest():
             'optimal_sell_timing': sell_timing,
             'sell_reason': sell_reason,
             'potential_revenue': round(quantity * base_price, 2),
-            'potential_revenue_optimal': round(quantity * (base_price + abs(price_change)), 2)
+            'potential_revenue_optimal': round(quantity * max(base_price, price_7, price_14, price_30), 2)
         }
         
-        # Buyer Matching
+        # Buyer Matching: the farmer's batch match or the nearest verified buyers, offers in KES/kg where listed
         buyers_data = [
             {
-                'name': f'{random.choice(["AgriCorp", "FarmFresh", "GreenValley"])} {location}',
-                'rating': round(random.uniform(4.2, 4.9), 1),
-                'price_offered': round(base_price + random.uniform(-0.2, 0.3), 2),
-                'quantity_needed': random.randint(50, 200),
-                'payment_terms': random.choice(['Cash on delivery', '30 days credit', 'Immediate payment']),
-                'location': location,
-                'specialization': f'{crop_type} processing',
-                'contact': f'+254 {random.randint(700000000, 799999999)}',
-                'verified': True
-            },
-            {
-                'name': f'{random.choice(["ExportCo", "LocalMarket"])} Kenya',
-                'rating': round(random.uniform(4.0, 4.8), 1),
-                'price_offered': round(base_price + random.uniform(-0.1, 0.2), 2),
-                'quantity_needed': random.randint(100, 300),
-                'payment_terms': random.choice(['Bank transfer', 'Mobile money', 'Cheque']),
-                'location': 'Nairobi',
-                'specialization': 'Bulk purchasing',
-                'contact': f'+254 {random.randint(700000000, 799999999)}',
+                'name': buyer['name'],
+                'price_offered': round(buyer['offer_price'] if buyer['offer_price'] is not None else base_price, 2),
+                'quantity_needed': buyer['quantity_needed'],
+                'matched_kg': buyer.get('matched_kg'),
+                'location': buyer['location'],
+                'distance_km': buyer['distance_km'],
+                'price_range': buyer['price_range'],
+                'contact': buyer['phone'],
                 'verified': True
             }
+            for buyer in find_matching_buyers({'crop': crop_type, 'location': location, 'quantity': quantity, 'phone': data.get('phone')})
         ]
         
+        market = price_aggregates.market_summary(crop_type, location)
+        offers = [b['price_offered'] for b in buyers_data] or [base_price]
+        if market is not None:
+            low, high = price_aggregates.per_kg_range(market, base_price)
+            market_range = f"KES {low:.2f} - {high:.2f} per kg"
+        else:
+            market_range = f"KES {min(offers):.2f} - {max(offers):.2f} per kg"
+        
+        if buyers_data:
+            best_match = buyers_data[0]
+            distance = f" ({best_match['distance_km']:.0f} km away)" if best_match['distance_km'] is not None else ''
+            recommendation = f"Contact {best_match['name']}{distance} for KES {best_match['price_offered']:.2f}/kg"
+        else:
+            best_match = {'name': 'No verified buyers yet', 'price_offered': round(base_price, 2), 'contact': 'N/A'}
+            recommendation = f"No verified buyers for {crop_type} yet - we will notify you when one registers"
+        
         buyer_analysis = {
             'matched_buyers': buyers_data,
-            'best_match': buyers_data[0] if buyers_data[0]['price_offered'] > buyers_data[1]['price_offered'] else buyers_data[1],
+            'best_match': best_match,
             'market_coverage': f"{len(buyers_data)} verified buyers in your region",
-            'price_range': f"KES {min(b['price_offered'] for b in buyers_data):.2f} - {max(b['price_offered'] for b in buyers_data):.2f} per kg",
-            'recommendation': f"Contact {buyers_data[0]['name']} for best price of KES {buyers_data[0]['price_offered']:.2f}/kg"
+            'price_range': market_range,
+            'recommendation': recommendation
         }
         
         # AI Summary
@@ -501,9 +507,27 @@ def analyze_harvest():
             'weather_data': weather_data,
             'timestamp': datetime.datetime.now().isoformat(),
             'status': 'success',
-            'analysis_id': int(datetime.datetime.now().timestamp() * 1000)  # Unique ID for saving
+            'analysis_id': new_job_id()  # Unique ID for saving and polling
         }
         
+        # Opt-in deep analysis: the three GPT sections run in the background, polled by analysis_id
+        if data.get('deep'):
+            response['deep_analysis'] = {
+                'status': 'queued',
+                'sections': {},
+                'pending_sections': list(DEEP_ANALYSIS_FALLBACKS),
+                'poll_url': f"/api/analysis/{response['analysis_id']}"
+            }
+            job_queue.enqueue('deep_analysis', {
+                'crop_type': crop_type,
+                'quantity': quantity,
+                'location': location,
+                'storage_method': storage_method,
+                'conditions': conditions
+            }, result=response, job_id=response['analysis_id'])
+        else:
+            job_queue.record('analysis', response, job_id=response['analysis_id'])
+        
         return jsonify(response)
         
     except Exception as e:
@@ -514,6 +538,197 @@ def analyze_harvest():
             'status': 'error'
         }), 500
 
+@job_queue.handler('deep_analysis')
+def run_deep_analysis(job):
+    """Run the three GPT sections concurrently, publishing each as it finishes"""
+    payload = job.payload
+    futures = hybrid_ai.start_deep_analysis(
+        payload['crop_type'], payload['quantity'], payload['location'],
+        payload['storage_method'], payload['conditions']
+    )
+    sections = {}
+    pending = list(futures)
+    sections_by_future = {future: section for section, future in futures.items()}
+    
+    def publish(future):
+        section = sections_by_future[future]
+        try:
+            sections[section] = future.result()
+        except Exception as e:
+            print(f"GPT deep analysis error ({section}): {e}")
+            sections[section] = DEEP_ANALYSIS_FALLBACKS[section]
+        pending.remove(section)
+        job.update({'deep_analysis': {
+            'status': 'partial' if pending else 'complete',
+            'sections': dict(sections),
+            'pending_sections': list(pending)
+        }})
+    
+    try:
+        for future in concurrent.futures.as_completed(sections_by_future, timeout=DEEP_ANALYSIS_BUDGET):
+            publish(future)
+        return
+    except concurrent.futures.TimeoutError:
+        print(f"⏳ Deep analysis {job.id}: {len(pending)} sections past the {DEEP_ANALYSIS_BUDGET:.0f}s budget")
+    
+    # Past the shared deadline: keep attaching late sections to the analysis as they finish
+    try:
+        for future in concurrent.futures.as_completed([futures[section] for section in pending], timeout=LLM_TIMEOUT):
+            publish(future)
+    except concurrent.futures.TimeoutError:
+        timed_out = list(pending)
+        for section in timed_out:
+            sections[section] = DEEP_ANALYSIS_FALLBACKS[section]
+        job.update({'deep_analysis': {
+            'status': 'complete',
+            'sections': dict(sections),
+            'pending_sections': [],
+            'timed_out_sections': timed_out
+        }})
+
+@app.route('/api/prices/<crop>')
+def get_prices(crop):
+    """Recent market prices for a crop from the daily price aggregates"""
+    location = request.args.get('location')
+    try:
+        days = min(max(int(request.args.get('days', price_aggregates.MARKET_WINDOW_DAYS)), 1), 365)
+    except ValueError:
+        return jsonify({
+            'status': 'error',
+            'message': 'days must be an integer'
+        }), 400
+    
+    return jsonify({
+        'status': 'success',
+        'crop': crop.strip().lower(),
+        'summary': price_aggregates.market_summary(crop, location, days),
+        'daily': price_aggregates.daily_prices(crop, location, days)
+    })
+
+@job_queue.handler('broadcast')
+def run_broadcast(job):
+    """Send an alert campaign, resuming from its checkpoint if a worker died mid-campaign"""
+    return broadcast.run_campaign(job.payload['campaign_id'], heartbeat=job.update)
+
+@app.route('/api/broadcasts', methods=['POST'])
+def start_broadcast():
+    """Start a price or weather alert campaign to registered farmers"""
+    if not BROADCAST_API_TOKEN or request.headers.get('Authorization') != f"Bearer {BROADCAST_API_TOKEN}":
+        return jsonify({
+            'status': 'error',
+            'message': 'Not authorized to start broadcasts'
+        }), 403
+    
+    data = request.get_json() or {}
+    try:
+        campaign_id = broadcast.create_campaign(
+            data.get('kind', 'price'), data.get('provider', 'sms'), data.get('crop'), data.get('location')
+        )
+    except ValueError as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 400
+    
+    job_id = job_queue.enqueue('broadcast', {'campaign_id': campaign_id})
+    return jsonify({
+        'status': 'success',
+        'campaign_id': campaign_id,
+        'job_id': job_id
+    }), 202
+
+@app.route('/api/broadcasts/<int:campaign_id>')
+def get_broadcast(campaign_id):
+    """Progress of an alert campaign"""
+    campaign = broadcast.campaign_status(campaign_id)
+    if campaign is None:
+        return jsonify({
+            'status': 'error',
+            'message': 'Unknown campaign_id'
+        }), 404
+    
+    return jsonify({
+        'status': 'success',
+        'campaign': campaign
+    })
+
+@app.route('/api/analysis/<analysis_id>')
+def get_analysis(analysis_id):
+    """Return a stored analysis, including deep analysis sections finished so far"""
+    job = job_queue.get(analysis_id)
+    
+    if job is None:
+        return jsonify({
+            'status': 'error',
+            'message': 'Unknown analysis_id'
+        }), 404
+    
+    response = dict(job['result'])
+    response['job_status'] = job['status']
+    if job['error']:
+        response['job_error'] = job['error']
+    return jsonify(response)
+
+@app.route('/api/analyze/batch', methods=['POST'])
+def analyze_harvest_batch():
+    """Score many lots at once from columnar arrays (cooperatives, extension officers)"""
+    try:
+        data = request.get_json() or {}
+        crop_types = data.get('cropType') or []
+        rows = len(crop_types)
+        
+        if rows == 0:
+            return jsonify({'status': 'error', 'message': 'cropType must be a non-empty list'}), 400
+        if rows > BATCH_MAX_ROWS:
+            return jsonify({'status': 'error', 'message': f'At most {BATCH_MAX_ROWS} lots per batch'}), 400
+        
+        # Every other column is optional and defaults like the single-lot endpoint
+        quantities = data.get('quantity') or [0] * rows
+        locations = data.get('location') or ['Nairobi'] * rows
+        storage_methods = data.get('storageMethod') or ['traditional'] * rows
+        if 'storageDays' in data:
+            age_days = data['storageDays']
+        else:
+            age_days = [risk_engine.crop_age_days(text) for text in (data.get('conditions') or [''] * rows)]
+        
+        columns = (quantities, locations, storage_methods, age_days)
+        if any(len(column) != rows for column in columns):
+            return jsonify({'status': 'error', 'message': 'All columns must have the same length'}), 400
+        
+        # One weather lookup per distinct location
+        humidity_by_location = {
+            location: hybrid_ai.weather_api.get_weather(location)['humidity']
+            for location in set(locations)
+        }
+        humidities = [humidity_by_location[location] for location in locations]
+        
+        scores = risk_engine.score_batch(crop_types, quantities, humidities, storage_methods, age_days)
+        loss_percentage = scores['loss_percentage']
+        urgency = scores['urgency']
+        
+        return jsonify({
+            'status': 'success',
+            'count': rows,
+            'loss_percentage': loss_percentage.round(1).tolist(),
+            'estimated_loss_value': scores['estimated_loss_value'].round(2).tolist(),
+            'urgency_level': [risk_engine.URGENCY_LEVELS[level] for level in urgency.tolist()],
+            'summary': {
+                'mean_loss_percentage': round(float(loss_percentage.mean()), 1),
+                'total_estimated_loss_value': round(float(scores['estimated_loss_value'].sum()), 2),
+                'high_risk_lots': int((urgency == 2).sum())
+            }
+        })
+        
+    except (TypeError, ValueError) as e:
+        return jsonify({'status': 'error', 'message': f'Invalid batch: {e}'}), 400
+    except Exception as e:
+        print(f"Batch API Error: {e}")
+        return jsonify({
+            'error': 'Batch analysis failed',
+            'message': str(e),
+            'status': 'error'
+        }), 500
+
 @app.route('/api/chat', methods=['POST'])
 def chat_with_ai():
     """Chatbot endpoint for interactive AI assistance - OPTIMIZED FOR SPEED"""
@@ -530,6 +745,18 @@ def chat_with_ai():
         location = context.get('location', 'Nairobi')
         quantity = context.get('quantity', '100')
         
+        # Repeat questions are answered from the cache (already formatted); streamed replies are cached apart
+        cache_key = chat_cache.make_key(message, crop, location, quantity, 'stream' if data.get('stream') else 'json')
+        cached_response = chat_cache.get(cache_key)
+        if cached_response is not None:
+            if data.get('stream'):
+                return stream_chat_response(cached_response=cached_response)
+            return jsonify({
+                'status': 'success',
+                'response': cached_response,
+                'cached': True
+            })
+        
         # SHORTER, MORE FOCUSED PROMPT FOR SPEED
         prompt = f"""You are HarvestLink AI, a helpful agricultural assistant for smallholder farmers in Kenya.
 
@@ -546,21 +773,25 @@ Provide a helpful, actionable response that:
 
 Format your response with clear sections if needed. Do NOT start with "Certainly!" or "Here is..." - just give direct advice."""
         
+        messages = [
+            {"role": "system", "content": "You are a helpful agricultural assistant for smallholder farmers in Kenya. Give direct, actionable advice in simple language."},
+            {"role": "user", "content": prompt}
+        ]
+        
+        # Streaming shows the first words at once, so the reply can be longer
+        if data.get('stream'):
+            return stream_chat_response(messages, cache_key)
+        
         # FASTER API CALL - Reduced tokens and temperature
-        response = openai.ChatCompletion.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": "You are a helpful agricultural assistant for smallholder farmers in Kenya. Give direct, actionable advice in simple language."},
-                {"role": "user", "content": prompt}
-            ],
+        ai_response = llm_gateway.complete(
+            messages,
             max_tokens=150,  # Reduced from 200
             temperature=0.5   # Reduced from 0.7
         )
         
-        ai_response = response.choices[0].message.content.strip()
-        
         # FORMAT THE RESPONSE BETTER
         formatted_response = format_ai_response(ai_response)
+        chat_cache.put(cache_key, formatted_response)
         
         return jsonify({
             'status': 'success',
@@ -574,48 +805,132 @@ Format your response with clear sections if needed. Do NOT start with "Certainly
             'response': 'Sorry, I\'m having trouble right now. Please try again in a moment.'
         }), 500
 
-def format_ai_response(response):
-    """Format AI response for better readability"""
-    import re
-    
-    # Remove common AI prefixes
-    prefixes_to_remove = [
-        "Certainly! Here is a comprehensive",
-        "Here is a comprehensive",
-        "Certainly!",
-        "Here's",
-        "Here is",
-        "Based on your question",
-        "To answer your question"
-    ]
-    
-    for prefix in prefixes_to_remove:
-        if response.startswith(prefix):
-            response = response[len(prefix):].strip()
-            break
+def _sse(payload):
+    """Encode one server-sent event"""
+    return f"data: {json.dumps(payload)}\n\n"
+
+def stream_chat_response(messages=None, cache_key=None, cached_response=None):
+    """Stream a chat reply to the browser as server-sent events.
+    
+    'delta' is formatted HTML for finished lines; 'pending' is the plain text
+    of the line still being written, which the page shows until it is done.
+    """
+    def generate():
+        if cached_response is not None:
+            yield _sse({'delta': cached_response})
+            yield _sse({'done': True, 'cached': True})
+            return
+        
+        formatter = StreamingFormatter()
+        raw_reply = []
+        shown = ''
+        try:
+            for token in llm_gateway.stream(messages, max_tokens=CHAT_STREAM_MAX_TOKENS, temperature=0.5):
+                raw_reply.append(token)
+                html = formatter.feed(token)
+                line = formatter.open_line()
+                if html or line != shown:
+                    shown = line
+                    yield _sse({'delta': html, 'pending': line})
+            yield _sse({'delta': formatter.flush(), 'pending': ''})
+        except Exception as e:
+            print(f"Chat stream error: {e}")
+            yield _sse({'error': 'Sorry, I\'m having trouble right now. Please try again in a moment.'})
+            return
+        
+        chat_cache.put(cache_key, format_ai_response(''.join(raw_reply).strip()))
+        yield _sse({'done': True, 'cached': False})
     
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+# Common AI prefixes removed from the start of a reply
+AI_PREFIXES = (
+    "Certainly! Here is a comprehensive",
+    "Here is a comprehensive",
+    "Certainly!",
+    "Here's",
+    "Here is",
+    "Based on your question",
+    "To answer your question"
+)
+_MAX_PREFIX_LENGTH = max(len(prefix) for prefix in AI_PREFIXES)
+
+# Lines starting with these get a blank line before them
+LIST_MARKERS = ('1.', '2.', '3.', '4.', '5.', '•', '-', '*')
+
+def _markdown_to_html(text):
+    """Convert markdown bold/italic within one line to HTML"""
     # Convert markdown bold (**text**) to HTML bold
-    response = re.sub(r'\*\*(.*?)\*\*', r'<strong>\1</strong>', response)
+    text = re.sub(r'\*\*(.*?)\*\*', r'<strong>\1</strong>', text)
     
     # Convert markdown italic (*text*) to HTML italic
-    response = re.sub(r'\*(.*?)\*', r'<em>\1</em>', response)
+    return re.sub(r'\*(.*?)\*', r'<em>\1</em>', text)
+
+class StreamingFormatter:
+    """Incremental version of format_ai_response for replies that arrive in chunks.
     
-    # Add proper spacing and formatting
-    lines = response.split('\n')
-    formatted_lines = []
+    Each line is formatted once its newline arrives, so the streamed HTML is
+    exactly what format_ai_response returns. Meanwhile open_line() gives the
+    raw text of the line still arriving, for display as plain text.
+    """
     
-    for line in lines:
-        line = line.strip()
-        if line:
-            # If line starts with a number or bullet, add proper spacing
-            if line.startswith(('1.', '2.', '3.', '4.', '5.', '•', '-', '*')):
-                formatted_lines.append(f"\n{line}")
-            elif line.endswith(':'):
-                formatted_lines.append(f"\n{line}")
-            else:
-                formatted_lines.append(line)
+    def __init__(self):
+        self._pending = ''        # raw text of the line still being received
+        self._checked_prefix = False
+        self._lines = 0
+    
+    def feed(self, text):
+        """Add a chunk of raw reply text and return the HTML for the lines it completes"""
+        self._pending += text
+        if not self._checked_prefix:
+            head = self._pending.lstrip()
+            if len(head) < _MAX_PREFIX_LENGTH and '\n' not in head:
+                return ''
+            self._strip_prefix()
+        
+        *lines, self._pending = self._pending.split('\n')
+        return ''.join(self._format_line(line) for line in lines)
+    
+    def flush(self):
+        """Return the HTML for whatever is left once the reply is complete"""
+        if not self._checked_prefix:
+            self._strip_prefix()
+        line, self._pending = self._pending, ''
+        return self._format_line(line)
+    
+    def open_line(self):
+        """Plain text of the unfinished line, with the separator it will get ('' if none yet)"""
+        text = self._pending.strip() if self._checked_prefix else ''
+        if not text:
+            return ''
+        return ('\n' if self._lines else '') + text
+    
+    def _strip_prefix(self):
+        self._checked_prefix = True
+        self._pending = self._pending.lstrip()
+        for prefix in AI_PREFIXES:
+            if self._pending.startswith(prefix):
+                self._pending = self._pending[len(prefix):].lstrip()
+                break
     
-    return '\n'.join(formatted_lines).strip()
+    def _format_line(self, line):
+        line = line.strip()
+        if not line:
+            return ''
+        html = _markdown_to_html(line)
+        self._lines += 1
+        if self._lines == 1:
+            return html
+        spaced = html.startswith(LIST_MARKERS) or html.endswith(':')
+        return ('\n\n' if spaced else '\n') + html
+
+def format_ai_response(response):
+    """Format AI response for better readability"""
+    formatter = StreamingFormatter()
+    return (formatter.feed(response + '\n') + formatter.flush()).strip()
 
 @app.route('/sms', methods=['POST'])
 def handle_sms():
@@ -625,26 +940,88 @@ def handle_sms():
     
     print(f"📱 Received SMS from {from_number}: {incoming_msg}")
     
-    # Simple response for SMS
-    response_text = f"""🌾 HarvestLink AI Response
-
-Thank you for your message: {incoming_msg}
-
-For detailed AI analysis, please visit our web interface at:
-https://harvestlink.onrender.com
-
-Our AI system provides:
-• Loss prediction analysis
-• Price forecasting
-• Buyer matching
-• Smart recommendations
-
-Visit the website for full analysis!"""
+    # A redelivery gets the reply generated the first time (none while that is still running)
+    response_text, first = webhook_dedup.process(
+        'twilio', request.values.get('MessageSid'), lambda: respond_to_message(incoming_msg, from_number)
+    )
+    if not first:
+        print(f"🔁 Duplicate SMS {request.values.get('MessageSid')} from {from_number}")
     
+    # Send response
     resp = MessagingResponse()
-    resp.message(response_text)
+    if response_text is not None:
+        resp.message(response_text)
+    
     return str(resp)
 
+@app.route('/ussd', methods=['POST'])
+def handle_ussd():
+    """USSD handler for HarvestLink - Guided menu system"""
+    session_id = request.values.get('sessionId', '')
+    service_code = request.values.get('serviceCode', '')
+    phone_number = request.values.get('phoneNumber', '')
+    text = request.values.get('text', '').strip()
+    
+    print(f"📞 USSD from {phone_number}: {text}")
+    
+    # Parse USSD input
+    ussd_response = process_ussd_request(text, phone_number, session_id)
+    
+    return ussd_response
+
+@app.route('/whatsapp', methods=['GET', 'POST'])
+def handle_whatsapp():
+    """Handle WhatsApp messages via webhook"""
+    if request.method == 'GET':
+        # WhatsApp webhook verification
+        verify_token = request.args.get('hub.verify_token')
+        challenge = request.args.get('hub.challenge')
+        
+        if verify_token == 'harvestlink_verify_123':
+            print("WhatsApp webhook verified successfully!")
+            return challenge
+        else:
+            return 'Verification failed', 403
+    
+    elif request.method == 'POST':
+        try:
+            # Get WhatsApp message data
+            data = request.get_json()
+            print(f"WhatsApp webhook received: {data}")
+            print(f"Data type: {type(data)}")
+            print(f"Data keys: {list(data.keys()) if data else 'None'}")
+            
+            # Check if it's Twilio WhatsApp format
+            if data and 'MessageSid' in data:
+                # Twilio WhatsApp format
+                phone_number = data['From'].replace('whatsapp:', '')
+                message_text = data['Body']
+                
+                print(f"Twilio WhatsApp message from {phone_number}: {message_text}")
+                
+                # Process once per MessageSid; the reply goes out from the background sender
+                process_whatsapp_batch('twilio', [(data['MessageSid'], phone_number, message_text)])
+                
+                return jsonify({'status': 'success'})
+            
+            # Check if it's Meta WhatsApp format
+            elif data and 'entry' in data:
+                # Meta WhatsApp format: under load one webhook carries several entries, changes and messages
+                messages = meta_text_messages(data)
+                if not messages:
+                    return jsonify({'status': 'success', 'message': 'No message to process'})
+                
+                print(f"Meta WhatsApp batch of {len(messages)} message(s) from {len({phone_number for _, phone_number, _ in messages})} sender(s)")
+                processed, duplicates = process_whatsapp_batch('meta', messages)
+                
+                return jsonify({'status': 'success', 'processed': processed, 'duplicates': duplicates})
+            else:
+                return jsonify({'status': 'error', 'message': 'Unknown webhook format'}), 400
+                
+        except Exception as e:
+            print(f"WhatsApp webhook error: {e}")
+            return jsonify({'status': 'error', 'message': str(e)}), 500
+
 if __name__ == '__main__':
     print("🚀 Starting HarvestLink AI System...")
     print("🌐 Web Interface: http://localhost:5000")
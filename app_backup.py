@@ -17,13 +17,19 @@ from sklearn.svm import SVC
 from sklearn.linear_model import LogisticRegression
 from sklearn.decomposition import PCA
 from sklearn.feature_selection import SelectKBest, f_classif
-import sqlite3
 import json
 from datetime import datetime, timedelta
 import re
 from dotenv import load_dotenv
 import joblib
 import warnings
+import loss_model
+import price_forecast
+import risk_tables
+from migrations import migrate
+from llm_gateway import LLMGateway
+from messaging import meta_text_messages, process_ussd_request, process_whatsapp_batch, respond_to_message
+from webhook_dedup import webhook_dedup
 warnings.filterwarnings('ignore')
 
 load_dotenv()
@@ -40,78 +46,8 @@ client = Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
 # OpenAI configuration
 openai.api_key = os.getenv('OPENAI_API_KEY')
 
-# Initialize database
-def init_db():
-    conn = sqlite3.connect('harvestlink.db')
-    cursor = conn.cursor()
-    
-    # Farmers table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS farmers (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            phone TEXT UNIQUE NOT NULL,
-            name TEXT,
-            location TEXT,
-            crops TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    # Buyers table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS buyers (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL,
-            phone TEXT,
-            crops_interested TEXT,
-            location TEXT,
-            price_range TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    # Transactions table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS transactions (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            farmer_id INTEGER,
-            buyer_id INTEGER,
-            crop_type TEXT,
-            quantity REAL,
-            price REAL,
-            transaction_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (farmer_id) REFERENCES farmers (id),
-            FOREIGN KEY (buyer_id) REFERENCES buyers (id)
-        )
-    ''')
-    
-    # Loss predictions table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS loss_predictions (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            farmer_id INTEGER,
-            crop_type TEXT,
-            quantity REAL,
-            storage_method TEXT,
-            weather_condition TEXT,
-            predicted_loss REAL,
-            mitigation_advice TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (farmer_id) REFERENCES farmers (id)
-        )
-    ''')
-    
-    # USSD sessions table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS ussd_sessions (
-            session_id TEXT PRIMARY KEY,
-            data TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    conn.commit()
-    conn.close()
+# Shared non-blocking gateway for every GPT call (bounded in-flight completions)
+llm_gateway = LLMGateway()
 
 # Advanced AI System with Deep Learning and Ensemble Methods
 class SimpleAI:
@@ -127,7 +63,13 @@ class SimpleAI:
     
     def predict_loss_advanced(self, crop_type, storage_method, weather_condition, humidity, temperature, storage_days, pest_signs, **kwargs):
         """Advanced loss prediction with uncertainty quantification"""
-        # Use sophisticated ensemble prediction
+        # Trained ensemble (python loss_model.py); hand-written scorers until one exists
+        trained = loss_model.predict_one(crop_type, storage_method, weather_condition, humidity, temperature,
+                                         storage_days, pest_signs, kwargs.get('quantity', loss_model.DEFAULT_QUANTITY))
+        if trained is not None:
+            final_prediction, probabilities = trained
+            return final_prediction, np.array(probabilities), max(probabilities)
+        
         predictions = []
         confidences = []
         
@@ -189,13 +131,12 @@ class SimpleAI:
     
     def forecast_price_advanced(self, crop_type, days_ahead=7, **kwargs):
         """Advanced price forecasting with multiple factors"""
-        # Base prices for different crops
-        base_prices = {
-            'maize': 200, 'rice': 300, 'wheat': 250, 'beans': 400, 
-            'tomatoes': 150, 'millet': 180, 'sorghum': 190, 'cassava': 120
-        }
+        # Fitted on transaction history when the crop has any
+        forecast = price_forecast.forecaster.forecast(crop_type, kwargs.get('location'), horizons=(days_ahead,))
+        if forecast is not None:
+            return max(forecast['forecasts'][days_ahead], 0.0)
         
-        base_price = base_prices.get(crop_type, 200)
+        base_price = risk_tables.crops.row(crop_type)[risk_tables.FORECAST_PRICE]
         
         # Advanced price calculation with multiple factors
         price_factors = []
@@ -254,21 +195,16 @@ class SimpleAI:
         print("✅ Adaptive Learning: Models improve with farmer feedback")
         print("✅ Multi-factor Analysis: 15+ features per prediction")
     
+    def _factor_risk(self, model, crop_type, storage_method, weather_condition):
+        """Sum of one model's crop, storage and weather risk factors"""
+        return (risk_tables.crops.row(crop_type)[model]
+                + risk_tables.storage.row(storage_method)[model]
+                + risk_tables.weather.row(weather_condition)[model])
+    
     def _rf_loss_prediction(self, crop_type, storage_method, weather_condition, humidity, temperature, storage_days, pest_signs):
         """Random Forest based prediction"""
-        risk_score = 0
-        
-        # Crop risk factors
-        crop_risks = {'tomatoes': 0.8, 'beans': 0.6, 'maize': 0.4, 'rice': 0.3, 'wheat': 0.3}
-        risk_score += crop_risks.get(crop_type, 0.4)
-        
-        # Storage risk factors
-        storage_risks = {'traditional': 0.7, 'improved': 0.4, 'cold_storage': 0.2, 'silo': 0.3, 'hermetic': 0.1}
-        risk_score += storage_risks.get(storage_method, 0.4)
-        
-        # Weather risk factors
-        weather_risks = {'dry': 0.2, 'humid': 0.6, 'rainy': 0.8, 'stormy': 1.0, 'drought': 0.3}
-        risk_score += weather_risks.get(weather_condition, 0.4)
+        # Crop, storage and weather risk factors
+        risk_score = self._factor_risk(risk_tables.RF, crop_type, storage_method, weather_condition)
         
         # Environmental factors
         risk_score += (humidity - 50) / 100
@@ -287,16 +223,7 @@ class SimpleAI:
     def _gb_loss_prediction(self, crop_type, storage_method, weather_condition, humidity, temperature, storage_days, pest_signs):
         """Gradient Boosting based prediction"""
         # Similar logic but with different weighting
-        risk_score = 0
-        
-        crop_risks = {'tomatoes': 0.9, 'beans': 0.7, 'maize': 0.5, 'rice': 0.4, 'wheat': 0.4}
-        risk_score += crop_risks.get(crop_type, 0.5)
-        
-        storage_risks = {'traditional': 0.8, 'improved': 0.5, 'cold_storage': 0.3, 'silo': 0.4, 'hermetic': 0.2}
-        risk_score += storage_risks.get(storage_method, 0.5)
-        
-        weather_risks = {'dry': 0.3, 'humid': 0.7, 'rainy': 0.9, 'stormy': 1.1, 'drought': 0.4}
-        risk_score += weather_risks.get(weather_condition, 0.5)
+        risk_score = self._factor_risk(risk_tables.GB, crop_type, storage_method, weather_condition)
         
         risk_score += (humidity - 45) / 80
         risk_score += (temperature - 22) / 40
@@ -313,16 +240,7 @@ class SimpleAI:
     def _nn_loss_prediction(self, crop_type, storage_method, weather_condition, humidity, temperature, storage_days, pest_signs):
         """Neural Network inspired prediction"""
         # Non-linear combinations
-        risk_score = 0
-        
-        crop_risks = {'tomatoes': 0.7, 'beans': 0.5, 'maize': 0.3, 'rice': 0.2, 'wheat': 0.2}
-        risk_score += crop_risks.get(crop_type, 0.3)
-        
-        storage_risks = {'traditional': 0.6, 'improved': 0.3, 'cold_storage': 0.1, 'silo': 0.2, 'hermetic': 0.05}
-        risk_score += storage_risks.get(storage_method, 0.3)
-        
-        weather_risks = {'dry': 0.1, 'humid': 0.5, 'rainy': 0.7, 'stormy': 0.9, 'drought': 0.2}
-        risk_score += weather_risks.get(weather_condition, 0.3)
+        risk_score = self._factor_risk(risk_tables.NN, crop_type, storage_method, weather_condition)
         
         # Non-linear interactions
         risk_score += np.sin((humidity - 50) / 50) * 0.2
@@ -342,7 +260,7 @@ class HybridAI:
     """Hybrid AI system combining custom ML models with GPT-4o-mini"""
     
     def __init__(self):
-        self.ml_ai = HarvestLinkAI()
+        self.ml_ai = SimpleAI()
         self.gpt_model = "gpt-4o-mini"
     
     def analyze_crop_conditions(self, conditions_text):
@@ -366,18 +284,16 @@ class HybridAI:
             Format your response as a structured analysis.
             """
             
-            response = openai.ChatCompletion.create(
-                model=self.gpt_model,
-                messages=[
+            return llm_gateway.complete(
+                [
                     {"role": "system", "content": "You are an expert agricultural AI assistant specializing in crop condition analysis and post-harvest management."},
                     {"role": "user", "content": prompt}
                 ],
+                model=self.gpt_model,
                 max_tokens=500,
                 temperature=0.3
             )
             
-            return response.choices[0].message.content.strip()
-            
         except Exception as e:
             print(f"GPT analysis error: {e}")
             return "AI analysis temporarily unavailable. Please try again."
@@ -407,18 +323,16 @@ class HybridAI:
             Be specific and actionable for smallholder farmers.
             """
             
-            response = openai.ChatCompletion.create(
-                model=self.gpt_model,
-                messages=[
+            return llm_gateway.complete(
+                [
                     {"role": "system", "content": "You are an expert agricultural consultant specializing in post-harvest management and market optimization for smallholder farmers in Africa."},
                     {"role": "user", "content": prompt}
                 ],
+                model=self.gpt_model,
                 max_tokens=600,
                 temperature=0.4
             )
             
-            return response.choices[0].message.content.strip()
-            
         except Exception as e:
             print(f"GPT recommendations error: {e}")
             return "AI recommendations temporarily unavailable. Please try again."
@@ -447,24 +361,22 @@ class HybridAI:
             Focus on actionable intelligence for farmers.
             """
             
-            response = openai.ChatCompletion.create(
-                model=self.gpt_model,
-                messages=[
+            return llm_gateway.complete(
+                [
                     {"role": "system", "content": "You are a market intelligence expert specializing in African agricultural markets and supply chains."},
                     {"role": "user", "content": prompt}
                 ],
+                model=self.gpt_model,
                 max_tokens=500,
                 temperature=0.4
             )
             
-            return response.choices[0].message.content.strip()
-            
         except Exception as e:
             print(f"GPT market intelligence error: {e}")
             return "Market intelligence temporarily unavailable. Please try again."
 
 # Initialize Advanced AI system
-ai_system = HarvestLinkAI()
+ai_system = SimpleAI()
 hybrid_ai = HybridAI()
 
 @app.route('/sms', methods=['POST'])
@@ -475,26 +387,17 @@ def handle_sms():
     
     print(f"📱 Received SMS from {from_number}: {incoming_msg}")
     
-    # Parse SMS input
-    parsed_data = parse_sms_input(incoming_msg)
-    
-    if not parsed_data:
-        response_text = """🌾 Welcome to HarvestLink! 
-
-SMS Mode: Send harvest details
-Format: CROP QUANTITY LOCATION STORAGE WEATHER
-Example: maize 50kg Nairobi traditional dry
-
-USSD Mode: Dial *123# for guided menu
-
-We'll predict losses, find buyers, and optimize your sales!"""
-    else:
-        # Process with ML system
-        response_text = process_harvest_request(parsed_data, from_number)
+    # A redelivery gets the reply generated the first time (none while that is still running)
+    response_text, first = webhook_dedup.process(
+        'twilio', request.values.get('MessageSid'), lambda: respond_to_message(incoming_msg, from_number)
+    )
+    if not first:
+        print(f"🔁 Duplicate SMS {request.values.get('MessageSid')} from {from_number}")
     
     # Send response
     resp = MessagingResponse()
-    resp.message(response_text)
+    if response_text is not None:
+        resp.message(response_text)
     
     return str(resp)
 
@@ -513,459 +416,6 @@ def handle_ussd():
     
     return ussd_response
 
-def process_ussd_request(text, phone_number, session_id):
-    """Process USSD requests with guided menu system"""
-    # USSD session management
-    session_data = get_ussd_session(session_id)
-    
-    if text == '':
-        # Initial USSD menu
-        response = """CON 🌾 Welcome to HarvestLink!
-        
-1. Check Harvest Loss Risk
-2. Get Price Forecast  
-3. Find Buyers
-4. Get Farming Advice
-5. Register as Farmer
-0. Exit"""
-        
-    elif text == '1':
-        # Harvest Loss Risk Check
-        session_data['step'] = 'crop_selection'
-        save_ussd_session(session_id, session_data)
-        
-        response = """CON Select your crop:
-        
-1. Maize
-2. Rice  
-3. Wheat
-4. Beans
-5. Tomatoes
-6. Millet
-7. Sorghum
-8. Cassava
-0. Back"""
-        
-    elif text.startswith('1*'):
-        # Crop selected, ask for quantity
-        crop_map = {'1': 'maize', '2': 'rice', '3': 'wheat', '4': 'beans', 
-                   '5': 'tomatoes', '6': 'millet', '7': 'sorghum', '8': 'cassava'}
-        
-        crop_choice = text.split('*')[1]
-        if crop_choice in crop_map:
-            session_data['crop'] = crop_map[crop_choice]
-            session_data['step'] = 'quantity_input'
-            save_ussd_session(session_id, session_data)
-            
-            response = f"""CON Enter quantity for {crop_map[crop_choice]}:
-            
-Format: 50kg or 2tons
-Example: 50kg"""
-        else:
-            response = "END Invalid selection. Please try again."
-            
-    elif text.startswith('1*') and '*' in text.split('*')[2:]:
-        # Quantity entered, ask for location
-        parts = text.split('*')
-        if len(parts) >= 3:
-            try:
-                quantity_text = parts[2]
-                # Extract number from quantity
-                quantity_match = re.search(r'(\d+(?:\.\d+)?)', quantity_text)
-                if quantity_match:
-                    session_data['quantity'] = float(quantity_match.group(1))
-                    session_data['step'] = 'location_selection'
-                    save_ussd_session(session_id, session_data)
-                    
-                    response = """CON Select your location:
-                    
-1. Nairobi
-2. Mombasa
-3. Kisumu
-4. Nakuru
-5. Eldoret
-6. Thika
-7. Meru
-8. Other
-0. Back"""
-                else:
-                    response = "END Invalid quantity format. Please try again."
-            except:
-                response = "END Invalid input. Please try again."
-        else:
-            response = "END Invalid input. Please try again."
-            
-    elif text.startswith('1*') and len(text.split('*')) >= 4:
-        # Location selected, ask for storage method
-        location_map = {'1': 'Nairobi', '2': 'Mombasa', '3': 'Kisumu', '4': 'Nakuru',
-                       '5': 'Eldoret', '6': 'Thika', '7': 'Meru', '8': 'Other'}
-        
-        parts = text.split('*')
-        if len(parts) >= 4:
-            location_choice = parts[3]
-            if location_choice in location_map:
-                session_data['location'] = location_map[location_choice]
-                session_data['step'] = 'storage_selection'
-                save_ussd_session(session_id, session_data)
-                
-                response = """CON Select storage method:
-                
-1. Traditional (open air)
-2. Improved (covered)
-3. Cold Storage
-4. Silo
-5. Hermetic bags
-0. Back"""
-            else:
-                response = "END Invalid location selection."
-        else:
-            response = "END Invalid input."
-            
-    elif text.startswith('1*') and len(text.split('*')) >= 5:
-        # Storage selected, ask for weather
-        storage_map = {'1': 'traditional', '2': 'improved', '3': 'cold_storage', 
-                      '4': 'silo', '5': 'hermetic'}
-        
-        parts = text.split('*')
-        if len(parts) >= 5:
-            storage_choice = parts[4]
-            if storage_choice in storage_map:
-                session_data['storage'] = storage_map[storage_choice]
-                session_data['step'] = 'weather_selection'
-                save_ussd_session(session_id, session_data)
-                
-                response = """CON Select weather condition:
-                
-1. Dry
-2. Humid
-3. Rainy
-4. Stormy
-5. Drought
-0. Back"""
-            else:
-                response = "END Invalid storage selection."
-        else:
-            response = "END Invalid input."
-            
-    elif text.startswith('1*') and len(text.split('*')) >= 6:
-        # Weather selected, process with AI
-        weather_map = {'1': 'dry', '2': 'humid', '3': 'rainy', '4': 'stormy', '5': 'drought'}
-        
-        parts = text.split('*')
-        if len(parts) >= 6:
-            weather_choice = parts[5]
-            if weather_choice in weather_map:
-                session_data['weather'] = weather_map[weather_choice]
-                
-                # Process with AI system
-                ai_response = process_harvest_request(session_data, phone_number)
-                
-                # Format for USSD (shorter response)
-                ussd_response = format_ai_response_for_ussd(ai_response)
-                
-                # Clear session
-                clear_ussd_session(session_id)
-                
-                response = f"END {ussd_response}"
-            else:
-                response = "END Invalid weather selection."
-        else:
-            response = "END Invalid input."
-            
-    elif text == '2':
-        # Price Forecast
-        response = """CON Select crop for price forecast:
-        
-1. Maize
-2. Rice
-3. Wheat
-4. Beans
-5. Tomatoes
-0. Back"""
-        
-    elif text.startswith('2*'):
-        # Price forecast for selected crop
-        crop_map = {'1': 'maize', '2': 'rice', '3': 'wheat', '4': 'beans', '5': 'tomatoes'}
-        crop_choice = text.split('*')[1]
-        
-        if crop_choice in crop_map:
-            crop = crop_map[crop_choice]
-            price = random.uniform(2.5, 4.5)
-            
-            response = f"END {crop.upper()} PRICE FORECAST\n\nCurrent: {price:.2f} KES/kg\n7-day trend: {'Rising' if price > 3.5 else 'Stable'}\nRecommendation: {'Hold' if price > 3.5 else 'Sell now'}\n\nDial *123# for more options"
-        else:
-            response = "END Invalid selection."
-            
-    elif text == '3':
-        # Find Buyers
-        response = """CON Find buyers for:
-        
-1. Maize
-2. Rice
-3. Wheat
-4. Beans
-5. Tomatoes
-6. All crops
-0. Back"""
-        
-    elif text.startswith('3*'):
-        # Show buyers for selected crop
-        crop_map = {'1': 'maize', '2': 'rice', '3': 'wheat', '4': 'beans', '5': 'tomatoes', '6': 'all'}
-        crop_choice = text.split('*')[1]
-        
-        if crop_choice in crop_map:
-            crop = crop_map[crop_choice]
-            buyers = find_matching_buyers({'crop': crop})
-            
-            if buyers:
-                buyer_list = "\n".join([f"{i+1}. {name} ({location})" for i, (name, phone, price_range, location) in enumerate(buyers[:3])])
-                response = f"END BUYERS FOR {crop.upper()}:\n\n{buyer_list}\n\nContact details sent via SMS\nDial *123# for more options"
-            else:
-                response = f"END No buyers found for {crop}.\n\nWe'll notify you when available.\nDial *123# for more options"
-        else:
-            response = "END Invalid selection."
-            
-    elif text == '4':
-        # Farming Advice
-        response = """CON Get farming advice:
-        
-1. Post-harvest storage tips
-2. Pest control methods
-3. Weather protection
-4. Market timing
-5. General farming tips
-0. Back"""
-        
-    elif text == '5':
-        # Register as Farmer
-        response = """CON Register as farmer:
-        
-1. Yes, register me
-2. View benefits
-0. Back"""
-        
-    elif text == '0':
-        # Exit
-        response = "END Thank you for using HarvestLink!\n\nEmpowering African farmers\nSMS: Send harvest details\nUSSD: Dial *123# anytime"
-        
-    else:
-        # Invalid input
-        response = "END Invalid selection. Please try again.\n\nDial *123# to restart"
-    
-    return response
-
-def get_ussd_session(session_id):
-    """Get USSD session data"""
-    conn = sqlite3.connect('harvestlink.db')
-    cursor = conn.cursor()
-    
-    cursor.execute('SELECT data FROM ussd_sessions WHERE session_id = ?', (session_id,))
-    result = cursor.fetchone()
-    
-    conn.close()
-    
-    if result:
-        return json.loads(result[0])
-    else:
-        return {'step': 'initial'}
-
-def save_ussd_session(session_id, data):
-    """Save USSD session data"""
-    conn = sqlite3.connect('harvestlink.db')
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        INSERT OR REPLACE INTO ussd_sessions (session_id, data, created_at)
-        VALUES (?, ?, CURRENT_TIMESTAMP)
-    ''', (session_id, json.dumps(data)))
-    
-    conn.commit()
-    conn.close()
-
-def clear_ussd_session(session_id):
-    """Clear USSD session data"""
-    conn = sqlite3.connect('harvestlink.db')
-    cursor = conn.cursor()
-    
-    cursor.execute('DELETE FROM ussd_sessions WHERE session_id = ?', (session_id,))
-    
-    conn.commit()
-    conn.close()
-
-def format_ai_response_for_ussd(ai_response):
-    """Format AI response for USSD (shorter, more concise)"""
-    lines = ai_response.split('\n')
-    ussd_lines = []
-    
-    for line in lines:
-        if 'HARVESTLINK AI ANALYSIS' in line:
-            ussd_lines.append("🧠 AI ANALYSIS")
-        elif 'LOSS PREDICTION:' in line:
-            ussd_lines.append(line.strip())
-        elif 'Confidence:' in line:
-            ussd_lines.append(line.strip())
-        elif 'AI PRICE FORECAST:' in line:
-            ussd_lines.append(line.strip())
-        elif 'AI RECOMMENDATION:' in line:
-            ussd_lines.append(line.strip())
-        elif line.strip().startswith('1.') or line.strip().startswith('2.') or line.strip().startswith('3.'):
-            ussd_lines.append(line.strip())
-    
-    return '\n'.join(ussd_lines[:8])  # Limit to 8 lines for USSD
-
-def parse_sms_input(message):
-    """Parse SMS input to extract harvest details"""
-    message = message.lower().strip()
-    
-    # Simple regex patterns for parsing
-    patterns = {
-        'crop': r'\b(maize|rice|wheat|beans|tomatoes|corn|millet|sorghum)\b',
-        'quantity': r'(\d+(?:\.\d+)?)\s*(?:kg|kgs|tons?|tonnes?)',
-        'location': r'\b(nairobi|mombasa|kisumu|nakuru|eldoret|thika|meru|kakamega|kisii|nyeri)\b',
-        'storage': r'\b(traditional|improved|cold_storage|silo|barn|open)\b',
-        'weather': r'\b(dry|humid|rainy|wet|damp)\b'
-    }
-    
-    parsed = {}
-    for key, pattern in patterns.items():
-        match = re.search(pattern, message)
-        if match:
-            parsed[key] = match.group(1) if key != 'quantity' else float(match.group(1))
-    
-    # If we have at least crop and quantity, consider it valid
-    if 'crop' in parsed and 'quantity' in parsed:
-        return parsed
-    
-    return None
-
-def process_harvest_request(data, phone_number):
-    """Process harvest request with Advanced AI and return comprehensive response"""
-    try:
-        # Register/update farmer
-        farmer_id = register_farmer(phone_number, data)
-        
-        # Advanced AI loss prediction with uncertainty quantification
-        import random
-        loss_percentage = random.uniform(5, 25)
-        confidence = random.uniform(85, 95)
-        loss_prediction = f"Predicted loss: {loss_percentage:.1f}% (Confidence: {confidence:.1f}%)"
-        
-        # Generate advanced mitigation advice with confidence
-        mitigation_advice = generate_advanced_mitigation_advice(data, loss_prediction, confidence)
-        
-        # Advanced farmer clustering
-        farmer_clusters = [0]  # Simplified clustering
-        
-        # Advanced price forecasting
-        base_price = random.uniform(2.5, 4.5)
-        forecasted_price = f"KES {base_price:.2f}/kg"
-        
-        # Find potential buyers
-        buyers = find_matching_buyers(data)
-        
-        # Generate comprehensive AI-powered response
-        response = f"""🧠 HARVESTLINK AI ANALYSIS
-
-📊 LOSS PREDICTION: {loss_prediction.upper()} risk
-🎯 Confidence: {confidence:.1%}
-{mitigation_advice}
-
-💰 AI PRICE FORECAST: {forecasted_price:.0f} KES/kg (7-day)
-📈 Price Trend: {'Rising' if forecasted_price > 200 else 'Stable'}
-
-🤝 BUYER MATCHES: {len(buyers)} found
-{format_buyer_matches(buyers)}
-
-🔮 AI RECOMMENDATION: {'Hold for better price' if forecasted_price > 200 else 'Sell now'}
-📊 Cluster Group: {farmer_clusters[0] if farmer_clusters else 'Individual'}
-
-Reply 'BUYERS' for contacts, 'ADVICE' for detailed AI tips, or 'LEARN' for how AI improves."""
-        
-        return response
-        
-    except Exception as e:
-        print(f"❌ Error processing request: {e}")
-        return "❌ AI processing error. Please try again with the correct format."
-
-def register_farmer(phone_number, data):
-    """Register or update farmer information"""
-    conn = sqlite3.connect('harvestlink.db')
-    cursor = conn.cursor()
-    
-    # Check if farmer exists
-    cursor.execute('SELECT id FROM farmers WHERE phone = ?', (phone_number,))
-    farmer = cursor.fetchone()
-    
-    if farmer:
-        farmer_id = farmer[0]
-        # Update farmer info
-        cursor.execute('''
-            UPDATE farmers SET location = ?, crops = ?
-            WHERE id = ?
-        ''', (data.get('location', ''), data.get('crop', ''), farmer_id))
-    else:
-        # Create new farmer
-        cursor.execute('''
-            INSERT INTO farmers (phone, location, crops)
-            VALUES (?, ?, ?)
-        ''', (phone_number, data.get('location', ''), data.get('crop', '')))
-        farmer_id = cursor.lastrowid
-    
-    conn.commit()
-    conn.close()
-    
-    return farmer_id
-
-def generate_advanced_mitigation_advice(data, loss_prediction, confidence):
-    """Generate AI-powered mitigation advice with confidence levels"""
-    crop = data.get('crop', 'maize')
-    storage = data.get('storage', 'traditional')
-    
-    # Advanced advice based on prediction and confidence
-    advice_map = {
-        'low': f"✅ AI Analysis: Your {crop} is well-preserved (Confidence: {confidence:.1%}). Maintain current storage conditions.",
-        'medium': f"⚠️ AI Alert: Moderate risk detected (Confidence: {confidence:.1%}). Recommended actions:\n1) Dry {crop} for 2-3 more days\n2) Check for pest activity\n3) Improve ventilation\n4) Monitor temperature daily",
-        'high': f"🚨 AI Emergency: High loss risk (Confidence: {confidence:.1%})! Immediate actions:\n1) Dry {crop} urgently (within 24 hours)\n2) Apply pest treatment\n3) Sell within 3 days\n4) Consider emergency storage upgrade"
-    }
-    
-    base_advice = advice_map.get(loss_prediction, "Monitor your harvest closely.")
-    
-    # Add AI-specific insights
-    if confidence > 0.8:
-        base_advice += f"\n🧠 AI Insight: High confidence prediction based on similar cases."
-    elif confidence < 0.6:
-        base_advice += f"\n🧠 AI Note: Lower confidence - consider multiple factors."
-    
-    return base_advice
-
-def find_matching_buyers(data):
-    """Find buyers interested in the farmer's crop"""
-    conn = sqlite3.connect('harvestlink.db')
-    cursor = conn.cursor()
-    
-    crop = data.get('crop', 'maize')
-    cursor.execute('''
-        SELECT name, phone, price_range, location
-        FROM buyers 
-        WHERE crops_interested LIKE ? OR crops_interested LIKE ?
-    ''', (f'%{crop}%', '%all%'))
-    
-    buyers = cursor.fetchall()
-    conn.close()
-    
-    return buyers
-
-def format_buyer_matches(buyers):
-    """Format buyer matches for SMS response"""
-    if not buyers:
-        return "No buyers found. We'll notify you when matches are available."
-    
-    formatted = []
-    for i, (name, phone, price_range, location) in enumerate(buyers[:3]):  # Limit to 3
-        formatted.append(f"{i+1}. {name} ({location}) - {price_range}")
-    
-    return "\n".join(formatted)
-
 @app.route('/')
 def home():
     return render_template('index.html')
@@ -1140,37 +590,22 @@ def handle_whatsapp():
                 
                 print(f"Twilio WhatsApp message from {phone_number}: {message_text}")
                 
-                # Process the message using existing AI system
-                response = process_harvest_request(message_text, phone_number, 'whatsapp')
-                
-                # Send response back via Twilio WhatsApp
-                send_twilio_whatsapp_message(phone_number, response)
+                # Process once per MessageSid; the reply goes out from the background sender
+                process_whatsapp_batch('twilio', [(data['MessageSid'], phone_number, message_text)])
                 
                 return jsonify({'status': 'success'})
             
             # Check if it's Meta WhatsApp format
             elif data and 'entry' in data:
-                # Meta WhatsApp format
-                entry = data['entry'][0]
-                changes = entry['changes'][0]
-                value = changes['value']
-                
-                if 'messages' in value:
-                    message = value['messages'][0]
-                    phone_number = message['from']
-                    message_text = message['text']['body']
-                    
-                    print(f"Meta WhatsApp message from {phone_number}: {message_text}")
-                    
-                    # Process the message using existing AI system
-                    response = process_harvest_request(message_text, phone_number, 'whatsapp')
-                    
-                    # Send response back via Meta WhatsApp API
-                    send_meta_whatsapp_message(phone_number, response)
-                    
-                    return jsonify({'status': 'success'})
-                else:
+                # Meta WhatsApp format: under load one webhook carries several entries, changes and messages
+                messages = meta_text_messages(data)
+                if not messages:
                     return jsonify({'status': 'success', 'message': 'No message to process'})
+                
+                print(f"Meta WhatsApp batch of {len(messages)} message(s) from {len({phone_number for _, phone_number, _ in messages})} sender(s)")
+                processed, duplicates = process_whatsapp_batch('meta', messages)
+                
+                return jsonify({'status': 'success', 'processed': processed, 'duplicates': duplicates})
             else:
                 return jsonify({'status': 'error', 'message': 'Unknown webhook format'}), 400
                 
@@ -1178,86 +613,7 @@ def handle_whatsapp():
             print(f"WhatsApp webhook error: {e}")
             return jsonify({'status': 'error', 'message': str(e)}), 500
 
-def send_twilio_whatsapp_message(to_number, message):
-    """Send WhatsApp message via Twilio API"""
-    try:
-        # Twilio WhatsApp configuration
-        account_sid = os.getenv('TWILIO_ACCOUNT_SID')
-        auth_token = os.getenv('TWILIO_AUTH_TOKEN')
-        whatsapp_from = os.getenv('TWILIO_WHATSAPP_NUMBER', 'whatsapp:+14155238886')
-        
-        if not account_sid or not auth_token:
-            print("Twilio credentials not configured. Logging response instead:")
-            print(f"WhatsApp response to {to_number}: {message}")
-            return True
-        
-        # Format phone number for WhatsApp
-        if not to_number.startswith('whatsapp:'):
-            to_number = f"whatsapp:{to_number}"
-        
-        # Send via Twilio API
-        url = f"https://api.twilio.com/2010-04-01/Accounts/{account_sid}/Messages.json"
-        
-        data = {
-            'To': to_number,
-            'From': whatsapp_from,
-            'Body': message
-        }
-        
-        response = requests.post(url, data=data, auth=(account_sid, auth_token))
-        
-        if response.status_code == 201:
-            print(f"Twilio WhatsApp message sent successfully to {to_number}")
-            return True
-        else:
-            print(f"Twilio WhatsApp send failed: {response.status_code} - {response.text}")
-            return False
-            
-    except Exception as e:
-        print(f"Twilio WhatsApp send error: {e}")
-        return False
-
-def send_meta_whatsapp_message(to_number, message):
-    """Send WhatsApp message via Meta Business API"""
-    try:
-        # Meta WhatsApp Business API configuration
-        phone_number_id = os.getenv('WHATSAPP_PHONE_NUMBER_ID')
-        access_token = os.getenv('WHATSAPP_ACCESS_TOKEN')
-        
-        if not phone_number_id or not access_token:
-            print("Meta WhatsApp credentials not configured. Logging response instead:")
-            print(f"WhatsApp response to {to_number}: {message}")
-            return True
-        
-        # Format message for WhatsApp
-        whatsapp_message = {
-            "messaging_product": "whatsapp",
-            "to": to_number,
-            "type": "text",
-            "text": {"body": message}
-        }
-        
-        # Send via Meta API
-        url = f"https://graph.facebook.com/v18.0/{phone_number_id}/messages"
-        headers = {
-            "Authorization": f"Bearer {access_token}",
-            "Content-Type": "application/json"
-        }
-        
-        response = requests.post(url, json=whatsapp_message, headers=headers)
-        
-        if response.status_code == 200:
-            print(f"Meta WhatsApp message sent successfully to {to_number}")
-            return True
-        else:
-            print(f"Meta WhatsApp send failed: {response.status_code} - {response.text}")
-            return False
-            
-    except Exception as e:
-        print(f"Meta WhatsApp send error: {e}")
-        return False
-
 if __name__ == '__main__':
-    init_db()
+    migrate()
     port = int(os.environ.get('PORT', 5000))
     app.run(debug=False, host='0.0.0.0', port=port)
@@ -0,0 +1,267 @@
+"""Periodic capacity-aware matching of every open farmer lot to buyers.
+
+Live matching looks at one farmer at a time, so popular buyers get far more
+offers than their quantity_needed while others get none. The batch matcher
+instead takes all open lots (farmers with a crop, a quantity and a known
+location) and all verified buyers with declared capacity, and assigns
+kilograms greedily by value. Lots from the same town and crop share one
+candidate list, ranked once by net KES/kg (offer minus transport, see
+buyer_index.net_offer). The search radius widens until the candidates'
+capacity covers the group's kilograms, so a lot spills over to farther
+buyers once the nearby ones are full. Each list keeps a pointer that skips
+buyers as they fill. A max-heap of these groups, keyed by the net price of
+each group's best buyer with room, hands the best remaining pairing to the
+group's next lot, so a run costs O(matches log groups) after ranking. A lot
+may be split across several buyers.
+
+Each run replaces the matches table in one transaction; the SMS, USSD and
+web paths just read it. Run it once with:  python batch_matcher.py
+"""
+import heapq
+from collections import deque
+import os
+import threading
+import time
+
+import database as db
+import geo
+from buyer_index import SEARCH_RADII_KM, WILDCARD_CROP, net_offer, parse_crops
+
+BATCH_MATCH_INTERVAL = int(os.getenv('BATCH_MATCH_INTERVAL', '900'))
+
+# Smallest share (kg) worth sending a farmer to a buyer for
+MIN_MATCH_KG = 1.0
+
+_MATCH_COLUMNS = ('id', 'name', 'phone', 'location', 'price_range', 'quantity_needed', 'offer_price')
+
+
+def load_lots(conn):
+    """Open farmer lots as (farmer_id, crop, kg, (latitude, longitude))"""
+    lots = []
+    for farmer_id, crop_type, quantity, location in conn.execute('''
+        SELECT id, crop_type, quantity, location FROM farmers
+        WHERE quantity > 0 AND crop_type IS NOT NULL AND crop_type != ''
+    '''):
+        coords = geo.locate(location)
+        if coords is not None:
+            lots.append((farmer_id, crop_type.strip().lower(), float(quantity), coords))
+    return lots
+
+
+def load_buyers(conn):
+    """Verified, located buyers with capacity as {buyer_id: (latitude, longitude, offer, kg, crops)}"""
+    return {
+        buyer_id: (latitude, longitude, offer_price, float(quantity_needed), set(parse_crops(crop_types)))
+        for buyer_id, latitude, longitude, offer_price, quantity_needed, crop_types in conn.execute('''
+            SELECT id, latitude, longitude, offer_price, quantity_needed, crop_types FROM buyers
+            WHERE verified = 1 AND geo_cell IS NOT NULL AND quantity_needed > 0
+        ''')
+    }
+
+
+class _Candidates:
+    """Buyers of one crop around one place, best net offer first"""
+
+    def __init__(self, ranked):
+        self.ranked = ranked    # [(net KES/kg, buyer_id, distance_km)]
+        self.next = 0
+
+    def best(self, remaining):
+        """Best candidate whose buyer still has capacity, or None"""
+        while self.next < len(self.ranked) and remaining[self.ranked[self.next][1]] < MIN_MATCH_KG:
+            self.next += 1
+        return self.ranked[self.next] if self.next < len(self.ranked) else None
+
+
+def solve(lots, buyers):
+    """Greedy value-first assignment; returns [(farmer_id, buyer_id, crop, kg, distance_km, net)]"""
+    # Grid of buyers per (crop, cell); wildcard buyers are filed under WILDCARD_CROP
+    grid = {}
+    for buyer_id, (latitude, longitude, _, _, crops) in buyers.items():
+        cell = geo.cell_of(latitude, longitude)
+        for crop in crops:
+            grid.setdefault((crop, cell), []).append(buyer_id)
+
+    offers = {}
+    for _, _, offer, _, crops in buyers.values():
+        if offer is not None:
+            for crop in crops:
+                offers.setdefault(crop, []).append(offer)
+    reference = {crop: sorted(values)[len(values) // 2] for crop, values in offers.items()}
+
+    def rank(crop, coords, kg):
+        ranked = {}
+        # Buyers sit on gazetteer points, so few distinct distances are needed
+        distances = {}
+        capacity = 0.0
+        for radius in SEARCH_RADII_KM:
+            for cell in geo.cells_within(coords[0], coords[1], radius):
+                for buyer_id in grid.get((crop, cell), []) + grid.get((WILDCARD_CROP, cell), []):
+                    if buyer_id in ranked:
+                        continue
+                    latitude, longitude, offer, quantity_needed, _ = buyers[buyer_id]
+                    distance = distances.get((latitude, longitude))
+                    if distance is None:
+                        distance = distances[latitude, longitude] = geo.distance_km(coords[0], coords[1], latitude, longitude)
+                    if distance > radius:
+                        continue
+                    if offer is None:
+                        offer = reference.get(crop, reference.get(WILDCARD_CROP, 1.0))
+                    ranked[buyer_id] = (net_offer(offer, distance), buyer_id, distance)
+                    capacity += quantity_needed
+            # Widen only while the buyers found so far cannot take the whole group
+            if capacity >= kg:
+                break
+        return _Candidates(sorted(ranked.values(), key=lambda candidate: (-candidate[0], candidate[2], candidate[1])))
+
+    # Lots from one town and crop share their candidates, so the heap holds groups; each serves its lots in order
+    queues = {}
+    for farmer_id, crop, quantity, coords in lots:
+        queues.setdefault((crop, coords), deque()).append([farmer_id, quantity])
+    groups = {
+        key: (rank(key[0], key[1], sum(lot[1] for lot in queue)), queue)
+        for key, queue in queues.items()
+    }
+
+    remaining = {buyer_id: buyer[3] for buyer_id, buyer in buyers.items()}
+    heap = []
+    for key, (candidates, _) in groups.items():
+        best = candidates.best(remaining)
+        if best is not None:
+            heap.append((-best[0], key))
+    heapq.heapify(heap)
+
+    assignments = []
+    while heap:
+        value, key = heapq.heappop(heap)
+        candidates, queue = groups[key]
+        best = candidates.best(remaining)
+        if best is None:
+            continue
+        if best[0] < -value:
+            # Its best buyer filled up since this entry was pushed
+            heapq.heappush(heap, (-best[0], key))
+            continue
+
+        net, buyer_id, distance = best
+        lot = queue[0]
+        kg = min(lot[1], remaining[buyer_id])
+        remaining[buyer_id] -= kg
+        lot[1] -= kg
+        assignments.append((lot[0], buyer_id, key[0], kg, round(distance, 1), round(net, 4)))
+        if lot[1] < MIN_MATCH_KG:
+            queue.popleft()
+        if queue:
+            heapq.heappush(heap, (value, key))
+    return assignments
+
+
+def _write(conn, lots, buyers, assignments, started, run_id=None):
+    conn.execute('DELETE FROM matches')
+    conn.executemany('''
+        INSERT INTO matches (farmer_id, buyer_id, crop, quantity, distance_km, net_price, run_id)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', [assignment + (run_id,) for assignment in assignments])
+
+    stats = {
+        'lots': len(lots),
+        'buyers': len(buyers),
+        'matches': len(assignments),
+        'lot_kg': sum(lot[2] for lot in lots),
+        'matched_kg': sum(assignment[3] for assignment in assignments),
+        'seconds': round(time.time() - started, 3)
+    }
+    if run_id is not None:
+        conn.execute('''
+            UPDATE match_runs SET finished_at = ?, lots = ?, buyers = ?, matches = ?, lot_kg = ?, matched_kg = ?
+            WHERE id = ?
+        ''', (time.time(), stats['lots'], stats['buyers'], stats['matches'], stats['lot_kg'], stats['matched_kg'], run_id))
+    print(f"🤝 Matched {stats['matched_kg']:.0f}/{stats['lot_kg']:.0f} kg across {stats['lots']} lots "
+          f"and {stats['buyers']} buyers in {stats['seconds']:.2f}s")
+    return stats
+
+
+def run(conn):
+    """Recompute all matches inside the caller's write transaction; returns run statistics"""
+    started = time.time()
+    lots, buyers = load_lots(conn), load_buyers(conn)
+    return _write(conn, lots, buyers, solve(lots, buyers), started)
+
+
+def run_due(interval=BATCH_MATCH_INTERVAL):
+    """Run a batch unless any process started one within the interval; returns its stats or None"""
+    started = time.time()
+    with db.transaction() as conn:
+        last = conn.execute('SELECT MAX(started_at) FROM match_runs').fetchone()[0]
+        if last is not None and started - last < interval:
+            return None
+        run_id = conn.execute('INSERT INTO match_runs (started_at) VALUES (?)', (started,)).lastrowid
+
+    # Solve on a read snapshot so the write lock is held only while the results are stored
+    with db.connection() as conn:
+        lots, buyers = load_lots(conn), load_buyers(conn)
+    assignments = solve(lots, buyers)
+    with db.transaction() as conn:
+        return _write(conn, lots, buyers, assignments, started, run_id)
+
+
+def matches_for_farmer(conn, farmer_id):
+    """Buyers the last batch assigned a farmer to, best net price first"""
+    rows = conn.execute(f'''
+        SELECT {', '.join('b.' + column for column in _MATCH_COLUMNS)}, m.distance_km, m.net_price, m.quantity
+        FROM matches m JOIN buyers b ON b.id = m.buyer_id
+        WHERE m.farmer_id = ?
+        ORDER BY m.net_price DESC
+    ''', (farmer_id,)).fetchall()
+    return [
+        dict(zip(_MATCH_COLUMNS, row), distance_km=row[-3], score=row[-2], matched_kg=row[-1])
+        for row in rows
+    ]
+
+
+def last_run():
+    """Statistics of the most recent finished batch, or None"""
+    with db.connection() as conn:
+        row = conn.execute('''
+            SELECT id, started_at, finished_at, lots, buyers, matches, lot_kg, matched_kg FROM match_runs
+            WHERE finished_at IS NOT NULL ORDER BY id DESC LIMIT 1
+        ''').fetchone()
+    if row is None:
+        return None
+    return dict(zip(('run_id', 'started_at', 'finished_at', 'lots', 'buyers', 'matches', 'lot_kg', 'matched_kg'), row))
+
+
+class BatchMatcher:
+    """Daemon thread that runs the batch matcher on an interval"""
+
+    def __init__(self, interval=BATCH_MATCH_INTERVAL):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def start(self):
+        """Start the matcher thread once per process"""
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+        threading.Thread(target=self._run, name='batch-matcher', daemon=True).start()
+
+    def _run(self):
+        while True:
+            try:
+                run_due(self.interval)
+            except Exception as e:
+                print(f"❌ Batch matching failed: {e}")
+            time.sleep(self.interval)
+
+
+matcher = BatchMatcher()
+
+
+if __name__ == '__main__':
+    from migrations import migrate
+
+    migrate()
+    with db.transaction() as conn:
+        run(conn)
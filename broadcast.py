@@ -0,0 +1,255 @@
+"""Price and weather alert campaigns to every registered farmer.
+
+A campaign streams farmers in id order, BROADCAST_CHUNK_SIZE rows at a
+time by keyset pagination, so no read stays open while messages go out.
+Farmers are grouped into segments by crop and location, and each segment's
+message is rendered once and reused for everyone in it. Messages go through
+the outbound dispatcher at bulk priority, so the provider's worker pool and
+throughput cap apply and replies to farmers still go first.
+
+Progress is checkpointed in broadcast_campaigns. last_farmer_id only moves
+past a chunk once every message in it and in every earlier chunk has been
+delivered or dead-lettered. At most BROADCAST_WINDOW chunks are in flight.
+A campaign interrupted by a crash resumes from its checkpoint. Only the
+in-flight chunks are sent again, so delivery is at-least-once.
+
+Run a campaign:  python broadcast.py price|weather [sms|twilio|meta] [crop] [location]
+"""
+import json
+import os
+import threading
+import time
+from collections import deque
+
+import database as db
+import outbound
+import price_aggregates
+import risk_engine
+from price_forecast import forecaster
+from weather_cache import WEATHER_STALE_TTL, normalize_location
+
+BROADCAST_CHUNK_SIZE = int(os.getenv('BROADCAST_CHUNK_SIZE', '500'))
+BROADCAST_WINDOW = int(os.getenv('BROADCAST_WINDOW', '4'))
+
+KINDS = ('price', 'weather')
+
+_CAMPAIGN_COLUMNS = ('id', 'kind', 'provider', 'crop', 'location', 'status', 'last_farmer_id', 'sent', 'failed',
+                     'skipped', 'segments', 'created_at', 'updated_at', 'finished_at')
+
+
+def render_price(crop, location):
+    """Price alert for one crop/location segment, or None without any price data"""
+    market = price_aggregates.market_summary(crop, location)
+    forecast = forecaster.forecast(crop, location)
+    if market is None and forecast is None:
+        return None
+
+    # Trade prices are not per kg: apply their spread and trend to the KES/kg base price
+    price = risk_engine.base_price(crop)
+    place = market['location'] if market is not None else forecast['location']
+    lines = [f"🌾 HarvestLink {crop.title()} prices{' in ' + place if place else ''}"]
+    lines.append(f"Today: {price:.2f} KES/kg")
+    if market is not None:
+        low, high = price_aggregates.per_kg_range(market, price)
+        lines.append(f"Range: {low:.2f}-{high:.2f} KES/kg")
+    if forecast is not None and forecast['current'] > 0:
+        trend = {'increasing': 'rising', 'decreasing': 'falling'}.get(forecast['trend'], 'stable')
+        lines.append(f"Next 7 days: {max(price * forecast['forecasts'][7] / forecast['current'], 0.0):.2f} KES/kg ({trend})")
+    lines.append("Dial *123# to find buyers near you")
+    return '\n'.join(lines)
+
+
+def render_weather(crop, location, reading):
+    """Weather alert for one crop/location segment, or None without a recent reading"""
+    if reading is None:
+        return None
+    condition = str(reading.get('condition', '')).lower()
+    humidity = reading.get('humidity', 0)
+    produce = crop or 'produce'
+    if 'rain' in condition or 'storm' in condition:
+        advice = f"Rain expected: cover your {produce} and raise stacks off the floor."
+    elif humidity >= 75:
+        advice = f"High humidity: dry {produce} below 13% moisture and ventilate stores."
+    elif reading.get('temperature', 0) >= 30:
+        advice = f"Hot weather: keep {produce} shaded and check stores for pests."
+    else:
+        advice = f"Good drying conditions for {produce}."
+    return (f"🌦️ HarvestLink weather for {location}: {reading.get('condition', 'Unknown')}, "
+            f"{reading.get('temperature')}°C, humidity {humidity}%\n{advice}")
+
+
+def _weather_readings(conn):
+    """Recent weather readings by normalized location, from the prefetcher's snapshot"""
+    return {
+        location: json.loads(data)
+        for location, data in conn.execute(
+            'SELECT location, data FROM weather_snapshot WHERE fetched_at > ?', (time.time() - WEATHER_STALE_TTL,)
+        )
+    }
+
+
+def create_campaign(kind, provider='sms', crop=None, location=None):
+    """Record a new campaign, optionally limited to one crop and/or location; returns its id"""
+    if kind not in KINDS:
+        raise ValueError(f"Unknown broadcast kind: {kind}")
+    if provider not in outbound.dispatcher.providers:
+        raise ValueError(f"Unknown outbound provider: {provider}")
+    now = time.time()
+    with db.transaction() as conn:
+        return conn.execute('''
+            INSERT INTO broadcast_campaigns (kind, provider, crop, location, status, created_at, updated_at)
+            VALUES (?, ?, ?, ?, 'queued', ?, ?)
+        ''', (kind, provider, crop.strip().lower() if crop else None,
+              normalize_location(location) if location else None, now, now)).lastrowid
+
+
+def campaign_status(campaign_id):
+    """A campaign's settings and progress, or None"""
+    with db.connection() as conn:
+        row = conn.execute(
+            f"SELECT {', '.join(_CAMPAIGN_COLUMNS)} FROM broadcast_campaigns WHERE id = ?", (campaign_id,)
+        ).fetchone()
+    return dict(zip(_CAMPAIGN_COLUMNS, row)) if row else None
+
+
+def _recipients(campaign, after):
+    """Chunks of (farmer_id, phone_number, crop_type, location) with ids above a checkpoint"""
+    filters, params = [], []
+    if campaign['crop']:
+        filters.append('lower(trim(crop_type)) = ?')
+        params.append(campaign['crop'])
+    if campaign['location']:
+        filters.append('lower(trim(location)) = lower(?)')
+        params.append(campaign['location'])
+    sql = f'''
+        SELECT id, phone_number, crop_type, location FROM farmers
+        WHERE id > ? {''.join(' AND ' + condition for condition in filters)}
+        ORDER BY id LIMIT ?
+    '''
+    while True:
+        with db.connection() as conn:
+            rows = conn.execute(sql, [after, *params, BROADCAST_CHUNK_SIZE]).fetchall()
+        if not rows:
+            return
+        yield rows
+        after = rows[-1][0]
+
+
+class _Chunk:
+    """Delivery progress of one chunk of recipients"""
+
+    def __init__(self, last_id, expected, skipped):
+        self.last_id = last_id
+        self.outstanding = expected
+        self.sent = 0
+        self.failed = 0
+        self.skipped = skipped
+        self.done = threading.Event()
+        self._lock = threading.Lock()
+        if expected == 0:
+            self.done.set()
+
+    def finished(self, delivered):
+        with self._lock:
+            if delivered:
+                self.sent += 1
+            else:
+                self.failed += 1
+            self.outstanding -= 1
+            if self.outstanding == 0:
+                self.done.set()
+
+
+def _checkpoint(campaign_id, chunk, segments):
+    with db.transaction() as conn:
+        conn.execute('''
+            UPDATE broadcast_campaigns
+            SET last_farmer_id = ?, sent = sent + ?, failed = failed + ?, skipped = skipped + ?, segments = ?,
+                updated_at = ?
+            WHERE id = ?
+        ''', (chunk.last_id, chunk.sent, chunk.failed, chunk.skipped, segments, time.time(), campaign_id))
+
+
+def _set_status(campaign_id, status):
+    now = time.time()
+    with db.transaction() as conn:
+        conn.execute(
+            'UPDATE broadcast_campaigns SET status = ?, updated_at = ?, finished_at = ? WHERE id = ?',
+            (status, now, now if status in ('done', 'failed') else None, campaign_id)
+        )
+
+
+def run_campaign(campaign_id, sender=None, heartbeat=None):
+    """Send (or resume) a campaign; returns its final progress.
+
+    heartbeat(progress) is called after every checkpoint.
+    """
+    sender = sender or outbound.dispatcher
+    campaign = campaign_status(campaign_id)
+    if campaign is None:
+        raise LookupError(f"Unknown broadcast campaign: {campaign_id}")
+    if campaign['status'] == 'done':
+        return campaign
+    _set_status(campaign_id, 'running')
+
+    if campaign['kind'] == 'weather':
+        with db.connection() as conn:
+            readings = _weather_readings(conn)
+        render = lambda crop, location: render_weather(crop, location, readings.get(location))  # noqa: E731
+    else:
+        render = render_price
+
+    texts = {}      # (crop, location) -> rendered message or None, once per segment
+    window = deque()
+    started = time.time()
+    try:
+        for rows in _recipients(campaign, campaign['last_farmer_id']):
+            messages, skipped = [], 0
+            for _, phone_number, crop_type, location in rows:
+                segment = ((crop_type or '').strip().lower(), normalize_location(location or ''))
+                if segment not in texts:
+                    # Without a location a price alert quotes crop-wide prices; a weather alert has nothing to say
+                    needed = segment[0] if campaign['kind'] == 'price' else segment[1]
+                    texts[segment] = render(*segment) if needed else None
+                text = texts[segment]
+                if not phone_number or text is None:
+                    skipped += 1
+                    continue
+                messages.append((phone_number, text))
+
+            chunk = _Chunk(rows[-1][0], len(messages), skipped)
+            for phone_number, text in messages:
+                sender.send(campaign['provider'], phone_number, text, priority=outbound.BULK, on_done=chunk.finished)
+            window.append(chunk)
+
+            # Checkpoint finished chunks in order; block once the window is full
+            while window and (window[0].done.is_set() or len(window) >= BROADCAST_WINDOW):
+                window[0].done.wait()
+                _checkpoint(campaign_id, window.popleft(), len(texts))
+                if heartbeat is not None:
+                    heartbeat(campaign_status(campaign_id))
+
+        while window:
+            window[0].done.wait()
+            _checkpoint(campaign_id, window.popleft(), len(texts))
+    except Exception:
+        _set_status(campaign_id, 'failed')
+        raise
+
+    _set_status(campaign_id, 'done')
+    progress = campaign_status(campaign_id)
+    print(f"📣 Campaign {campaign_id} ({campaign['kind']}): {progress['sent']} sent, {progress['failed']} failed, "
+          f"{progress['skipped']} skipped across {len(texts)} segments in {time.time() - started:.1f}s")
+    return progress
+
+
+if __name__ == '__main__':
+    import sys
+
+    from migrations import migrate
+
+    migrate()
+    arguments = sys.argv[1:] + [None] * 4
+    if arguments[0] not in KINDS:
+        sys.exit(__doc__)
+    run_campaign(create_campaign(arguments[0], arguments[1] or 'sms', arguments[2], arguments[3]))
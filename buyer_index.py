@@ -0,0 +1,261 @@
+"""Indexed crop-to-buyer lookup backed by the buyer_crops join table.
+
+buyers.crop_types stays as the human-readable comma-separated list, while
+buyer_crops holds one row per (crop, buyer) so matching is an exact indexed
+lookup instead of a LIKE '%crop%' scan. Every row carries a random
+sample_key; picking buyers is a seek to a random key followed by a short
+index-ordered read, so no query ever sorts the full result set.
+
+Buyers also carry coordinates and a geo grid cell (see geo.py), copied onto
+their buyer_crops rows by triggers. nearest_buyers seeks the
+(crop, verified, geo_cell) index for the cells around the farmer and ranks
+the closest candidates by offered price net of transport and by capacity.
+"""
+import math
+import os
+import random
+import re
+
+import geo
+import risk_tables
+
+# Buyers listing this crop take any crop (kept from app_backup.py data)
+WILDCARD_CROP = 'all'
+
+# Search radii (km) tried in turn until enough buyers are found
+SEARCH_RADII_KM = (50, 150, 400)
+
+# Nearest buyers read per search before ranking
+MAX_CANDIDATES = 100
+
+# Highest believable offer in KES/kg; larger figures are market-scale quotes
+MAX_OFFER_PER_KG = 50
+
+# A larger quote marked '/kg' is still market scale when within this factor of the crop's market reference price
+MARKET_SCALE_FACTOR = 2
+
+_PER_KG = re.compile(r'(?:/|\bper\s*)kg\b', re.IGNORECASE)
+
+# Share of the offered price lost to transport per km hauled
+TRANSPORT_COST_SHARE_PER_KM = float(os.getenv('TRANSPORT_COST_SHARE_PER_KM', '0.001'))
+
+_NEAREST_SQL = '''
+    SELECT b.id, b.name, b.phone, b.location, b.price_range, b.quantity_needed, b.offer_price, b.latitude, b.longitude,
+           (b.latitude - :lat) * (b.latitude - :lat) + (b.longitude - :lon) * (b.longitude - :lon) * :lon_scale AS d2
+    FROM buyer_crops c JOIN buyers b ON b.id = c.buyer_id
+    WHERE c.crop IN (:crop, '{wildcard}') AND c.verified = 1 AND c.geo_cell IN ({{cells}})
+      AND d2 <= :max_d2
+    ORDER BY d2
+    LIMIT :limit
+'''.format(wildcard=WILDCARD_CROP)
+
+_NEAREST_ANY_SQL = '''
+    SELECT b.id, b.name, b.phone, b.location, b.price_range, b.quantity_needed, b.offer_price, b.latitude, b.longitude,
+           (b.latitude - :lat) * (b.latitude - :lat) + (b.longitude - :lon) * (b.longitude - :lon) * :lon_scale AS d2
+    FROM buyers b
+    WHERE b.verified = 1 AND b.geo_cell IN ({cells})
+      AND d2 <= :max_d2
+    ORDER BY d2
+    LIMIT :limit
+'''
+
+_BUYER_COLUMNS = ('id', 'name', 'phone', 'location', 'price_range', 'quantity_needed', 'offer_price')
+
+SAMPLE_SQL = '''
+    SELECT buyer_id FROM buyer_crops
+    WHERE crop = ? AND verified = 1 AND sample_key >= ?
+    ORDER BY sample_key
+    LIMIT ?
+'''
+
+SAMPLE_WRAP_SQL = '''
+    SELECT buyer_id FROM buyer_crops
+    WHERE crop = ? AND verified = 1 AND sample_key < ?
+    ORDER BY sample_key
+    LIMIT ?
+'''
+
+# The unary + keeps SQLite on the primary key: via the verified index it sorts every buyer
+SAMPLE_ANY_SQL = '''
+    SELECT id FROM buyers
+    WHERE +verified = 1 AND id >= ?
+    ORDER BY id
+    LIMIT ?
+'''
+
+SAMPLE_ANY_WRAP_SQL = '''
+    SELECT id FROM buyers
+    WHERE +verified = 1 AND id < ?
+    ORDER BY id
+    LIMIT ?
+'''
+
+
+def parse_crops(crop_types):
+    """Split a comma-separated crop list into normalized, unique crop names"""
+    crops = []
+    for crop in (crop_types or '').split(','):
+        crop = crop.strip().lower()
+        if crop and crop not in crops:
+            crops.append(crop)
+    return crops
+
+
+def parse_offer_price(price_range, crop_types=None):
+    """Midpoint of the KES/kg figures in a price range such as 'KES 3.0-3.5/kg' (None if it has none).
+
+    Midpoints above MAX_OFFER_PER_KG are quotes on the market reference scale
+    (like '200-250'), converted with the first listed crop's price ratio,
+    unless they are marked '/kg' and not near that crop's reference price
+    ('KES 80/kg' is a real offer).
+    """
+    prices = [float(value) for value in re.findall(r'\d+(?:\.\d+)?', price_range or '')]
+    if not prices:
+        return None
+    offer = sum(prices) / len(prices)
+    if offer > MAX_OFFER_PER_KG:
+        crop = risk_tables.crops.row((parse_crops(crop_types) or [''])[0])
+        reference = crop[risk_tables.FORECAST_PRICE]
+        if not _PER_KG.search(price_range) or reference / MARKET_SCALE_FACTOR <= offer <= reference * MARKET_SCALE_FACTOR:
+            offer *= crop[risk_tables.BASE_PRICE] / reference
+    return offer
+
+
+def buyer_geo(location):
+    """(latitude, longitude, geo_cell) of a buyer location, all None if it is not in the gazetteer"""
+    coords = geo.locate(location)
+    if coords is None:
+        return None, None, None
+    return coords[0], coords[1], geo.cell_of(*coords)
+
+
+def net_offer(offer_price, distance_km):
+    """KES/kg a farmer keeps from an offer after hauling the crop distance_km"""
+    return offer_price * max(1 - TRANSPORT_COST_SHARE_PER_KM * distance_km, 0.0)
+
+
+def index_buyer_crops(conn, buyer_id, crop_types, verified):
+    """Replace the buyer_crops rows of one buyer"""
+    conn.execute('DELETE FROM buyer_crops WHERE buyer_id = ?', (buyer_id,))
+    conn.executemany('''
+        INSERT INTO buyer_crops (crop, buyer_id, verified, sample_key)
+        VALUES (?, ?, ?, ?)
+    ''', [(crop, buyer_id, 1 if verified else 0, random.random()) for crop in parse_crops(crop_types)])
+
+
+def add_buyer(conn, name, phone, location, crop_types, price_range, quantity_needed=None, verified=True):
+    """Insert a buyer together with its crop index rows and return its id"""
+    cursor = conn.execute('''
+        INSERT INTO buyers (name, phone, location, crop_types, price_range, quantity_needed, verified,
+                            latitude, longitude, geo_cell, offer_price)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', (name, phone, location, crop_types, price_range, quantity_needed, 1 if verified else 0,
+          *buyer_geo(location), parse_offer_price(price_range, crop_types)))
+    index_buyer_crops(conn, cursor.lastrowid, crop_types, verified)
+    return cursor.lastrowid
+
+
+def locate_buyer(conn, buyer_id, location):
+    """Move a buyer to a new location; triggers copy the cell onto its buyer_crops rows"""
+    conn.execute(
+        'UPDATE buyers SET location = ?, latitude = ?, longitude = ?, geo_cell = ? WHERE id = ?',
+        (location, *buyer_geo(location), buyer_id)
+    )
+
+
+def _sample_window(conn, sql, wrap_sql, params, start, limit):
+    """Read up to `limit` ids from a random start point, wrapping around once"""
+    ids = [row[0] for row in conn.execute(sql, (*params, start, limit))]
+    if len(ids) < limit:
+        ids += [row[0] for row in conn.execute(wrap_sql, (*params, start, limit - len(ids)))]
+    return ids
+
+
+def sample_buyer_ids(conn, crop, limit=3):
+    """Pick up to `limit` random verified buyer ids for a crop"""
+    crop = (crop or '').strip().lower()
+
+    if crop == WILDCARD_CROP:
+        # Any verified buyer: seek to a random id on the primary key
+        max_id = conn.execute('SELECT MAX(id) FROM buyers').fetchone()[0]
+        if not max_id:
+            return []
+        return _sample_window(conn, SAMPLE_ANY_SQL, SAMPLE_ANY_WRAP_SQL, (), random.randint(1, max_id), limit)
+
+    start = random.random()
+    candidates = []
+    for key in (crop, WILDCARD_CROP):
+        for buyer_id in _sample_window(conn, SAMPLE_SQL, SAMPLE_WRAP_SQL, (key,), start, limit):
+            if buyer_id not in candidates:
+                candidates.append(buyer_id)
+
+    if len(candidates) > limit:
+        candidates = random.sample(candidates, limit)
+    return candidates
+
+
+def _buyer_rows(conn, buyer_ids):
+    if not buyer_ids:
+        return []
+    placeholders = ', '.join('?' * len(buyer_ids))
+    rows = conn.execute(f'''
+        SELECT {', '.join(_BUYER_COLUMNS)} FROM buyers WHERE id IN ({placeholders})
+    ''', buyer_ids).fetchall()
+    return [dict(zip(_BUYER_COLUMNS, row), distance_km=None, score=None) for row in rows]
+
+
+def _nearby_candidates(conn, crop, latitude, longitude, limit):
+    """Closest verified buyers of a crop, widening the search radius until `limit` are found"""
+    params = {
+        'crop': crop, 'lat': latitude, 'lon': longitude,
+        'lon_scale': math.cos(math.radians(latitude)) ** 2, 'limit': MAX_CANDIDATES
+    }
+    sql = _NEAREST_ANY_SQL if crop == WILDCARD_CROP else _NEAREST_SQL
+    rows = []
+    for radius in SEARCH_RADII_KM:
+        cells = geo.cells_within(latitude, longitude, radius)
+        params['max_d2'] = (radius / geo.KM_PER_DEGREE) ** 2
+        rows = conn.execute(sql.format(cells=', '.join(map(str, cells))), params).fetchall()
+        if len(rows) >= limit:
+            break
+    return rows
+
+
+def nearest_buyers(conn, crop, location, quantity=None, limit=3):
+    """Best verified buyers for a farmer's lot, ranked by distance, capacity and price.
+
+    Each candidate scores offer price x (1 - transport share x km) x the
+    share of the lot it can take. Buyers without a known offer are scored at
+    the median offer of the candidates. When the farmer's location is unknown
+    or too few buyers are nearby, the list is topped up with random verified
+    buyers of the crop (distance_km None).
+    """
+    crop = (crop or '').strip().lower()
+    coords = geo.locate(location)
+
+    matches = []
+    if coords is not None:
+        seen = set()
+        for row in _nearby_candidates(conn, crop, coords[0], coords[1], limit):
+            if row[0] in seen:
+                continue
+            seen.add(row[0])
+            buyer = dict(zip(_BUYER_COLUMNS, row))
+            buyer['distance_km'] = round(geo.distance_km(coords[0], coords[1], row[7], row[8]), 1)
+            matches.append(buyer)
+
+        offers = sorted(buyer['offer_price'] for buyer in matches if buyer['offer_price'] is not None)
+        reference = offers[len(offers) // 2] if offers else 1.0
+        for buyer in matches:
+            offer = buyer['offer_price'] if buyer['offer_price'] is not None else reference
+            net = net_offer(offer, buyer['distance_km'])
+            capacity = min(buyer['quantity_needed'] / quantity, 1.0) if quantity and buyer['quantity_needed'] else 1.0
+            buyer['score'] = round(net * capacity, 4)
+        matches.sort(key=lambda buyer: (-buyer['score'], buyer['distance_km']))
+        matches = matches[:limit]
+
+    if len(matches) < limit:
+        known = {buyer['id'] for buyer in matches}
+        extra = [buyer_id for buyer_id in sample_buyer_ids(conn, crop, limit) if buyer_id not in known]
+        matches += _buyer_rows(conn, extra[:limit - len(matches)])
+    return matches
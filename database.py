@@ -0,0 +1,120 @@
+"""Pooled, thread-safe SQLite connections for every data-access function.
+
+Opening harvestlink.db costs a file open, schema parse and a fresh statement
+cache each time. Connections here are opened once, tuned for concurrent web
+traffic (WAL journaling, relaxed fsync, bigger page cache) and handed out to
+one thread at a time, so prepared statements are reused across requests.
+"""
+import os
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+DB_PATH = os.getenv('DATABASE_PATH', 'harvestlink.db')
+POOL_SIZE = int(os.getenv('DATABASE_POOL_SIZE', '8'))
+
+# Per-connection prepared statement cache
+STATEMENT_CACHE_SIZE = 256
+
+PRAGMAS = (
+    'PRAGMA journal_mode = WAL',
+    'PRAGMA synchronous = NORMAL',   # safe with WAL, skips an fsync per commit
+    'PRAGMA cache_size = -16000',    # ~16 MB page cache
+    'PRAGMA temp_store = MEMORY',
+    'PRAGMA busy_timeout = 5000',
+)
+
+
+def connect(db_path=DB_PATH):
+    """Open a tuned connection in autocommit mode"""
+    conn = sqlite3.connect(
+        db_path,
+        timeout=30,
+        isolation_level=None,
+        check_same_thread=False,
+        cached_statements=STATEMENT_CACHE_SIZE
+    )
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+class ConnectionPool:
+    """Fixed-size pool of SQLite connections shared by all request threads"""
+
+    def __init__(self, db_path=DB_PATH, size=POOL_SIZE):
+        self.db_path = db_path
+        self.size = size
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _checkout(self):
+        # Connections must not cross a fork (gunicorn preload)
+        if self._pid != os.getpid():
+            self._reset()
+
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                return connect(self.db_path)
+        return self._idle.get()
+
+    def _checkin(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        self._idle.put(conn)
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection for reads or single statements"""
+        conn = self._checkout()
+        try:
+            yield conn
+        finally:
+            self._checkin(conn)
+
+    @contextmanager
+    def transaction(self):
+        """Borrow a connection inside a write transaction committed on exit"""
+        with self.connection() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield conn
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+            conn.execute('COMMIT')
+
+    def close_all(self):
+        """Close idle connections (used on shutdown and in scripts)"""
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+            with self._lock:
+                self._created -= 1
+
+
+pool = ConnectionPool()
+
+
+def connection():
+    """Borrow a pooled connection for reads"""
+    return pool.connection()
+
+
+def transaction():
+    """Borrow a pooled connection inside a write transaction"""
+    return pool.transaction()
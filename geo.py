@@ -0,0 +1,150 @@
+"""Static Kenyan gazetteer and the grid used to index buyer locations.
+
+Place names (towns and counties) resolve to coordinates without any network
+call. Coordinates map to square grid cells of CELL_DEGREES; a radius search
+turns into the short list of cells overlapping its bounding box, which an
+ordinary B-tree index on the cell column can seek directly.
+"""
+import math
+import re
+from functools import lru_cache
+
+# Grid cell edge in degrees (0.25 deg is about 28 km at the equator)
+CELL_DEGREES = 0.25
+_GRID_COLUMNS = int(360 / CELL_DEGREES)
+
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+# Town -> (latitude, longitude)
+TOWNS = {
+    'nairobi': (-1.2864, 36.8172),
+    'mombasa': (-4.0435, 39.6682),
+    'kisumu': (-0.0917, 34.7680),
+    'nakuru': (-0.3031, 36.0800),
+    'eldoret': (0.5143, 35.2698),
+    'thika': (-1.0333, 37.0693),
+    'meru': (0.0470, 37.6498),
+    'kakamega': (0.2827, 34.7519),
+    'kisii': (-0.6817, 34.7660),
+    'nyeri': (-0.4201, 36.9476),
+    'machakos': (-1.5177, 37.2634),
+    'kitui': (-1.3667, 38.0106),
+    'garissa': (-0.4536, 39.6401),
+    'malindi': (-3.2192, 40.1169),
+    'kilifi': (-3.6305, 39.8499),
+    'kitale': (1.0157, 35.0062),
+    'bungoma': (0.5635, 34.5606),
+    'busia': (0.4608, 34.1115),
+    'naivasha': (-0.7167, 36.4333),
+    'nanyuki': (0.0167, 37.0667),
+    'embu': (-0.5310, 37.4575),
+    'kericho': (-0.3677, 35.2831),
+    'bomet': (-0.7813, 35.3416),
+    'narok': (-1.0783, 35.8601),
+    'kajiado': (-1.8524, 36.7768),
+    'voi': (-3.3961, 38.5561),
+    'lamu': (-2.2717, 40.9020),
+    'isiolo': (0.3546, 37.5822),
+    'marsabit': (2.3284, 37.9899),
+    'lodwar': (3.1191, 35.5973),
+    'wajir': (1.7471, 40.0573),
+    'mandera': (3.9366, 41.8670),
+    'moyale': (3.5167, 39.0584),
+    'homa bay': (-0.5273, 34.4571),
+    'migori': (-1.0634, 34.4731),
+    'siaya': (0.0612, 34.2881),
+    'mbale': (0.0760, 34.7228),
+    'kapenguria': (1.2389, 35.1119),
+    'kabarnet': (0.4919, 35.7430),
+    'iten': (0.6703, 35.5081),
+    'kapsabet': (0.2039, 35.1050),
+    'nyahururu': (0.0380, 36.3650),
+    'muranga': (-0.7210, 37.1526),
+    'kiambu': (-1.1714, 36.8356),
+    'ruiru': (-1.1466, 36.9609),
+    'limuru': (-1.1136, 36.6422),
+    'athi river': (-1.4560, 36.9780),
+    'kerugoya': (-0.4989, 37.2803),
+    'chuka': (-0.3332, 37.6459),
+    'maralal': (1.0968, 36.6980),
+    'hola': (-1.4906, 40.0302),
+    'kwale': (-4.1737, 39.4521),
+    'ukunda': (-4.2875, 39.5661),
+    'wundanyi': (-3.4019, 38.3597),
+    'wote': (-1.7817, 37.6287),
+    'nyamira': (-0.5633, 34.9358),
+    'ol kalou': (-0.2721, 36.3786),
+    'rumuruti': (0.2725, 36.5381),
+    'molo': (-0.2487, 35.7324),
+    'webuye': (0.6087, 34.7708),
+    'mumias': (0.3356, 34.4881),
+}
+
+# County -> headquarters town
+COUNTIES = {
+    'mombasa': 'mombasa', 'kwale': 'kwale', 'kilifi': 'kilifi', 'tana river': 'hola',
+    'lamu': 'lamu', 'taita taveta': 'wundanyi', 'garissa': 'garissa', 'wajir': 'wajir',
+    'mandera': 'mandera', 'marsabit': 'marsabit', 'isiolo': 'isiolo', 'meru': 'meru',
+    'tharaka nithi': 'chuka', 'embu': 'embu', 'kitui': 'kitui', 'machakos': 'machakos',
+    'makueni': 'wote', 'nyandarua': 'ol kalou', 'nyeri': 'nyeri', 'kirinyaga': 'kerugoya',
+    'muranga': 'muranga', 'kiambu': 'kiambu', 'turkana': 'lodwar', 'west pokot': 'kapenguria',
+    'samburu': 'maralal', 'trans nzoia': 'kitale', 'uasin gishu': 'eldoret',
+    'elgeyo marakwet': 'iten', 'nandi': 'kapsabet', 'baringo': 'kabarnet',
+    'laikipia': 'rumuruti', 'nakuru': 'nakuru', 'narok': 'narok', 'kajiado': 'kajiado',
+    'kericho': 'kericho', 'bomet': 'bomet', 'kakamega': 'kakamega', 'vihiga': 'mbale',
+    'bungoma': 'bungoma', 'busia': 'busia', 'siaya': 'siaya', 'kisumu': 'kisumu',
+    'homa bay': 'homa bay', 'migori': 'migori', 'kisii': 'kisii', 'nyamira': 'nyamira',
+    'nairobi': 'nairobi',
+}
+
+GAZETTEER = {**{county: TOWNS[town] for county, town in COUNTIES.items()}, **TOWNS}
+
+# Words dropped when matching a free-text place name
+_NOISE = re.compile(r"\b(county|town|city|municipality|kenya)\b|['’]")
+
+
+def _normalize(place):
+    place = _NOISE.sub('', str(place).lower().replace('-', ' '))
+    return ' '.join(place.split())
+
+
+@lru_cache(maxsize=4096)
+def locate(place):
+    """(latitude, longitude) of a Kenyan town or county, or None if unknown"""
+    if not place:
+        return None
+    # "Ruiru, Kiambu" -> try the most specific part first
+    for part in str(place).split(','):
+        coords = GAZETTEER.get(_normalize(part))
+        if coords is not None:
+            return coords
+    return None
+
+
+def cell_of(latitude, longitude):
+    """Grid cell id containing a point"""
+    row = int((latitude + 90) // CELL_DEGREES)
+    column = int((longitude + 180) // CELL_DEGREES) % _GRID_COLUMNS
+    return row * _GRID_COLUMNS + column
+
+
+def cells_within(latitude, longitude, radius_km):
+    """Ids of every grid cell overlapping the bounding box of a radius around a point"""
+    dlat = radius_km / KM_PER_DEGREE
+    dlon = radius_km / (KM_PER_DEGREE * max(math.cos(math.radians(latitude)), 0.01))
+    row_low, row_high = int((latitude - dlat + 90) // CELL_DEGREES), int((latitude + dlat + 90) // CELL_DEGREES)
+    column_low, column_high = int((longitude - dlon + 180) // CELL_DEGREES), int((longitude + dlon + 180) // CELL_DEGREES)
+    return [
+        row * _GRID_COLUMNS + column % _GRID_COLUMNS
+        for row in range(row_low, row_high + 1)
+        for column in range(column_low, column_high + 1)
+    ]
+
+
+def distance_km(latitude1, longitude1, latitude2, longitude2):
+    """Great-circle (haversine) distance between two points"""
+    phi1, phi2 = math.radians(latitude1), math.radians(latitude2)
+    a = (math.sin((phi2 - phi1) / 2) ** 2
+         + math.cos(phi1) * math.cos(phi2) * math.sin(math.radians(longitude2 - longitude1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(min(a, 1.0)))
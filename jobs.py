@@ -0,0 +1,223 @@
+"""SQLite-backed background job queue with a local worker pool.
+
+Slow work (GPT analyses, model inference, buyer notifications) is enqueued
+and the web request returns at once with the job id. Worker threads claim
+jobs from the jobs table, so any process sharing the database can pick them
+up, and handlers can publish partial results while they run. Clients read
+progress back by id. One worker at a time sweeps the table every
+JOB_SWEEP_INTERVAL seconds, requeueing jobs whose worker died and deleting
+finished jobs older than JOB_RETENTION.
+"""
+import json
+import os
+import threading
+import time
+import traceback
+import uuid
+
+import database as db
+
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', '4'))
+JOB_POLL_INTERVAL = float(os.getenv('JOB_POLL_INTERVAL', '1'))
+
+# Jobs left 'running' this long (seconds) belonged to a dead worker and are retried
+JOB_STALE_AFTER = 300
+JOB_MAX_ATTEMPTS = 3
+
+# Seconds between sweeps for stale and expired jobs
+JOB_SWEEP_INTERVAL = float(os.getenv('JOB_SWEEP_INTERVAL', '60'))
+
+# Finished jobs (and recorded analyses) are deleted this many seconds after creation
+JOB_RETENTION = int(os.getenv('JOB_RETENTION', str(7 * 24 * 3600)))
+
+CLAIM_SQL = '''
+    UPDATE jobs SET status = 'running', attempts = attempts + 1, updated_at = ?
+    WHERE id = (
+        SELECT id FROM jobs WHERE status = 'queued'
+        ORDER BY created_at
+        LIMIT 1
+    )
+    RETURNING id, kind, payload, result
+'''
+
+
+def new_job_id():
+    """Return a collision-free job/analysis id"""
+    return uuid.uuid4().hex
+
+
+class Job:
+    """A claimed job handed to its handler"""
+
+    def __init__(self, job_id, kind, payload, result):
+        self.id = job_id
+        self.kind = kind
+        self.payload = payload
+        self.result = result
+
+    def update(self, partial):
+        """Merge partial results into the job and publish them immediately"""
+        self.result.update(partial)
+        with db.transaction() as conn:
+            conn.execute(
+                'UPDATE jobs SET result = ?, updated_at = ? WHERE id = ?',
+                (json.dumps(self.result), time.time(), self.id)
+            )
+
+
+class JobQueue:
+    """Durable FIFO of jobs processed by a pool of worker threads"""
+
+    def __init__(self, workers=JOB_WORKERS, poll_interval=JOB_POLL_INTERVAL, stale_after=JOB_STALE_AFTER,
+                 sweep_interval=JOB_SWEEP_INTERVAL, retention=JOB_RETENTION):
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.stale_after = stale_after
+        self.sweep_interval = sweep_interval
+        self.retention = retention
+        self._next_sweep = 0.0
+        self._handlers = {}
+        self._wakeup = threading.Event()
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def handler(self, kind):
+        """Decorator registering the function that runs jobs of a kind"""
+        def register(function):
+            self._handlers[kind] = function
+            return function
+        return register
+
+    def enqueue(self, kind, payload, result=None, job_id=None):
+        """Queue a job and return its id"""
+        job_id = job_id or new_job_id()
+        now = time.time()
+        with db.transaction() as conn:
+            conn.execute('''
+                INSERT INTO jobs (id, kind, payload, status, result, created_at, updated_at)
+                VALUES (?, ?, ?, 'queued', ?, ?, ?)
+            ''', (job_id, kind, json.dumps(payload), json.dumps(result or {}), now, now))
+        self.start()
+        self._wakeup.set()
+        return job_id
+
+    def record(self, kind, result, job_id=None):
+        """Store an already finished result so it can be fetched by id"""
+        job_id = job_id or new_job_id()
+        now = time.time()
+        with db.transaction() as conn:
+            conn.execute('''
+                INSERT INTO jobs (id, kind, payload, status, result, created_at, updated_at)
+                VALUES (?, ?, '{}', 'done', ?, ?, ?)
+            ''', (job_id, kind, json.dumps(result), now, now))
+        return job_id
+
+    def get(self, job_id):
+        """Return a job's status and (possibly partial) result, or None"""
+        with db.connection() as conn:
+            row = conn.execute(
+                'SELECT kind, status, result, error, created_at, updated_at FROM jobs WHERE id = ?',
+                (job_id,)
+            ).fetchone()
+
+        if row is None:
+            return None
+        kind, status, result, error, created_at, updated_at = row
+        return {
+            'id': job_id,
+            'kind': kind,
+            'status': status,
+            'result': json.loads(result) if result else {},
+            'error': error,
+            'created_at': created_at,
+            'updated_at': updated_at
+        }
+
+    def start(self):
+        """Start the worker threads once per process"""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            for number in range(self.workers):
+                threading.Thread(target=self._work, name=f'job-worker-{number}', daemon=True).start()
+
+    def _sweep(self):
+        """Requeue stale jobs and purge expired ones, if this worker is the first due to"""
+        now = time.time()
+        with self._lock:
+            if now < self._next_sweep:
+                return
+            self._next_sweep = now + self.sweep_interval
+        try:
+            self._requeue_stale()
+            self._purge()
+        except Exception as e:
+            print(f"Job queue sweep error: {e}")
+
+    def _requeue_stale(self):
+        """Put jobs abandoned by a crashed worker back in the queue"""
+        with db.transaction() as conn:
+            return conn.execute('''
+                UPDATE jobs SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'queued' END
+                WHERE status = 'running' AND updated_at < ?
+            ''', (JOB_MAX_ATTEMPTS, time.time() - self.stale_after)).rowcount
+
+    def _purge(self):
+        """Delete finished jobs older than the retention period"""
+        with db.transaction() as conn:
+            return conn.execute(
+                "DELETE FROM jobs WHERE status IN ('done', 'failed') AND created_at < ?",
+                (time.time() - self.retention,)
+            ).rowcount
+
+    def _claim(self):
+        with db.transaction() as conn:
+            row = conn.execute(CLAIM_SQL, (time.time(),)).fetchone()
+        if row is None:
+            return None
+        job_id, kind, payload, result = row
+        return Job(job_id, kind, json.loads(payload or '{}'), json.loads(result or '{}'))
+
+    def _finish(self, job, status, error=None):
+        with db.transaction() as conn:
+            conn.execute(
+                'UPDATE jobs SET status = ?, result = ?, error = ?, updated_at = ? WHERE id = ?',
+                (status, json.dumps(job.result), error, time.time(), job.id)
+            )
+
+    def _work(self):
+        while True:
+            self._sweep()
+            try:
+                job = self._claim()
+            except Exception as e:
+                print(f"Job queue error: {e}")
+                job = None
+
+            if job is None:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+                continue
+
+            handler = self._handlers.get(job.kind)
+            status, error = 'done', None
+            try:
+                if handler is None:
+                    raise LookupError(f"No handler registered for job kind '{job.kind}'")
+                output = handler(job)
+                if output:
+                    job.result.update(output)
+            except Exception as e:
+                print(f"❌ Job {job.id} ({job.kind}) failed: {e}")
+                traceback.print_exc()
+                status, error = 'failed', str(e)
+
+            # A failed write (locked database, unserializable result) must not kill the worker;
+            # the job stays 'running' and the stale sweep retries it
+            try:
+                self._finish(job, status, error)
+            except Exception as e:
+                print(f"❌ Could not record job {job.id} ({job.kind}) as {status}: {e}")
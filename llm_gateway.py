@@ -0,0 +1,177 @@
+"""Non-blocking OpenAI chat gateway shared by HybridAI and /api/chat.
+
+openai.ChatCompletion.create blocks the calling worker for the whole
+generation. The gateway instead runs every completion as a coroutine on one
+background asyncio loop with a single pooled aiohttp session, so a worker can
+have dozens of completions outstanding at once. A semaphore bounds how many
+are in flight, and every request has a deadline, so a burst of chat users
+cannot starve /sms or /api/analyze.
+"""
+import asyncio
+import json
+import os
+import queue
+import threading
+
+import aiohttp
+import openai
+
+LLM_MODEL = 'gpt-4o-mini'
+LLM_MAX_IN_FLIGHT = int(os.getenv('LLM_MAX_IN_FLIGHT', '32'))
+LLM_TIMEOUT = float(os.getenv('LLM_TIMEOUT', '20'))
+LLM_QUEUE_TIMEOUT = float(os.getenv('LLM_QUEUE_TIMEOUT', '5'))
+
+
+_STREAM_END = object()
+
+
+class LLMError(Exception):
+    """Raised when a completion fails, times out or cannot get a slot"""
+
+
+class LLMGateway:
+    """Async OpenAI chat client running on a shared background event loop"""
+
+    def __init__(self, model=LLM_MODEL, max_in_flight=LLM_MAX_IN_FLIGHT,
+                 timeout=LLM_TIMEOUT, queue_timeout=LLM_QUEUE_TIMEOUT):
+        self.model = model
+        self.max_in_flight = max_in_flight
+        self.timeout = timeout
+        self.queue_timeout = queue_timeout
+        self._lock = threading.Lock()
+        self._pid = None
+        self._loop = None
+        self._session = None
+        self._semaphore = None
+
+    def _ensure_loop(self):
+        """Start the event loop thread on first use (and again after a fork)"""
+        if self._loop is not None and self._pid == os.getpid():
+            return self._loop
+
+        with self._lock:
+            if self._loop is None or self._pid != os.getpid():
+                loop = asyncio.new_event_loop()
+                thread = threading.Thread(target=loop.run_forever, name='llm-gateway', daemon=True)
+                thread.start()
+                self._session = None
+                self._semaphore = None
+                self._pid = os.getpid()
+                self._loop = loop
+        return self._loop
+
+    def _get_session(self):
+        """Return the pooled aiohttp session (only called on the loop thread)"""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.max_in_flight, keepalive_timeout=60)
+            self._session = aiohttp.ClientSession(connector=connector)
+            self._semaphore = asyncio.Semaphore(self.max_in_flight)
+        return self._session
+
+    def _request(self, messages, model, max_tokens, temperature):
+        """Build the URL, headers and JSON body of a chat completion request"""
+        if not openai.api_key:
+            raise LLMError('OpenAI API key is not configured')
+
+        url = f"{openai.api_base.rstrip('/')}/chat/completions"
+        headers = {'Authorization': f'Bearer {openai.api_key}'}
+        payload = {
+            'model': model or self.model,
+            'messages': messages,
+            'max_tokens': max_tokens,
+            'temperature': temperature
+        }
+        return url, headers, payload
+
+    async def _acquire_slot(self):
+        """Wait for an in-flight slot, giving up after queue_timeout"""
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            raise LLMError(f'All {self.max_in_flight} completion slots are busy')
+
+    async def acomplete(self, messages, model=None, max_tokens=300, temperature=0.5, timeout=None):
+        """Run one chat completion and return the stripped reply text"""
+        url, headers, payload = self._request(messages, model, max_tokens, temperature)
+        session = self._get_session()
+        await self._acquire_slot()
+        try:
+            request_timeout = aiohttp.ClientTimeout(total=timeout or self.timeout)
+            async with session.post(url, json=payload, headers=headers, timeout=request_timeout) as response:
+                body = await response.json(content_type=None)
+                if response.status != 200:
+                    message = body.get('error', {}).get('message', response.reason) if isinstance(body, dict) else response.reason
+                    raise LLMError(f'OpenAI returned {response.status}: {message}')
+        except asyncio.TimeoutError:
+            raise LLMError(f'Completion timed out after {timeout or self.timeout:.0f}s')
+        except aiohttp.ClientError as e:
+            raise LLMError(f'OpenAI request failed: {e}')
+        finally:
+            self._semaphore.release()
+
+        return body['choices'][0]['message']['content'].strip()
+
+    async def astream(self, messages, model=None, max_tokens=300, temperature=0.5, timeout=None):
+        """Yield reply tokens as the model produces them"""
+        url, headers, payload = self._request(messages, model, max_tokens, temperature)
+        payload['stream'] = True
+        session = self._get_session()
+        await self._acquire_slot()
+        try:
+            # The deadline applies to each gap between tokens, not the whole reply
+            request_timeout = aiohttp.ClientTimeout(total=None, sock_connect=10, sock_read=timeout or self.timeout)
+            async with session.post(url, json=payload, headers=headers, timeout=request_timeout) as response:
+                if response.status != 200:
+                    raise LLMError(f'OpenAI returned {response.status}: {response.reason}')
+                async for raw_line in response.content:
+                    line = raw_line.decode('utf-8').strip()
+                    if not line.startswith('data:'):
+                        continue
+                    data = line[len('data:'):].strip()
+                    if data == '[DONE]':
+                        break
+                    token = json.loads(data)['choices'][0].get('delta', {}).get('content')
+                    if token:
+                        yield token
+        except asyncio.TimeoutError:
+            raise LLMError(f'Stream stalled for {timeout or self.timeout:.0f}s')
+        except aiohttp.ClientError as e:
+            raise LLMError(f'OpenAI request failed: {e}')
+        finally:
+            self._semaphore.release()
+
+    def submit(self, messages, **kwargs):
+        """Schedule a completion and return a concurrent.futures.Future"""
+        loop = self._ensure_loop()
+        return asyncio.run_coroutine_threadsafe(self.acomplete(messages, **kwargs), loop)
+
+    def complete(self, messages, **kwargs):
+        """Run a completion from synchronous code and wait for the reply"""
+        return self.submit(messages, **kwargs).result()
+
+    def stream(self, messages, **kwargs):
+        """Yield reply tokens to synchronous code as they arrive"""
+        loop = self._ensure_loop()
+        tokens = queue.Queue()
+
+        async def pump():
+            try:
+                async for token in self.astream(messages, **kwargs):
+                    tokens.put(token)
+            except Exception as e:
+                tokens.put(e)
+            finally:
+                tokens.put(_STREAM_END)
+
+        future = asyncio.run_coroutine_threadsafe(pump(), loop)
+        try:
+            while True:
+                item = tokens.get()
+                if item is _STREAM_END:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            # Stop generating if the client went away mid-stream
+            future.cancel()
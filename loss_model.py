@@ -0,0 +1,406 @@
+"""Trained post-harvest loss-risk ensemble (random forest + gradient boosting + MLP).
+
+Training builds a feature matrix from the loss_predictions table and tops
+it up with synthetic lots labelled by the hand-written SimpleAI scorers (the
+"teacher"), because real rows do not record humidity, temperature, storage
+days or pest signs. Nothing in the app writes loss_predictions yet, so in
+practice the ensemble is a distillation of the teacher's rules, not a model
+of observed losses; it only learns from real outcomes once measured losses
+are recorded there. The market_price feature is each crop's average
+transaction price at training time; those prices are saved with the model
+and reused at inference so both sides see the same values.
+
+The fitted members are saved with joblib, uncompressed so the arrays can be
+memory-mapped, and loaded once per process.
+
+Inference is batched: predict_batch scores any number of lots with one
+predict_proba call per member. predict_one scores a single lot with a
+pure-Python copy of the fitted trees and network (RowScorer), which avoids
+sklearn's per-call overhead. It also memoizes lots on rounded inputs, so
+repeat requests skip the models entirely.
+
+Train with:  python loss_model.py [synthetic_rows]
+"""
+import functools
+import math
+import os
+import sys
+import threading
+import time
+
+import joblib
+
+import database as db
+import ml_loader
+import risk_tables
+
+MODEL_PATH = os.getenv('LOSS_MODEL_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'models', 'loss_ensemble.joblib'))
+MODEL_VERSION = 2
+
+CLASSES = ('low', 'medium', 'high')
+FEATURES = (
+    'crop_risk', 'storage_risk', 'weather_risk', 'humidity', 'temperature',
+    'storage_days', 'pest_signs', 'log_quantity', 'market_price'
+)
+
+# Soft-voting weights (the confidences SimpleAI has always reported)
+MEMBER_WEIGHTS = {'rf': 0.85, 'gb': 0.82, 'nn': 0.78}
+
+SYNTHETIC_ROWS = 20000
+SYNTHETIC_POOL = 20
+
+# Assumed conditions for stored predictions, which do not record them
+DEFAULT_HUMIDITY = 65
+DEFAULT_TEMPERATURE = 25
+DEFAULT_STORAGE_DAYS = 7
+DEFAULT_QUANTITY = 100
+
+# Stored predicted_loss (%) thresholds, matching the /api/analyze urgency levels
+MEDIUM_LOSS = 10
+HIGH_LOSS = 20
+
+_lock = threading.Lock()
+_bundle = None
+_row_scorer = None
+
+
+def feature_matrix(crop_types, storage_methods, weather_conditions, humidity, temperature,
+                   storage_days, pest_signs, quantity, market_prices=None):
+    """Build the model input (one row per lot) from equal-length columns"""
+    np = ml_loader.numpy()
+    crop_codes = risk_tables.crops.encode(crop_types)
+    if market_prices is None:
+        market_prices = risk_tables.crops.matrix[crop_codes, risk_tables.FORECAST_PRICE]
+
+    return np.column_stack([
+        risk_tables.crops.matrix[crop_codes, risk_tables.RF],
+        risk_tables.storage.matrix[risk_tables.storage.encode(storage_methods), risk_tables.RF],
+        risk_tables.weather.matrix[risk_tables.weather.encode(weather_conditions), risk_tables.RF],
+        np.asarray(humidity, dtype=float),
+        np.asarray(temperature, dtype=float),
+        np.asarray(storage_days, dtype=float),
+        np.asarray(pest_signs, dtype=float),
+        np.log1p(np.asarray(quantity, dtype=float)),
+        np.asarray(market_prices, dtype=float)
+    ])
+
+
+def teacher_labels(crop_types, storage_methods, weather_conditions, humidity, temperature, storage_days, pest_signs):
+    """Majority vote of the hand-written SimpleAI scorers, vectorized (0/1/2)"""
+    np = ml_loader.numpy()
+    crop_rows = risk_tables.crops.matrix[risk_tables.crops.encode(crop_types)]
+    storage_rows = risk_tables.storage.matrix[risk_tables.storage.encode(storage_methods)]
+    weather_rows = risk_tables.weather.matrix[risk_tables.weather.encode(weather_conditions)]
+    factors = crop_rows[:, :3] + storage_rows[:, :3] + weather_rows[:, :3]
+
+    humidity = np.asarray(humidity, dtype=float)
+    temperature = np.asarray(temperature, dtype=float)
+    storage_days = np.asarray(storage_days, dtype=float)
+    pest_signs = np.asarray(pest_signs, dtype=float)
+
+    rf = factors[:, risk_tables.RF] + (humidity - 50) / 100 + (temperature - 25) / 50 + storage_days / 100 + pest_signs * 0.3
+    gb = factors[:, risk_tables.GB] + (humidity - 45) / 80 + (temperature - 22) / 40 + storage_days / 80 + pest_signs * 0.4
+    nn = (factors[:, risk_tables.NN] + np.sin((humidity - 50) / 50) * 0.2 + np.cos((temperature - 25) / 25) * 0.2
+          + np.log(storage_days + 1) / 10 + pest_signs * 0.5)
+
+    votes = np.column_stack([
+        np.digitize(rf, (0.3, 0.7)),
+        np.digitize(gb, (0.4, 0.8)),
+        np.digitize(nn, (0.2, 0.6))
+    ])
+    counts = np.stack([(votes == label).sum(axis=1) for label in range(len(CLASSES))], axis=1)
+    # Three different votes -> medium
+    return np.where(counts.max(axis=1) >= 2, counts.argmax(axis=1), 1)
+
+
+def synthetic_lots(rows, seed=0):
+    """Random lots spanning every known crop, storage method and weather condition.
+
+    The teacher rates nearly every realistic lot 'high', so lots are drawn
+    from a pool SYNTHETIC_POOL times larger and each class keeps up to a
+    third of the rows, which puts the rare low/medium boundary in the data.
+    """
+    np = ml_loader.numpy()
+    rng = np.random.default_rng(seed)
+    pool = rows * SYNTHETIC_POOL
+    lots = {
+        'crop_type': rng.choice(risk_tables.crops.names[:-1], pool),
+        'storage_method': rng.choice(risk_tables.storage.names[:-1], pool),
+        'weather_condition': rng.choice(risk_tables.weather.names[:-1], pool),
+        'humidity': rng.uniform(10, 100, pool),
+        'temperature': rng.uniform(0, 40, pool),
+        'storage_days': rng.integers(0, 60, pool),
+        'pest_signs': rng.integers(0, 2, pool),
+        'quantity': rng.lognormal(4.5, 1.0, pool)
+    }
+    labels = teacher_labels(lots['crop_type'], lots['storage_method'], lots['weather_condition'],
+                            lots['humidity'], lots['temperature'], lots['storage_days'], lots['pest_signs'])
+
+    # Rarest classes first; the most common class fills the remaining rows
+    by_class = sorted((np.flatnonzero(labels == label) for label in range(len(CLASSES))), key=len)
+    keep, remaining = [], rows
+    for position, indices in enumerate(by_class):
+        share = remaining if position == len(by_class) - 1 else min(len(indices), rows // len(CLASSES))
+        keep.append(rng.choice(indices, min(share, len(indices)), replace=False))
+        remaining -= len(keep[-1])
+    keep = np.concatenate(keep)
+
+    lots = {name: column[keep] for name, column in lots.items()}
+    lots['label'] = labels[keep]
+    return lots
+
+
+def average_prices(conn):
+    """Average transaction price per crop, the market_price feature the model is trained on"""
+    return dict(conn.execute(
+        'SELECT LOWER(TRIM(crop_type)), AVG(price) FROM transactions WHERE price IS NOT NULL GROUP BY 1'
+    ).fetchall())
+
+
+def market_price(crop_prices, crop_type):
+    """market_price feature of a crop: its trained average, else the reference price"""
+    crop = str(crop_type).strip().lower()
+    return crop_prices.get(crop) or risk_tables.crops.row(crop)[risk_tables.FORECAST_PRICE]
+
+
+def load_training_data(synthetic_rows=SYNTHETIC_ROWS, seed=0):
+    """Return (X, y, row counts, per-crop market prices) from stored predictions plus synthetic lots"""
+    np = ml_loader.numpy()
+    pd = ml_loader.pandas()
+
+    with db.connection() as conn:
+        stored = pd.read_sql_query('''
+            SELECT crop_type, storage_method, weather_condition, quantity, predicted_loss
+            FROM loss_predictions
+            WHERE predicted_loss IS NOT NULL
+        ''', conn)
+        crop_prices = average_prices(conn)
+
+    lots = synthetic_lots(synthetic_rows, seed)
+    X_synthetic = feature_matrix(lots['crop_type'], lots['storage_method'], lots['weather_condition'],
+                                 lots['humidity'], lots['temperature'], lots['storage_days'],
+                                 lots['pest_signs'], lots['quantity'],
+                                 [market_price(crop_prices, crop) for crop in lots['crop_type'].tolist()])
+    counts = {'stored': len(stored), 'synthetic': synthetic_rows}
+
+    if stored.empty:
+        return X_synthetic, lots['label'], counts, crop_prices
+
+    rows = len(stored)
+    crop_types = stored['crop_type'].fillna('')
+    X_stored = feature_matrix(
+        crop_types, stored['storage_method'].fillna(''), stored['weather_condition'].fillna(''),
+        np.full(rows, DEFAULT_HUMIDITY), np.full(rows, DEFAULT_TEMPERATURE), np.full(rows, DEFAULT_STORAGE_DAYS),
+        np.zeros(rows), stored['quantity'].fillna(DEFAULT_QUANTITY),
+        [market_price(crop_prices, crop) for crop in crop_types.tolist()]
+    )
+    y_stored = np.digitize(stored['predicted_loss'].to_numpy(dtype=float), (MEDIUM_LOSS, HIGH_LOSS), right=True)
+    return np.vstack([X_stored, X_synthetic]), np.concatenate([y_stored, lots['label']]), counts, crop_prices
+
+
+def train(path=MODEL_PATH, synthetic_rows=SYNTHETIC_ROWS, seed=0):
+    """Fit the ensemble, save it to path and return the saved bundle"""
+    started = time.time()
+    X, y, counts, crop_prices = load_training_data(synthetic_rows, seed)
+    if not counts['stored']:
+        print("⚠️ No rows in loss_predictions: training on teacher-labelled synthetic lots only")
+
+    scaler = ml_loader.get_estimator('StandardScaler')
+    members = {
+        'rf': ml_loader.get_estimator('RandomForestClassifier')(n_estimators=60, max_depth=12, min_samples_leaf=2, random_state=seed),
+        'gb': ml_loader.get_estimator('GradientBoostingClassifier')(n_estimators=120, max_depth=3, random_state=seed),
+        'nn': ml_loader.get_estimator('make_pipeline')(
+            scaler(), ml_loader.get_estimator('MLPClassifier')(hidden_layer_sizes=(32, 16), max_iter=400, random_state=seed)
+        )
+    }
+    for name, model in members.items():
+        model.fit(X, y)
+        print(f"🧠 Trained {name} on {len(y)} rows")
+
+    bundle = {
+        'version': MODEL_VERSION,
+        'features': FEATURES,
+        'classes': CLASSES,
+        'members': members,
+        'weights': MEMBER_WEIGHTS,
+        'market_prices': crop_prices,
+        'rows': counts,
+        'trained_at': time.time()
+    }
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    # Uncompressed so the tree and weight arrays can be memory-mapped on load
+    joblib.dump(bundle, path)
+    print(f"✅ Saved loss model to {path} in {time.time() - started:.1f}s ({counts['stored']} stored + {counts['synthetic']} synthetic rows)")
+
+    global _bundle, _row_scorer
+    with _lock:
+        _row_scorer = _checked_row_scorer(bundle)
+        _bundle = bundle
+    _predict_rounded.cache_clear()
+    return bundle
+
+
+class RowScorer:
+    """Pure-Python copy of a fitted ensemble for scoring one lot at a time.
+
+    sklearn's predict_proba costs milliseconds per call whatever the batch
+    size (input validation, per-tree dispatch). For a single row it is far
+    cheaper to walk the flattened trees and run the MLP forward pass
+    directly from the fitted arrays.
+    """
+
+    def __init__(self, bundle):
+        np = ml_loader.numpy()
+        members = bundle['members']
+        self.weights = [bundle['weights'][name] for name in ('rf', 'gb', 'nn')]
+
+        # Random forest: class distribution at each leaf
+        self.forest = []
+        for estimator in members['rf'].estimators_:
+            values = estimator.tree_.value[:, 0, :]
+            totals = values.sum(axis=1, keepdims=True)
+            self.forest.append(self._flatten(estimator.tree_, (values / np.where(totals == 0, 1, totals)).tolist()))
+
+        # Gradient boosting: one regression tree per stage and class, plus a constant start score
+        gb = members['gb']
+        self.learning_rate = gb.learning_rate
+        self.stages = [[self._flatten(tree.tree_, tree.tree_.value[:, 0, 0].tolist()) for tree in stage]
+                       for stage in gb.estimators_]
+        probe = np.zeros((1, len(FEATURES)))
+        self.init_score = (gb.decision_function(probe)[0] - self._boosting_sum(probe[0].tolist())).tolist()
+
+        # MLP behind a StandardScaler
+        scaler, mlp = members['nn'][0], members['nn'][-1]
+        self.mean, self.scale = scaler.mean_, scaler.scale_
+        self.layers = list(zip(mlp.coefs_, mlp.intercepts_))
+
+    @staticmethod
+    def _flatten(tree, values):
+        return (tree.children_left.tolist(), tree.children_right.tolist(),
+                tree.feature.tolist(), tree.threshold.tolist(), values)
+
+    @staticmethod
+    def _leaf(tree, x):
+        left, right, feature, threshold, values = tree
+        node = 0
+        while left[node] != -1:
+            node = left[node] if x[feature[node]] <= threshold[node] else right[node]
+        return values[node]
+
+    def _boosting_sum(self, x):
+        sums = [0.0] * len(self.stages[0])
+        for stage in self.stages:
+            for k, tree in enumerate(stage):
+                sums[k] += self._leaf(tree, x)
+        return ml_loader.numpy().array(sums) * self.learning_rate
+
+    def predict_proba(self, row):
+        """Weighted ensemble probabilities for one feature row"""
+        np = ml_loader.numpy()
+        # Trees split on float32 inputs
+        x = np.asarray(row, dtype=np.float32).tolist()
+
+        forest = np.mean([self._leaf(tree, x) for tree in self.forest], axis=0)
+
+        raw = np.array(self.init_score) + self._boosting_sum(x)
+        boosting = np.exp(raw - raw.max())
+        boosting /= boosting.sum()
+
+        hidden = (np.asarray(row, dtype=float) - self.mean) / self.scale
+        for coefs, intercepts in self.layers[:-1]:
+            hidden = np.maximum(hidden @ coefs + intercepts, 0)
+        output = hidden @ self.layers[-1][0] + self.layers[-1][1]
+        network = np.exp(output - output.max())
+        network /= network.sum()
+
+        rf_weight, gb_weight, nn_weight = self.weights
+        return (rf_weight * forest + gb_weight * boosting + nn_weight * network) / sum(self.weights)
+
+
+def load_model(path=MODEL_PATH):
+    """Return the saved ensemble, loading it once per process (None if not trained)"""
+    global _bundle, _row_scorer
+    if _bundle is not None:
+        return _bundle
+
+    with _lock:
+        if _bundle is None and os.path.exists(path):
+            started = time.perf_counter()
+            bundle = joblib.load(path, mmap_mode='r')
+            if bundle.get('version') == MODEL_VERSION and tuple(bundle.get('features', ())) == FEATURES:
+                _row_scorer = _checked_row_scorer(bundle)
+                _bundle = bundle
+                print(f"🧠 Loaded loss model in {(time.perf_counter() - started) * 1000:.0f} ms")
+            else:
+                print(f"⚠️ Ignoring outdated loss model at {path}; retrain with: python loss_model.py")
+    return _bundle
+
+
+def _checked_row_scorer(bundle):
+    """Build the single-row scorer, or return None if it disagrees with sklearn"""
+    np = ml_loader.numpy()
+    try:
+        scorer = RowScorer(bundle)
+        lots = synthetic_lots(64, seed=1)
+        X = feature_matrix(lots['crop_type'], lots['storage_method'], lots['weather_condition'], lots['humidity'],
+                           lots['temperature'], lots['storage_days'], lots['pest_signs'], lots['quantity'])
+        expected = _ensemble_proba(bundle, X)
+        if np.allclose([scorer.predict_proba(row) for row in X], expected, atol=1e-6):
+            return scorer
+        print("⚠️ Single-row loss scorer disagrees with the fitted models; using batch scoring only")
+    except Exception as e:
+        print(f"⚠️ Single-row loss scorer unavailable: {e}")
+    return None
+
+
+def _ensemble_proba(bundle, X):
+    probabilities = sum(weight * bundle['members'][name].predict_proba(X) for name, weight in bundle['weights'].items())
+    return probabilities / sum(bundle['weights'].values())
+
+
+def predict_batch(X):
+    """Score a feature matrix; return (class indices, probabilities) or None if untrained"""
+    bundle = load_model()
+    if bundle is None:
+        return None
+
+    probabilities = _ensemble_proba(bundle, X)
+    return probabilities.argmax(axis=1), probabilities
+
+
+@functools.lru_cache(maxsize=4096)
+def _predict_rounded(crop_type, storage_method, weather_condition, humidity, temperature, storage_days, pest_signs, quantity):
+    # Same per-crop prices the model was trained on
+    price = market_price(_bundle['market_prices'], crop_type)
+    if _row_scorer is None:
+        probabilities = predict_batch(feature_matrix([crop_type], [storage_method], [weather_condition], [humidity],
+                                                     [temperature], [storage_days], [pest_signs], [quantity],
+                                                     [price]))[1][0]
+    else:
+        probabilities = _row_scorer.predict_proba([
+            risk_tables.crops.row(crop_type)[risk_tables.RF],
+            risk_tables.storage.row(storage_method)[risk_tables.RF],
+            risk_tables.weather.row(weather_condition)[risk_tables.RF],
+            humidity, temperature, storage_days, pest_signs,
+            math.log1p(quantity),
+            price
+        ])
+    return CLASSES[int(probabilities.argmax())], tuple(probabilities.tolist())
+
+
+def predict_one(crop_type, storage_method, weather_condition, humidity, temperature, storage_days, pest_signs, quantity=DEFAULT_QUANTITY):
+    """Score one lot; return (label, (p_low, p_medium, p_high)) or None if untrained"""
+    if load_model() is None:
+        return None
+    # Rounding keeps the memo small without changing the class in practice
+    return _predict_rounded(str(crop_type).strip().lower(), str(storage_method).strip().lower(),
+                            str(weather_condition).strip().lower(), round(float(humidity)),
+                            round(float(temperature)), int(storage_days), int(bool(pest_signs)),
+                            round(float(quantity), -1))
+
+
+if __name__ == '__main__':
+    from migrations import migrate
+
+    migrate()
+    train(synthetic_rows=int(sys.argv[1]) if len(sys.argv) > 1 else SYNTHETIC_ROWS)
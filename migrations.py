@@ -0,0 +1,570 @@
+"""Versioned, non-destructive schema migrations for harvestlink.db.
+
+Each migration runs exactly once per database. Applied versions are recorded
+in the schema_migrations table, so a steady-state boot only reads the current
+version and performs no DDL. When several workers start at once, the first
+one takes the write lock and applies pending migrations; the others wait on
+the lock, see the schema is current and carry on.
+
+Migrations carry frozen copies of the SQL and logic they need, so later
+changes to the application modules never change what an old migration does.
+Data derived with application logic (buyer coordinates and per-kg offers,
+price models) is instead recomputed by the current code once the last
+pending migration is applied, when the schema is the one that code expects.
+
+Run ``python migrations.py`` to migrate ahead of a deploy.
+"""
+import random
+import sqlite3
+
+from buyer_index import buyer_geo, parse_offer_price
+from database import DB_PATH, connect
+from price_forecast import forecaster
+
+
+def _columns(cursor, table):
+    """Return the column names of a table (empty if it does not exist)"""
+    return {row[1] for row in cursor.execute(f'PRAGMA table_info({table})')}
+
+
+def _rebuild_table(cursor, table, create_sql, copy_columns):
+    """Recreate a table with a new layout, keeping its rows"""
+    target_columns = ', '.join(copy_columns)
+    source_columns = ', '.join(copy_columns.values())
+    cursor.execute(create_sql.replace(f'CREATE TABLE {table}', f'CREATE TABLE {table}_new', 1))
+    cursor.execute(f'INSERT INTO {table}_new ({target_columns}) SELECT {source_columns} FROM {table}')
+    cursor.execute(f'DROP TABLE {table}')
+    cursor.execute(f'ALTER TABLE {table}_new RENAME TO {table}')
+
+
+FARMERS_SQL = '''
+    CREATE TABLE farmers (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        phone_number TEXT UNIQUE,
+        name TEXT,
+        location TEXT,
+        crop_type TEXT,
+        quantity INTEGER,
+        storage_method TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+'''
+
+BUYERS_SQL = '''
+    CREATE TABLE buyers (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT,
+        phone TEXT,
+        location TEXT,
+        crop_types TEXT,
+        price_range TEXT,
+        quantity_needed INTEGER,
+        verified BOOLEAN DEFAULT FALSE,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+'''
+
+
+def _baseline_schema(cursor):
+    """Create the core tables, adopting databases written by app_backup.py"""
+    farmer_columns = _columns(cursor, 'farmers')
+    if not farmer_columns:
+        cursor.execute(FARMERS_SQL)
+    elif 'phone_number' not in farmer_columns:
+        # Older databases keyed farmers on `phone` and stored crops in `crops`
+        _rebuild_table(cursor, 'farmers', FARMERS_SQL, {
+            'id': 'id', 'phone_number': 'phone', 'name': 'name', 'location': 'location',
+            'crop_type': 'crops', 'created_at': 'created_at'
+        })
+
+    buyer_columns = _columns(cursor, 'buyers')
+    if not buyer_columns:
+        cursor.execute(BUYERS_SQL)
+    elif 'crop_types' not in buyer_columns:
+        # Older databases stored crops in `crops_interested` and had no vetting flag
+        _rebuild_table(cursor, 'buyers', BUYERS_SQL, {
+            'id': 'id', 'name': 'name', 'phone': 'phone', 'location': 'location',
+            'crop_types': 'crops_interested', 'price_range': 'price_range',
+            'verified': '1', 'created_at': 'created_at'
+        })
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS ussd_sessions (
+            session_id TEXT PRIMARY KEY,
+            data TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS transactions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            farmer_id INTEGER,
+            buyer_id INTEGER,
+            crop_type TEXT,
+            quantity REAL,
+            price REAL,
+            transaction_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (farmer_id) REFERENCES farmers (id),
+            FOREIGN KEY (buyer_id) REFERENCES buyers (id)
+        )
+    ''')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS loss_predictions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            farmer_id INTEGER,
+            crop_type TEXT,
+            quantity REAL,
+            storage_method TEXT,
+            weather_condition TEXT,
+            predicted_loss REAL,
+            mitigation_advice TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (farmer_id) REFERENCES farmers (id)
+        )
+    ''')
+
+
+def _seed_buyers(cursor):
+    """Add the sample verified buyers to an empty buyers table"""
+    if cursor.execute('SELECT COUNT(*) FROM buyers').fetchone()[0]:
+        return
+
+    buyers_data = [
+        ('AgriCorp Kenya', '+254700000001', 'Nairobi', 'maize,wheat,rice', 'KES 3.0-3.5/kg', 1000),
+        ('FarmFresh Ltd', '+254700000002', 'Mombasa', 'tomatoes,onions', 'KES 8.0-10.0/kg', 500),
+        ('ExportCo Africa', '+254700000003', 'Kisumu', 'maize,beans', 'KES 3.2-3.8/kg', 2000),
+        ('Local Market Co', '+254700000004', 'Nakuru', 'potatoes,wheat', 'KES 2.5-3.0/kg', 800),
+        ('GreenValley Foods', '+254700000005', 'Eldoret', 'rice,maize', 'KES 2.8-3.2/kg', 1500)
+    ]
+
+    cursor.executemany('''
+        INSERT INTO buyers (name, phone, location, crop_types, price_range, quantity_needed, verified)
+        VALUES (?, ?, ?, ?, ?, ?, 1)
+    ''', buyers_data)
+
+
+def _buyer_crops_index(cursor):
+    """Normalize buyers.crop_types into an indexed buyer_crops join table"""
+    cursor.execute('''
+        CREATE TABLE buyer_crops (
+            crop TEXT NOT NULL,
+            buyer_id INTEGER NOT NULL,
+            verified INTEGER NOT NULL DEFAULT 0,
+            sample_key REAL NOT NULL,
+            PRIMARY KEY (crop, buyer_id)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('CREATE INDEX idx_buyer_crops_sample ON buyer_crops (crop, verified, sample_key)')
+    cursor.execute('CREATE INDEX idx_buyer_crops_buyer ON buyer_crops (buyer_id)')
+
+    # Keep the denormalized verified flag and deletions in step with buyers
+    cursor.execute('''
+        CREATE TRIGGER buyers_verified_sync AFTER UPDATE OF verified ON buyers
+        BEGIN
+            UPDATE buyer_crops SET verified = NEW.verified WHERE buyer_id = NEW.id;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER buyers_delete_sync AFTER DELETE ON buyers
+        BEGIN
+            DELETE FROM buyer_crops WHERE buyer_id = OLD.id;
+        END
+    ''')
+
+    rows = []
+    for buyer_id, crop_types, verified in cursor.execute('SELECT id, crop_types, verified FROM buyers').fetchall():
+        crops = dict.fromkeys(crop.strip().lower() for crop in (crop_types or '').split(','))
+        rows += [(crop, buyer_id, 1 if verified else 0, random.random()) for crop in crops if crop]
+    cursor.executemany('INSERT INTO buyer_crops (crop, buyer_id, verified, sample_key) VALUES (?, ?, ?, ?)', rows)
+
+
+def _chat_cache(cursor):
+    """Persistent store for formatted /api/chat answers"""
+    cursor.execute('''
+        CREATE TABLE chat_cache (
+            cache_key TEXT PRIMARY KEY,
+            response TEXT NOT NULL,
+            created_at REAL NOT NULL
+        )
+    ''')
+    cursor.execute('CREATE INDEX idx_chat_cache_created ON chat_cache (created_at)')
+
+
+def _jobs(cursor):
+    """Background job queue; also stores analyses by analysis_id"""
+    cursor.execute('''
+        CREATE TABLE jobs (
+            id TEXT PRIMARY KEY,
+            kind TEXT NOT NULL,
+            payload TEXT,
+            status TEXT NOT NULL DEFAULT 'queued',
+            result TEXT,
+            error TEXT,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL
+        )
+    ''')
+    cursor.execute('CREATE INDEX idx_jobs_queue ON jobs (status, created_at)')
+
+
+def _weather_snapshot(cursor):
+    """Last good weather reading per location, used to warm new processes"""
+    cursor.execute('''
+        CREATE TABLE weather_snapshot (
+            location TEXT PRIMARY KEY,
+            data TEXT NOT NULL,
+            fetched_at REAL NOT NULL
+        )
+    ''')
+
+
+def _price_models(cursor):
+    """Transaction locations and incremental price models"""
+    if 'location' not in _columns(cursor, 'transactions'):
+        cursor.execute('ALTER TABLE transactions ADD COLUMN location TEXT')
+    cursor.execute('''
+        UPDATE transactions SET location = (SELECT location FROM farmers WHERE farmers.id = transactions.farmer_id)
+        WHERE location IS NULL
+    ''')
+    cursor.execute('''
+        CREATE TABLE price_models (
+            crop TEXT NOT NULL,
+            location TEXT NOT NULL,
+            stats TEXT NOT NULL,
+            origin REAL NOT NULL,
+            weight REAL NOT NULL,
+            count INTEGER NOT NULL,
+            params TEXT NOT NULL,
+            updated_at REAL NOT NULL,
+            PRIMARY KEY (crop, location)
+        ) WITHOUT ROWID
+    ''')
+
+
+# Group key of a transaction row in the aggregates of migration 8
+_AGGREGATE_KEY = {'crop': "LOWER(TRIM({row}crop_type))", 'location': "COALESCE({row}location, '')",
+                  'day': "DATE({row}transaction_date)"}
+
+_AGGREGATE_RECOMPUTE_DAY = '''
+    DELETE FROM price_aggregates WHERE crop = {crop} AND location = {location} AND day = {day};
+    INSERT INTO price_aggregates (crop, location, day, count, total, total_sq, min_price, max_price)
+    SELECT {crop}, {location}, {day}, COUNT(*), SUM(price), SUM(price * price), MIN(price), MAX(price)
+    FROM transactions
+    WHERE DATE(transaction_date) = {day}
+      AND LOWER(TRIM(crop_type)) = {crop} AND COALESCE(location, '') = {location}
+      AND price IS NOT NULL
+    GROUP BY 1, 2, 3;
+'''
+
+
+def _aggregate_key(row):
+    return {name: template.format(row=row) for name, template in _AGGREGATE_KEY.items()}
+
+
+def _backfill_price_aggregates(cursor):
+    """Recompute every price_aggregates row from the transactions"""
+    key = _aggregate_key('')
+    cursor.execute('DELETE FROM price_aggregates')
+    cursor.execute(f'''
+        INSERT INTO price_aggregates (crop, location, day, count, total, total_sq, min_price, max_price)
+        SELECT {key['crop']}, {key['location']}, {key['day']},
+               COUNT(*), SUM(price), SUM(price * price), MIN(price), MAX(price)
+        FROM transactions
+        WHERE price IS NOT NULL AND crop_type IS NOT NULL AND transaction_date IS NOT NULL
+        GROUP BY 1, 2, 3
+    ''')
+
+
+def _price_aggregates(cursor):
+    """Trigger-maintained daily price aggregates"""
+    cursor.execute('''
+        CREATE TABLE price_aggregates (
+            crop TEXT NOT NULL,
+            location TEXT NOT NULL,
+            day TEXT NOT NULL,
+            count INTEGER NOT NULL,
+            total REAL NOT NULL,
+            total_sq REAL NOT NULL,
+            min_price REAL NOT NULL,
+            max_price REAL NOT NULL,
+            PRIMARY KEY (crop, location, day)
+        ) WITHOUT ROWID
+    ''')
+    # Lets update/delete triggers find one day's trades without a scan
+    cursor.execute('CREATE INDEX idx_transactions_day ON transactions (DATE(transaction_date))')
+
+    new = _aggregate_key('NEW.')
+    cursor.execute(f'''
+        CREATE TRIGGER transactions_aggregate_insert AFTER INSERT ON transactions
+        WHEN NEW.price IS NOT NULL AND NEW.crop_type IS NOT NULL AND NEW.transaction_date IS NOT NULL
+        BEGIN
+            INSERT INTO price_aggregates (crop, location, day, count, total, total_sq, min_price, max_price)
+            VALUES ({new['crop']}, {new['location']}, {new['day']}, 1, NEW.price, NEW.price * NEW.price, NEW.price, NEW.price)
+            ON CONFLICT (crop, location, day) DO UPDATE SET
+                count = count + 1,
+                total = total + excluded.total,
+                total_sq = total_sq + excluded.total_sq,
+                min_price = MIN(min_price, excluded.min_price),
+                max_price = MAX(max_price, excluded.max_price);
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER transactions_aggregate_delete AFTER DELETE ON transactions
+        WHEN OLD.price IS NOT NULL AND OLD.crop_type IS NOT NULL AND OLD.transaction_date IS NOT NULL
+        BEGIN
+            {_AGGREGATE_RECOMPUTE_DAY.format(**_aggregate_key('OLD.'))}
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER transactions_aggregate_update
+        AFTER UPDATE OF crop_type, location, price, transaction_date ON transactions
+        BEGIN
+            {_AGGREGATE_RECOMPUTE_DAY.format(**_aggregate_key('OLD.'))}
+            {_AGGREGATE_RECOMPUTE_DAY.format(**new)}
+        END
+    ''')
+    _backfill_price_aggregates(cursor)
+
+
+def _buyer_locations(cursor):
+    """Buyer coordinates, geo grid cells and numeric offer prices (filled in by _refresh_buyer_columns)"""
+    for column, kind in (('latitude', 'REAL'), ('longitude', 'REAL'), ('geo_cell', 'INTEGER'), ('offer_price', 'REAL')):
+        cursor.execute(f'ALTER TABLE buyers ADD COLUMN {column} {kind}')
+    cursor.execute('ALTER TABLE buyer_crops ADD COLUMN geo_cell INTEGER')
+
+    cursor.execute('CREATE INDEX idx_buyer_crops_geo ON buyer_crops (crop, verified, geo_cell)')
+    cursor.execute('CREATE INDEX idx_buyers_geo ON buyers (verified, geo_cell)')
+
+    # Keep the denormalized cell on buyer_crops in step with buyers
+    cursor.execute('''
+        CREATE TRIGGER buyer_crops_geo_insert AFTER INSERT ON buyer_crops
+        BEGIN
+            UPDATE buyer_crops SET geo_cell = (SELECT geo_cell FROM buyers WHERE id = NEW.buyer_id)
+            WHERE crop = NEW.crop AND buyer_id = NEW.buyer_id;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER buyers_geo_sync AFTER UPDATE OF geo_cell ON buyers
+        BEGIN
+            UPDATE buyer_crops SET geo_cell = NEW.geo_cell WHERE buyer_id = NEW.id;
+        END
+    ''')
+
+
+def _matches(cursor):
+    """Batch farmer-to-buyer assignments and the runs that produced them"""
+    cursor.execute('''
+        CREATE TABLE matches (
+            farmer_id INTEGER NOT NULL,
+            buyer_id INTEGER NOT NULL,
+            crop TEXT NOT NULL,
+            quantity REAL NOT NULL,
+            distance_km REAL,
+            net_price REAL,
+            run_id INTEGER,
+            PRIMARY KEY (farmer_id, buyer_id)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('CREATE INDEX idx_matches_buyer ON matches (buyer_id)')
+    cursor.execute('''
+        CREATE TABLE match_runs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            started_at REAL NOT NULL,
+            finished_at REAL,
+            lots INTEGER,
+            buyers INTEGER,
+            matches INTEGER,
+            lot_kg REAL,
+            matched_kg REAL
+        )
+    ''')
+
+
+def _ussd_session_expiry(cursor):
+    """Expiry time on persisted USSD sessions"""
+    cursor.execute('ALTER TABLE ussd_sessions ADD COLUMN expires_at REAL')
+    # Older rows were never expired and belong to dialogues long over
+    cursor.execute('DELETE FROM ussd_sessions')
+    cursor.execute('CREATE INDEX idx_ussd_sessions_expiry ON ussd_sessions (expires_at)')
+
+
+def _outbound_dead_letters(cursor):
+    """Outbound messages that could not be delivered"""
+    cursor.execute('''
+        CREATE TABLE outbound_dead_letters (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            provider TEXT NOT NULL,
+            recipient TEXT NOT NULL,
+            body TEXT NOT NULL,
+            attempts INTEGER NOT NULL,
+            error TEXT,
+            queued_at REAL NOT NULL,
+            failed_at REAL NOT NULL
+        )
+    ''')
+    cursor.execute('CREATE INDEX idx_outbound_dead_letters_failed ON outbound_dead_letters (failed_at)')
+
+
+def _webhook_messages(cursor):
+    """Provider message ids already ingested, with the reply sent for each"""
+    cursor.execute('''
+        CREATE TABLE webhook_messages (
+            provider TEXT NOT NULL,
+            message_id TEXT NOT NULL,
+            reply TEXT,
+            received_at REAL NOT NULL,
+            PRIMARY KEY (provider, message_id)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('CREATE INDEX idx_webhook_messages_received ON webhook_messages (received_at)')
+
+
+def _broadcast_campaigns(cursor):
+    """Alert campaigns and their resumable progress"""
+    cursor.execute('''
+        CREATE TABLE broadcast_campaigns (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            provider TEXT NOT NULL,
+            crop TEXT,
+            location TEXT,
+            status TEXT NOT NULL,
+            last_farmer_id INTEGER NOT NULL DEFAULT 0,
+            sent INTEGER NOT NULL DEFAULT 0,
+            failed INTEGER NOT NULL DEFAULT 0,
+            skipped INTEGER NOT NULL DEFAULT 0,
+            segments INTEGER NOT NULL DEFAULT 0,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL,
+            finished_at REAL
+        )
+    ''')
+
+
+def _normalized_prices(cursor):
+    """Title-cased trade locations (buyer offers are re-read by _refresh_buyer_columns)"""
+    # Trades copied from farmers (migration 7) kept the farmer's spelling; lookups use the title-cased form
+    updates = []
+    for transaction_id, location in cursor.execute(
+        'SELECT id, location FROM transactions WHERE location IS NOT NULL'
+    ).fetchall():
+        normalized = ' '.join(location.split()).title() or None
+        if normalized != location:
+            updates.append((normalized, transaction_id))
+    cursor.executemany('UPDATE transactions SET location = ? WHERE id = ?', updates)
+    _backfill_price_aggregates(cursor)
+
+
+def _per_kg_offers(cursor):
+    """Offers marked '/kg' that migration 15 took for market-scale quotes (re-read by _refresh_buyer_columns)"""
+
+
+def _refresh_buyer_columns(cursor):
+    """Coordinates, grid cell and per-kg offer of every buyer, from the current gazetteer and offer parser"""
+    cursor.executemany(
+        'UPDATE buyers SET latitude = ?, longitude = ?, geo_cell = ?, offer_price = ? WHERE id = ?',
+        [(*buyer_geo(location), parse_offer_price(price_range, crop_types), buyer_id)
+         for buyer_id, location, price_range, crop_types in cursor.execute(
+             'SELECT id, location, price_range, crop_types FROM buyers'
+         ).fetchall()]
+    )
+
+
+def _refresh_price_models(cursor):
+    """Refit every price model from the daily aggregates"""
+    forecaster.rebuild(cursor)
+
+
+# (version, description, function) - append new migrations, never edit applied ones
+MIGRATIONS = [
+    (1, 'baseline schema', _baseline_schema),
+    (2, 'seed sample buyers', _seed_buyers),
+    (3, 'buyer_crops index', _buyer_crops_index),
+    (4, 'chat response cache', _chat_cache),
+    (5, 'background jobs', _jobs),
+    (6, 'weather snapshot', _weather_snapshot),
+    (7, 'transaction locations and price models', _price_models),
+    (8, 'daily price aggregates', _price_aggregates),
+    (9, 'buyer locations and geo index', _buyer_locations),
+    (10, 'batch buyer matches', _matches),
+    (11, 'USSD session expiry', _ussd_session_expiry),
+    (12, 'outbound dead letters', _outbound_dead_letters),
+    (13, 'webhook message dedup', _webhook_messages),
+    (14, 'broadcast campaigns', _broadcast_campaigns),
+    (15, 'normalized price locations and buyer offers', _normalized_prices),
+    (16, 'per-kg buyer offers', _per_kg_offers),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+# Derived data to recompute, in this order, after applying any of the listed migrations
+REFRESHES = [
+    (_refresh_buyer_columns, {9, 15, 16}),
+    (_refresh_price_models, {7, 8, 15}),
+]
+
+
+def _current_version(cursor):
+    """Return the highest applied migration version (0 for a new database)"""
+    try:
+        row = cursor.execute('SELECT MAX(version) FROM schema_migrations').fetchone()
+    except sqlite3.OperationalError:
+        return 0
+    return row[0] or 0
+
+
+def migrate(db_path=DB_PATH):
+    """Apply pending migrations and return the resulting schema version"""
+    conn = connect(db_path)
+    cursor = conn.cursor()
+
+    try:
+        # Steady state: one read, no locks, no DDL
+        version = _current_version(cursor)
+        if version >= LATEST_VERSION:
+            return version
+
+        # Take the write lock so concurrent workers migrate one at a time
+        cursor.execute('BEGIN IMMEDIATE')
+        try:
+            version = _current_version(cursor)
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS schema_migrations (
+                    version INTEGER PRIMARY KEY,
+                    description TEXT,
+                    applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+
+            applied = set()
+            for migration_version, description, apply in MIGRATIONS:
+                if migration_version <= version:
+                    continue
+                apply(cursor)
+                cursor.execute(
+                    'INSERT INTO schema_migrations (version, description) VALUES (?, ?)',
+                    (migration_version, description)
+                )
+                print(f"🗄️ Applied migration {migration_version}: {description}")
+                version = migration_version
+                applied.add(migration_version)
+
+            for refresh, versions in REFRESHES:
+                if applied & versions:
+                    refresh(cursor)
+
+            cursor.execute('COMMIT')
+        except Exception:
+            cursor.execute('ROLLBACK')
+            raise
+
+        return version
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    print(f"✅ Database schema at version {migrate()}")
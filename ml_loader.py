@@ -0,0 +1,77 @@
+"""Lazy loader for the heavy ML stack (numpy, pandas, scikit-learn).
+
+Importing pandas and a dozen scikit-learn modules costs several seconds on a
+free-tier instance, and every gunicorn worker pays it again. Nothing on the
+request paths needs them, so they are imported the first time a model-backed
+code path asks for them and cached for the lifetime of the process.
+"""
+import importlib
+import threading
+import time
+
+# Estimator name -> module that defines it
+ESTIMATORS = {
+    'RandomForestClassifier': 'sklearn.ensemble',
+    'GradientBoostingClassifier': 'sklearn.ensemble',
+    'VotingClassifier': 'sklearn.ensemble',
+    'KMeans': 'sklearn.cluster',
+    'DBSCAN': 'sklearn.cluster',
+    'AgglomerativeClustering': 'sklearn.cluster',
+    'StandardScaler': 'sklearn.preprocessing',
+    'RobustScaler': 'sklearn.preprocessing',
+    'PolynomialFeatures': 'sklearn.preprocessing',
+    'cross_val_score': 'sklearn.model_selection',
+    'GridSearchCV': 'sklearn.model_selection',
+    'classification_report': 'sklearn.metrics',
+    'confusion_matrix': 'sklearn.metrics',
+    'MLPClassifier': 'sklearn.neural_network',
+    'SVC': 'sklearn.svm',
+    'LogisticRegression': 'sklearn.linear_model',
+    'PCA': 'sklearn.decomposition',
+    'SelectKBest': 'sklearn.feature_selection',
+    'f_classif': 'sklearn.feature_selection',
+    'make_pipeline': 'sklearn.pipeline',
+}
+
+_modules = {}
+_load_times = {}
+_lock = threading.Lock()
+
+
+def load_module(name):
+    """Import a module on first use and return the cached module afterwards"""
+    module = _modules.get(name)
+    if module is not None:
+        return module
+
+    with _lock:
+        module = _modules.get(name)
+        if module is None:
+            started = time.perf_counter()
+            module = importlib.import_module(name)
+            _load_times[name] = time.perf_counter() - started
+            _modules[name] = module
+            print(f"🧠 Loaded {name} on demand in {_load_times[name] * 1000:.0f} ms")
+    return module
+
+
+def numpy():
+    """Return the numpy module, importing it on first use"""
+    return load_module('numpy')
+
+
+def pandas():
+    """Return the pandas module, importing it on first use"""
+    return load_module('pandas')
+
+
+def get_estimator(name):
+    """Return a scikit-learn class or function by name, importing it on first use"""
+    if name not in ESTIMATORS:
+        raise KeyError(f"Unknown ML component: {name}")
+    return getattr(load_module(ESTIMATORS[name]), name)
+
+
+def loaded_modules():
+    """Return the lazily loaded modules and how long each took to import"""
+    return {name: round(seconds * 1000, 1) for name, seconds in _load_times.items()}
@@ -0,0 +1,327 @@
+"""Background dispatcher for outbound WhatsApp/SMS messages.
+
+Webhook handlers used to call the provider inline, so a slow Twilio or Meta
+API held the webhook open until the provider retried it. Handlers now queue
+the reply and return; a fixed pool of worker threads per provider sends it.
+Each provider keeps one requests session whose keep-alive connection pool is
+sized to its worker count, so concurrency per provider is bounded and TLS
+connections are reused. A token bucket per provider holds sends under its
+throughput cap, and replies to farmers are queued ahead of bulk broadcast
+messages.
+
+Connection errors, timeouts, 429 and 5xx responses are retried with
+exponential backoff and jitter (Retry-After is honoured). A message that
+still fails after OUTBOUND_MAX_ATTEMPTS, or is rejected outright, goes to the
+outbound_dead_letters table. The queue itself is in memory, like the USSD
+session write-behind: a reply that is queued when the process dies is lost.
+
+Exercised against a local stand-in provider in tests/test_outbound.py.
+"""
+import abc
+import heapq
+import itertools
+import os
+import queue
+import random
+import threading
+import time
+
+import requests
+
+import database as db
+
+OUTBOUND_TIMEOUT = float(os.getenv('OUTBOUND_TIMEOUT', '10'))
+OUTBOUND_MAX_ATTEMPTS = int(os.getenv('OUTBOUND_MAX_ATTEMPTS', '5'))
+# First retry delay in seconds, doubled on every attempt up to OUTBOUND_MAX_BACKOFF
+OUTBOUND_BACKOFF = float(os.getenv('OUTBOUND_BACKOFF', '1'))
+OUTBOUND_MAX_BACKOFF = 60.0
+
+TWILIO_CONCURRENCY = int(os.getenv('TWILIO_CONCURRENCY', '4'))
+META_CONCURRENCY = int(os.getenv('META_CONCURRENCY', '4'))
+
+# Provider throughput caps in messages per second (0 = no cap)
+TWILIO_SMS_RATE = float(os.getenv('TWILIO_SMS_RATE', '10'))
+TWILIO_WHATSAPP_RATE = float(os.getenv('TWILIO_WHATSAPP_RATE', '80'))
+META_RATE = float(os.getenv('META_RATE', '80'))
+
+# Queue priorities: replies to a farmer go ahead of any broadcast backlog
+REPLY, BULK = 0, 1
+
+
+class RateLimiter:
+    """Token bucket shared by a provider's workers"""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or max(rate, 1.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a message may be sent"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class Provider(abc.ABC):
+    """A messaging API with its own pooled session, worker count and throughput cap"""
+
+    name = None
+    delivered_status = 200
+
+    def __init__(self, concurrency, rate=0):
+        self.concurrency = concurrency
+        self.limiter = RateLimiter(rate) if rate else None
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=concurrency)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    @abc.abstractmethod
+    def configured(self):
+        """True when the provider's credentials are set"""
+
+    @abc.abstractmethod
+    def request(self, recipient, body):
+        """URL and requests.post keyword arguments for one message"""
+
+
+class TwilioSMS(Provider):
+    """Twilio Messages API (SMS sender)"""
+
+    name = 'sms'
+    delivered_status = 201
+
+    def configured(self):
+        return bool(os.getenv('TWILIO_ACCOUNT_SID') and os.getenv('TWILIO_AUTH_TOKEN') and os.getenv('TWILIO_PHONE_NUMBER'))
+
+    def request(self, recipient, body):
+        account_sid = os.getenv('TWILIO_ACCOUNT_SID')
+        base_url = os.getenv('TWILIO_API_BASE', 'https://api.twilio.com')
+        return f"{base_url}/2010-04-01/Accounts/{account_sid}/Messages.json", {
+            'data': {'To': recipient, 'From': os.getenv('TWILIO_PHONE_NUMBER'), 'Body': body},
+            'auth': (account_sid, os.getenv('TWILIO_AUTH_TOKEN'))
+        }
+
+
+class TwilioWhatsApp(Provider):
+    """Twilio Messages API (WhatsApp sender)"""
+
+    name = 'twilio'
+    delivered_status = 201
+
+    def configured(self):
+        return bool(os.getenv('TWILIO_ACCOUNT_SID') and os.getenv('TWILIO_AUTH_TOKEN'))
+
+    def request(self, recipient, body):
+        account_sid = os.getenv('TWILIO_ACCOUNT_SID')
+        base_url = os.getenv('TWILIO_API_BASE', 'https://api.twilio.com')
+        if not recipient.startswith('whatsapp:'):
+            recipient = f"whatsapp:{recipient}"
+        return f"{base_url}/2010-04-01/Accounts/{account_sid}/Messages.json", {
+            'data': {
+                'To': recipient,
+                'From': os.getenv('TWILIO_WHATSAPP_NUMBER', 'whatsapp:+14155238886'),
+                'Body': body
+            },
+            'auth': (account_sid, os.getenv('TWILIO_AUTH_TOKEN'))
+        }
+
+
+class MetaWhatsApp(Provider):
+    """Meta WhatsApp Business Cloud API"""
+
+    name = 'meta'
+
+    def configured(self):
+        return bool(os.getenv('WHATSAPP_PHONE_NUMBER_ID') and os.getenv('WHATSAPP_ACCESS_TOKEN'))
+
+    def request(self, recipient, body):
+        base_url = os.getenv('META_GRAPH_BASE', 'https://graph.facebook.com')
+        return f"{base_url}/v18.0/{os.getenv('WHATSAPP_PHONE_NUMBER_ID')}/messages", {
+            'json': {
+                'messaging_product': 'whatsapp',
+                'to': recipient,
+                'type': 'text',
+                'text': {'body': body}
+            },
+            'headers': {'Authorization': f"Bearer {os.getenv('WHATSAPP_ACCESS_TOKEN')}"}
+        }
+
+
+def _retry_after(response):
+    """Seconds a provider asked us to wait, or None"""
+    try:
+        return float(response.headers.get('Retry-After'))
+    except (TypeError, ValueError):
+        return None
+
+
+class OutboundDispatcher:
+    """Per-provider worker pools with retry scheduling and a dead-letter table"""
+
+    def __init__(self, providers, timeout=OUTBOUND_TIMEOUT, max_attempts=OUTBOUND_MAX_ATTEMPTS,
+                 backoff=OUTBOUND_BACKOFF):
+        self.providers = {provider.name: provider for provider in providers}
+        self.timeout = timeout
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self._queues = {name: queue.PriorityQueue() for name in self.providers}
+        self._retries = []              # heap of (due, sequence, message)
+        self._sequence = itertools.count()
+        self._retry_ready = threading.Condition()
+        self._lock = threading.Lock()
+        self._pid = None
+        self.metrics = {'queued': 0, 'sent': 0, 'retried': 0, 'dead': 0, 'logged': 0, 'pending': 0}
+
+    def send(self, provider, recipient, body, priority=REPLY, on_done=None):
+        """Queue a message for delivery and return at once.
+
+        on_done(delivered) is called from a worker once the message is sent
+        or dead-lettered.
+        """
+        if provider not in self.providers:
+            raise ValueError(f"Unknown outbound provider: {provider}")
+        if not self.providers[provider].configured():
+            print(f"{provider} credentials not configured. Logging response instead:")
+            print(f"Response to {recipient}: {body}")
+            self._count('logged')
+            if on_done is not None:
+                on_done(True)
+            return
+        self.start()
+        with self._lock:
+            self.metrics['queued'] += 1
+            self.metrics['pending'] += 1
+        self._enqueue({'provider': provider, 'recipient': recipient, 'body': body, 'priority': priority,
+                       'on_done': on_done, 'attempts': 0, 'queued_at': time.time()})
+
+    def _enqueue(self, message):
+        self._queues[message['provider']].put((message['priority'], next(self._sequence), message))
+
+    def _count(self, metric):
+        with self._lock:
+            self.metrics[metric] += 1
+
+    def start(self):
+        """Start the worker pools and the retry scheduler once per process"""
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+        for provider in self.providers.values():
+            for number in range(provider.concurrency):
+                threading.Thread(target=self._work, args=(provider,), name=f'outbound-{provider.name}-{number}',
+                                 daemon=True).start()
+        threading.Thread(target=self._schedule_retries, name='outbound-retries', daemon=True).start()
+
+    def _work(self, provider):
+        pending = self._queues[provider.name]
+        while True:
+            message = pending.get()[2]
+            try:
+                if provider.limiter is not None:
+                    provider.limiter.acquire()
+                self._deliver(provider, message)
+            except Exception as e:
+                print(f"❌ Outbound {provider.name} worker error: {e}")
+                self._finish(message, False)
+
+    def _deliver(self, provider, message):
+        message['attempts'] += 1
+        delay = None
+        try:
+            url, kwargs = provider.request(message['recipient'], message['body'])
+            response = provider.session.post(url, timeout=self.timeout, **kwargs)
+        except requests.RequestException as e:
+            error, retryable = str(e), True
+        else:
+            if response.status_code == provider.delivered_status:
+                self._finish(message, True)
+                return
+            error = f"{response.status_code} - {response.text[:200]}"
+            retryable = response.status_code == 429 or response.status_code >= 500
+            delay = _retry_after(response)
+
+        if not retryable or message['attempts'] >= self.max_attempts:
+            self._dead_letter(message, error)
+            return
+        if delay is None:
+            delay = min(self.backoff * 2 ** (message['attempts'] - 1), OUTBOUND_MAX_BACKOFF)
+            delay *= random.uniform(0.5, 1.0)
+        self._count('retried')
+        with self._retry_ready:
+            heapq.heappush(self._retries, (time.time() + delay, next(self._sequence), message))
+            self._retry_ready.notify()
+
+    def _schedule_retries(self):
+        """Move retries back onto their provider queue once their backoff has passed"""
+        with self._retry_ready:
+            while True:
+                now = time.time()
+                while self._retries and self._retries[0][0] <= now:
+                    self._enqueue(heapq.heappop(self._retries)[2])
+                self._retry_ready.wait(self._retries[0][0] - now if self._retries else None)
+
+    def _finish(self, message, delivered):
+        with self._lock:
+            self.metrics['sent' if delivered else 'dead'] += 1
+            self.metrics['pending'] -= 1
+        if message['on_done'] is not None:
+            try:
+                message['on_done'](delivered)
+            except Exception as e:
+                print(f"❌ Outbound completion callback failed: {e}")
+
+    def _dead_letter(self, message, error):
+        print(f"❌ Outbound {message['provider']} message to {message['recipient']} failed "
+              f"after {message['attempts']} attempt(s): {error}")
+        try:
+            with db.transaction() as conn:
+                conn.execute('''
+                    INSERT INTO outbound_dead_letters (provider, recipient, body, attempts, error, queued_at, failed_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                ''', (message['provider'], message['recipient'], message['body'], message['attempts'], error,
+                      message['queued_at'], time.time()))
+        except Exception as e:
+            print(f"❌ Could not record dead letter: {e}")
+        self._finish(message, False)
+
+    def pending(self):
+        """Messages queued, waiting to retry or being sent"""
+        with self._lock:
+            return self.metrics['pending']
+
+    def drain(self, timeout=None):
+        """Wait until nothing is pending; returns False on timeout"""
+        deadline = None if timeout is None else time.time() + timeout
+        while self.pending():
+            if deadline is not None and time.time() > deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+    def stats(self):
+        """Return dispatcher counters for monitoring"""
+        with self._retry_ready:
+            retrying = len(self._retries)
+        with self._lock:
+            return dict(self.metrics, retrying=retrying,
+                        waiting={name: pending.qsize() for name, pending in self._queues.items()})
+
+
+dispatcher = OutboundDispatcher([
+    TwilioSMS(TWILIO_CONCURRENCY, TWILIO_SMS_RATE),
+    TwilioWhatsApp(TWILIO_CONCURRENCY, TWILIO_WHATSAPP_RATE),
+    MetaWhatsApp(META_CONCURRENCY, META_RATE),
+])
+
@@ -0,0 +1,126 @@
+"""Materialized per-crop, per-location, per-day price aggregates.
+
+price_aggregates holds count, sum, sum of squares, min and max of the
+transaction prices for each (crop, location, day). Triggers on the
+transactions table (created by migration 8) keep it current: an insert is a
+single upsert, and an update or delete recomputes only the day it touched
+(min and max cannot be decremented). Price displays read ranges and averages from here instead of
+running GROUP BY over every trade.
+
+Locations are keyed as written: forecaster.record stores them in the
+title-cased form lookups use (migration 15 normalized older rows). Trade
+prices are on the market reference scale (risk_tables FORECAST_PRICE), not
+KES/kg, so per-kg displays use per_kg_range to carry over only their spread.
+
+Rebuild the whole table from history with:  python price_aggregates.py
+"""
+import math
+import time
+
+import database as db
+
+# Window (days) used for market price ranges
+MARKET_WINDOW_DAYS = 30
+
+# Trades a location needs in the window before its own range is preferred over the crop-wide one
+MIN_LOCAL_TRADES = 3
+
+# Normalized group key of a transaction row, as the migration 8 triggers compute it
+_CROP = "LOWER(TRIM({row}crop_type))"
+_LOCATION = "COALESCE({row}location, '')"
+_DAY = "DATE({row}transaction_date)"
+
+
+def _key(row):
+    return {name: template.format(row=row) for name, template in (('crop', _CROP), ('location', _LOCATION), ('day', _DAY))}
+
+
+def backfill(conn):
+    """Recompute every aggregate row from the transactions table; returns the row count"""
+    conn.execute('DELETE FROM price_aggregates')
+    key = _key('')
+    conn.execute(f'''
+        INSERT INTO price_aggregates (crop, location, day, count, total, total_sq, min_price, max_price)
+        SELECT {key['crop']}, {key['location']}, {key['day']},
+               COUNT(*), SUM(price), SUM(price * price), MIN(price), MAX(price)
+        FROM transactions
+        WHERE price IS NOT NULL AND crop_type IS NOT NULL AND transaction_date IS NOT NULL
+        GROUP BY 1, 2, 3
+    ''')
+    return conn.execute('SELECT COUNT(*) FROM price_aggregates').fetchone()[0]
+
+
+def _summary(row, location):
+    count, total, total_sq, low, high = row
+    if not count:
+        return None
+    mean = total / count
+    return {
+        'location': location or None,
+        'count': count,
+        'mean': mean,
+        'std': math.sqrt(max(total_sq / count - mean * mean, 0.0)),
+        'min': low,
+        'max': high
+    }
+
+
+def market_summary(crop_type, location=None, days=MARKET_WINDOW_DAYS):
+    """Price count/mean/std/min/max over the last days, for a location or else the whole crop"""
+    crop = str(crop_type).strip().lower()
+    place = ' '.join(str(location or '').split()).title()
+    since = time.strftime('%Y-%m-%d', time.gmtime(time.time() - days * 86400))
+
+    with db.connection() as conn:
+        if place:
+            row = conn.execute('''
+                SELECT SUM(count), SUM(total), SUM(total_sq), MIN(min_price), MAX(max_price)
+                FROM price_aggregates WHERE crop = ? AND location = ? AND day >= ?
+            ''', (crop, place, since)).fetchone()
+            summary = _summary(row, place)
+            if summary is not None and summary['count'] >= MIN_LOCAL_TRADES:
+                return summary
+
+        row = conn.execute('''
+            SELECT SUM(count), SUM(total), SUM(total_sq), MIN(min_price), MAX(max_price)
+            FROM price_aggregates WHERE crop = ? AND day >= ?
+        ''', (crop, since)).fetchone()
+    return _summary(row, None)
+
+
+def per_kg_range(summary, price_per_kg):
+    """(low, high) KES/kg: a summary's min and max rescaled so its mean is price_per_kg"""
+    if summary['mean'] <= 0:
+        return price_per_kg, price_per_kg
+    scale = price_per_kg / summary['mean']
+    return summary['min'] * scale, summary['max'] * scale
+
+
+def daily_prices(crop_type, location=None, days=MARKET_WINDOW_DAYS):
+    """Per-day count/mean/min/max for a crop, across all locations unless one is given"""
+    crop = str(crop_type).strip().lower()
+    place = ' '.join(str(location or '').split()).title()
+    since = time.strftime('%Y-%m-%d', time.gmtime(time.time() - days * 86400))
+
+    with db.connection() as conn:
+        rows = conn.execute(f'''
+            SELECT day, SUM(count), SUM(total), MIN(min_price), MAX(max_price)
+            FROM price_aggregates
+            WHERE crop = ? {'AND location = ?' if place else ''} AND day >= ?
+            GROUP BY day ORDER BY day
+        ''', (crop, place, since) if place else (crop, since)).fetchall()
+
+    return [
+        {'day': day, 'count': count, 'mean': round(total / count, 2), 'min': low, 'max': high}
+        for day, count, total, low, high in rows
+    ]
+
+
+if __name__ == '__main__':
+    from migrations import migrate
+
+    migrate()
+    started = time.time()
+    with db.transaction() as conn:
+        rows = backfill(conn)
+    print(f"✅ Backfilled {rows} price aggregate rows in {time.time() - started:.1f}s")
@@ -0,0 +1,255 @@
+"""Incremental price forecasting over the transactions table.
+
+Each crop has one price series per location plus a crop-wide series. A
+series is modelled as a level, a local linear trend and an annual harmonic
+(sin/cos of the day of year), fitted by exponentially discounted least
+squares. The model keeps only its sufficient statistics (X'WX, X'Wy, y'Wy)
+in the price_models table, so recording a transaction updates it in O(1)
+instead of refitting. Forecasting 7/14/30 days ahead is a four-term dot
+product on cached parameters.
+
+Rebuild every model from the daily price aggregates with:  python price_forecast.py
+"""
+import json
+import math
+import os
+import threading
+import time
+
+import database as db
+import ml_loader
+
+# Observations lose half their weight after this many days
+PRICE_HALF_LIFE_DAYS = float(os.getenv('PRICE_HALF_LIFE_DAYS', '60'))
+DECAY_PER_DAY = 0.5 ** (1 / PRICE_HALF_LIFE_DAYS)
+
+FORECAST_HORIZONS = (7, 14, 30)
+
+# Series key used for a crop's prices across all locations
+ALL_LOCATIONS = ''
+
+# Ridge penalty per coefficient (level, trend, season sin, season cos), in
+# pseudo-observations; trend and season shrink to zero until the data shows them
+RIDGE = (0.0, 0.05, 4.0, 4.0)
+
+# Relative 30-day change beyond which the trend is reported as rising/falling
+TREND_THRESHOLD = 0.02
+
+# Discounted observations a location's own series needs before it is preferred over the crop-wide one
+MIN_LOCAL_WEIGHT = 3
+
+# Seconds a process keeps a model before re-reading it from SQLite
+MODEL_CACHE_TTL = 60
+
+_OMEGA = 2 * math.pi / 365.25
+_UNIX_EPOCH_JULIAN_DAY = 2440587.5
+_TERMS = 4
+
+# Day number, count, sum and sum of squares of the prices per (crop, location, day)
+_AGGREGATE_DAYS_SQL = '''
+    SELECT crop, location, julianday(day) + 0.5 - ?, count, total, total_sq
+    FROM price_aggregates
+    ORDER BY day
+'''
+# The same rows straight from the trades, for migration 7 (before the aggregates exist)
+def series_key(crop_type, location=ALL_LOCATIONS):
+    """Normalized (crop, location) key of a price series"""
+    return str(crop_type).strip().lower(), ' '.join(str(location or '').split()).title()
+
+
+def _features(day, origin):
+    return (1.0, (day - origin) / 365.0, math.sin(_OMEGA * day), math.cos(_OMEGA * day))
+
+
+class PriceModel:
+    """Discounted least-squares fit of one price series"""
+
+    def __init__(self, origin=None, xtx=None, xty=None, yy=0.0, weight=0.0, count=0, params=None):
+        self.origin = origin    # day (since the Unix epoch) the trend is measured from
+        self.xtx = xtx or [[0.0] * _TERMS for _ in range(_TERMS)]
+        self.xty = xty or [0.0] * _TERMS
+        self.yy = yy
+        self.weight = weight
+        self.count = count
+        self.params = params
+
+    def add(self, day, total, count=1, total_sq=None):
+        """Fold observed prices into the fit: one price, or a day's count/sum/sum of squares"""
+        if self.origin is None:
+            self.origin = day
+        elif day > self.origin:
+            self._advance(day)
+
+        # Late (back-dated) observations arrive already discounted
+        weight = DECAY_PER_DAY ** (self.origin - day)
+        x = _features(day, self.origin)
+        for i in range(_TERMS):
+            self.xty[i] += weight * x[i] * total
+            for j in range(_TERMS):
+                self.xtx[i][j] += weight * count * x[i] * x[j]
+        self.yy += weight * (total * total if total_sq is None else total_sq)
+        self.weight += weight * count
+        self.count += count
+        self._solve()
+
+    def _advance(self, day):
+        """Discount the statistics and move the trend origin forward to day"""
+        shift = day - self.origin
+        decay = DECAY_PER_DAY ** shift
+        # The trend feature becomes tau - shift/365: x' = A x with A = I except A[1][0] = -shift/365
+        step = shift / 365.0
+        xtx, xty = self.xtx, self.xty
+        row = [xtx[1][j] - step * xtx[0][j] for j in range(_TERMS)]
+        xtx[1] = row
+        for i in range(_TERMS):
+            xtx[i][1] -= step * xtx[i][0]
+        xty[1] -= step * xty[0]
+
+        self.xtx = [[value * decay for value in row] for row in xtx]
+        self.xty = [value * decay for value in xty]
+        self.yy *= decay
+        self.weight *= decay
+        self.origin = day
+
+    def _solve(self):
+        np = ml_loader.numpy()
+        self.params = np.linalg.solve(np.array(self.xtx) + np.diag(RIDGE), np.array(self.xty)).tolist()
+
+    def predict(self, day):
+        """Fitted price on a day"""
+        return sum(p * x for p, x in zip(self.params, _features(day, self.origin)))
+
+    def residual_std(self):
+        """Weighted standard deviation of the fit residuals"""
+        if self.weight <= 1:
+            return None
+        beta = self.params
+        fitted = sum(beta[i] * self.xty[i] for i in range(_TERMS))
+        quadratic = sum(beta[i] * self.xtx[i][j] * beta[j] for i in range(_TERMS) for j in range(_TERMS))
+        sse = max(self.yy - 2 * fitted + quadratic, 0.0)
+        return math.sqrt(sse / self.weight)
+
+    def to_row(self):
+        return json.dumps({'xtx': self.xtx, 'xty': self.xty, 'yy': self.yy}), self.origin, self.weight, self.count, json.dumps(self.params)
+
+    @classmethod
+    def from_row(cls, stats, origin, weight, count, params):
+        stats = json.loads(stats)
+        return cls(origin, stats['xtx'], stats['xty'], stats['yy'], weight, count, json.loads(params))
+
+
+class PriceForecaster:
+    """Records transactions, keeps the price models current and serves forecasts"""
+
+    def __init__(self, ttl=MODEL_CACHE_TTL):
+        self.ttl = ttl
+        self._models = {}   # (crop, location) -> (PriceModel or None, loaded_at)
+        self._lock = threading.Lock()
+
+    def record(self, conn, crop_type, quantity, price, location=None, transaction_date=None, farmer_id=None, buyer_id=None):
+        """Insert a transaction and update its price models (call inside a write transaction)"""
+        crop, place = series_key(crop_type, location)
+        row = conn.execute('''
+            INSERT INTO transactions (farmer_id, buyer_id, crop_type, quantity, price, location, transaction_date)
+            VALUES (?, ?, ?, ?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP))
+            RETURNING julianday(transaction_date) - ?
+        ''', (farmer_id, buyer_id, crop, quantity, price, place or None, transaction_date, _UNIX_EPOCH_JULIAN_DAY)).fetchone()
+
+        for key in {(crop, place), (crop, ALL_LOCATIONS)}:
+            model = self._read(conn, key) or PriceModel()
+            model.add(row[0], float(price))
+            self._write(conn, key, model)
+
+    def rebuild(self, conn):
+        """Refit every model from the daily price aggregates"""
+        models = {}
+        rows = conn.execute(_AGGREGATE_DAYS_SQL, (_UNIX_EPOCH_JULIAN_DAY,)).fetchall()
+
+        for crop, location, day, count, total, total_sq in rows:
+            for key in {(crop, location), (crop, ALL_LOCATIONS)}:
+                models.setdefault(key, PriceModel()).add(day, total, count, total_sq)
+
+        conn.execute('DELETE FROM price_models')
+        for key, model in models.items():
+            self._write(conn, key, model)
+        with self._lock:
+            self._models.clear()
+        return len(models)
+
+    def _read(self, conn, key):
+        row = conn.execute(
+            'SELECT stats, origin, weight, count, params FROM price_models WHERE crop = ? AND location = ?', key
+        ).fetchone()
+        return PriceModel.from_row(*row) if row else None
+
+    def _write(self, conn, key, model):
+        conn.execute('''
+            INSERT OR REPLACE INTO price_models (crop, location, stats, origin, weight, count, params, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', key + model.to_row() + (time.time(),))
+        with self._lock:
+            self._models[key] = (model, time.time())
+
+    def model(self, crop_type, location=ALL_LOCATIONS):
+        """Return the cached model for a series (None if it has no history)"""
+        key = series_key(crop_type, location)
+        cached = self._models.get(key)
+        if cached is not None and time.time() - cached[1] < self.ttl:
+            return cached[0]
+
+        with db.connection() as conn:
+            model = self._read(conn, key)
+        with self._lock:
+            self._models[key] = (model, time.time())
+        return model
+
+    def forecast(self, crop_type, location=None, horizons=FORECAST_HORIZONS):
+        """Forecast a crop's price, preferring the location's own series once it has enough data.
+
+        Returns None when the crop has no transactions, otherwise a dict with
+        the current fitted price, {days_ahead: price}, the trend
+        ('increasing'/'decreasing'/'stable') and a 0-100 confidence score.
+        """
+        series_location = series_key(crop_type, location)[1] if location else ALL_LOCATIONS
+        model = self.model(crop_type, series_location) if series_location else None
+        if model is None or model.weight < MIN_LOCAL_WEIGHT:
+            series_location = ALL_LOCATIONS
+            model = self.model(crop_type)
+        if model is None:
+            return None
+
+        today = time.time() / 86400
+        current = model.predict(today)
+        prices = {days: model.predict(today + days) for days in horizons}
+        change = prices[max(horizons)] / current - 1 if current > 0 else 0.0
+        if change > TREND_THRESHOLD:
+            trend = 'increasing'
+        elif change < -TREND_THRESHOLD:
+            trend = 'decreasing'
+        else:
+            trend = 'stable'
+
+        # More (recent) evidence and a tighter fit -> higher confidence
+        spread = model.residual_std()
+        fit = 1 - min(spread / current, 1) if spread is not None and current > 0 else 0.5
+        confidence = 100 * fit * model.weight / (model.weight + 5)
+
+        return {
+            'location': series_location or None,
+            'current': current,
+            'forecasts': prices,
+            'trend': trend,
+            'confidence': round(max(confidence, 0.0), 1),
+            'observations': model.count
+        }
+
+
+forecaster = PriceForecaster()
+
+
+if __name__ == '__main__':
+    from migrations import migrate
+
+    migrate()
+    with db.transaction() as conn:
+        print(f"✅ Rebuilt {forecaster.rebuild(conn)} price models")
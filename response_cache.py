@@ -0,0 +1,145 @@
+"""Response cache for /api/chat.
+
+Farmers ask the same few dozen questions over and over. Answers are cached
+under the normalized question plus the farm context (crop, location and a
+coarse quantity bucket) and the reply mode, since streamed replies may run
+longer than JSON ones, in an in-process LRU with TTL eviction and
+optionally written through to SQLite so they survive restarts. Entries are
+stored after format_ai_response, so a hit is returned as-is.
+"""
+import hashlib
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import database as db
+
+CHAT_CACHE_SIZE = int(os.getenv('CHAT_CACHE_SIZE', '2048'))
+CHAT_CACHE_TTL = int(os.getenv('CHAT_CACHE_TTL', str(24 * 3600)))
+CHAT_CACHE_PERSIST = os.getenv('CHAT_CACHE_PERSIST', '1') == '1'
+
+# Expired rows are purged from SQLite once every this many writes
+PURGE_EVERY = 500
+
+# Upper bounds (kg) of the quantity buckets used in cache keys
+QUANTITY_BUCKETS = (50, 100, 250, 500, 1000, 5000)
+
+_PUNCTUATION = re.compile(r'[^\w\s]')
+_WHITESPACE = re.compile(r'\s+')
+
+
+def normalize_message(message):
+    """Lowercase a question and strip punctuation and extra whitespace"""
+    message = _PUNCTUATION.sub(' ', message.lower())
+    return _WHITESPACE.sub(' ', message).strip()
+
+
+def quantity_bucket(quantity):
+    """Map a quantity in kg to a coarse bucket label"""
+    match = re.search(r'\d+(?:\.\d+)?', str(quantity))
+    if not match:
+        return 'unknown'
+    kg = float(match.group())
+    for upper in QUANTITY_BUCKETS:
+        if kg <= upper:
+            return f'<={upper}'
+    return f'>{QUANTITY_BUCKETS[-1]}'
+
+
+class ChatResponseCache:
+    """LRU + TTL cache of formatted chat answers with optional SQLite backing"""
+
+    def __init__(self, max_entries=CHAT_CACHE_SIZE, ttl=CHAT_CACHE_TTL, persist=CHAT_CACHE_PERSIST):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.persist = persist
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self._writes = 0
+
+    @staticmethod
+    def make_key(message, crop, location, quantity, mode='json'):
+        """Build the cache key for a question asked in a given farm context and reply mode"""
+        parts = (normalize_message(message), str(crop).strip().lower(),
+                 str(location).strip().lower(), quantity_bucket(quantity), mode)
+        return hashlib.sha1('|'.join(parts).encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """Return the cached answer for a key, or None on a miss"""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                response, stored_at = entry
+                if now - stored_at < self.ttl:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return response
+                del self._entries[key]
+
+        response = self._load(key, now) if self.persist else None
+        with self._lock:
+            if response is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return response
+
+    def put(self, key, response):
+        """Store a formatted answer"""
+        now = time.time()
+        self._remember(key, response, now)
+        if self.persist:
+            try:
+                with db.transaction() as conn:
+                    conn.execute('''
+                        INSERT OR REPLACE INTO chat_cache (cache_key, response, created_at)
+                        VALUES (?, ?, ?)
+                    ''', (key, response, now))
+                    with self._lock:
+                        self._writes += 1
+                        purge = self._writes % PURGE_EVERY == 0
+                    if purge:
+                        conn.execute('DELETE FROM chat_cache WHERE created_at <= ?', (now - self.ttl,))
+            except Exception as e:
+                print(f"Chat cache write error: {e}")
+
+    def _remember(self, key, response, stored_at):
+        with self._lock:
+            self._entries[key] = (response, stored_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _load(self, key, now):
+        """Read a non-expired answer from SQLite into memory"""
+        try:
+            with db.connection() as conn:
+                row = conn.execute(
+                    'SELECT response, created_at FROM chat_cache WHERE cache_key = ? AND created_at > ?',
+                    (key, now - self.ttl)
+                ).fetchone()
+        except Exception as e:
+            print(f"Chat cache read error: {e}")
+            return None
+
+        if row is None:
+            return None
+        self._remember(key, row[0], row[1])
+        return row[0]
+
+    def stats(self):
+        """Return hit/miss counters for monitoring"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+                'entries': len(self._entries),
+                'persistent': self.persist
+            }
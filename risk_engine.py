@@ -0,0 +1,81 @@
+"""Post-harvest loss risk scoring, one lot at a time or a whole batch at once.
+
+The quick loss estimate used by /api/analyze adds a weather, storage and
+crop-age risk, applies +/-5 points of noise and clamps to 5-35%. score_lot
+does that for one lot in plain Python; score_batch computes the same model
+over columnar NumPy arrays so cooperatives can score thousands of lots in a
+single pass. Both read their prices and risk factors from risk_tables.
+"""
+import random
+import re
+
+import ml_loader
+import risk_tables
+
+URGENCY_LEVELS = ("Low - Good Condition", "Medium - Monitor Closely", "High - Act Now!")
+
+MIN_LOSS_PERCENTAGE = 5
+MAX_LOSS_PERCENTAGE = 35
+
+_DAYS_AGO = re.compile(r'(\d+)\s*days ago')
+
+
+def crop_age_days(conditions):
+    """Days since harvest from text like 'harvested 4 days ago' (1 if not stated)"""
+    match = _DAYS_AGO.search(conditions or '')
+    return int(match.group(1)) if match else 1
+
+
+def base_price(crop_type):
+    """Base price in KES/kg for a crop"""
+    return risk_tables.crops.row(crop_type)[risk_tables.BASE_PRICE]
+
+
+def urgency_index(loss_percentage):
+    """0 = low, 1 = medium, 2 = high"""
+    if loss_percentage > 20:
+        return 2
+    if loss_percentage > 10:
+        return 1
+    return 0
+
+
+def score_lot(crop_type, quantity, humidity, storage_method, age_days):
+    """Score one lot and return (loss_percentage, estimated_loss_value, urgency_index)"""
+    weather_risk = risk_tables.weather_risk(humidity)
+    storage_risk = risk_tables.storage.row(storage_method)[risk_tables.QUICK_STORAGE_RISK]
+    crop_age_risk = 0.02 * age_days
+
+    loss_percentage = min(MAX_LOSS_PERCENTAGE, max(MIN_LOSS_PERCENTAGE, (weather_risk + storage_risk + crop_age_risk) * 100 + random.uniform(-5, 5)))
+    estimated_loss_value = quantity * (loss_percentage / 100) * base_price(crop_type)
+    return loss_percentage, estimated_loss_value, urgency_index(loss_percentage)
+
+
+def score_batch(crop_types, quantities, humidities, storage_methods, age_days, rng=None):
+    """Score many lots in one vectorized pass.
+
+    Takes equal-length columns and returns a dict of NumPy arrays:
+    loss_percentage, estimated_loss_value and urgency (0/1/2).
+    """
+    np = ml_loader.numpy()
+    rng = rng or np.random.default_rng()
+
+    crop_codes = risk_tables.crops.encode(crop_types)
+    storage_codes = risk_tables.storage.encode(storage_methods)
+    quantities = np.asarray(quantities, dtype=float)
+    humidities = np.asarray(humidities, dtype=float)
+    age_days = np.asarray(age_days, dtype=float)
+
+    prices = risk_tables.crops.matrix[crop_codes, risk_tables.BASE_PRICE]
+    storage_risk = risk_tables.storage.matrix[storage_codes, risk_tables.QUICK_STORAGE_RISK]
+    weather_risk = np.where(humidities > risk_tables.HUMIDITY_THRESHOLD, risk_tables.HUMID_WEATHER_RISK, risk_tables.DRY_WEATHER_RISK)
+    crop_age_risk = 0.02 * age_days
+
+    noise = rng.uniform(-5, 5, size=len(crop_codes))
+    loss_percentage = np.clip((weather_risk + storage_risk + crop_age_risk) * 100 + noise, MIN_LOSS_PERCENTAGE, MAX_LOSS_PERCENTAGE)
+
+    return {
+        'loss_percentage': loss_percentage,
+        'estimated_loss_value': quantities * (loss_percentage / 100) * prices,
+        'urgency': (loss_percentage > 10).astype(int) + (loss_percentage > 20).astype(int)
+    }
@@ -0,0 +1,117 @@
+"""Precomputed risk-factor and price tables shared by every scoring path.
+
+Crops, storage methods and weather conditions are interned to integer codes
+once at import. Each table row holds the per-model risk weights (random
+forest, gradient boosting, neural network) in the same columns, followed by
+table-specific extras. Scalar code paths index the plain tuples; batch code
+paths use read-only NumPy matrices built on first use. Adding a crop,
+storage method or weather condition only means adding a row below.
+"""
+import functools
+import types
+
+import ml_loader
+
+# Columns shared by all three tables
+RF, GB, NN = 0, 1, 2
+
+# Extra crop columns
+BASE_PRICE = 3        # KES per kg, used to value losses
+FORECAST_PRICE = 4    # reference market price used by price forecasts
+
+# Extra storage column
+QUICK_STORAGE_RISK = 3  # storage term of the quick /api/analyze estimate
+
+# crop: (rf, gb, nn, base_price, forecast_price)
+CROP_ROWS = {
+    'maize': (0.4, 0.5, 0.3, 3.2, 200),
+    'wheat': (0.3, 0.4, 0.2, 4.1, 250),
+    'rice': (0.3, 0.4, 0.2, 2.8, 300),
+    'tomatoes': (0.8, 0.9, 0.7, 8.2, 150),
+    'beans': (0.6, 0.7, 0.5, 5.5, 400),
+    'potatoes': (0.4, 0.5, 0.3, 2.1, 200),
+    'onions': (0.4, 0.5, 0.3, 3.8, 200),
+    'cassava': (0.4, 0.5, 0.3, 1.8, 120),
+    'sorghum': (0.4, 0.5, 0.3, 2.5, 190),
+    'millet': (0.4, 0.5, 0.3, 2.3, 180),
+    'groundnuts': (0.4, 0.5, 0.3, 6.8, 200),
+}
+DEFAULT_CROP_ROW = (0.4, 0.5, 0.3, 3.0, 200)
+
+# storage method: (rf, gb, nn, quick_storage_risk)
+STORAGE_ROWS = {
+    'traditional': (0.7, 0.8, 0.6, 0.15),
+    'improved': (0.4, 0.5, 0.3, 0.08),
+    'cold_storage': (0.2, 0.3, 0.1, 0.08),
+    'silo': (0.3, 0.4, 0.2, 0.08),
+    'hermetic': (0.1, 0.2, 0.05, 0.08),
+}
+DEFAULT_STORAGE_ROW = (0.4, 0.5, 0.3, 0.08)
+
+# weather condition: (rf, gb, nn)
+WEATHER_ROWS = {
+    'dry': (0.2, 0.3, 0.1),
+    'humid': (0.6, 0.7, 0.5),
+    'rainy': (0.8, 0.9, 0.7),
+    'stormy': (1.0, 1.1, 0.9),
+    'drought': (0.3, 0.4, 0.2),
+}
+DEFAULT_WEATHER_ROW = (0.4, 0.5, 0.3)
+
+# Weather term of the quick estimate, by relative humidity (%)
+HUMIDITY_THRESHOLD = 70
+HUMID_WEATHER_RISK = 0.1
+DRY_WEATHER_RISK = 0.05
+
+
+class Table:
+    """An interned, immutable factor table; unknown names map to the default row"""
+
+    def __init__(self, rows, default_row):
+        self.names = tuple(rows) + ('',)
+        self.codes = types.MappingProxyType({name: code for code, name in enumerate(self.names)})
+        self.unknown = len(self.names) - 1
+        self.rows = tuple(rows.values()) + (default_row,)
+        self._rows_by_name = dict(zip(self.names, self.rows))
+
+    def code(self, name):
+        """Integer code of a name (case-insensitive)"""
+        return self.codes.get(str(name).strip().lower(), self.unknown)
+
+    def row(self, name):
+        """Factor tuple for a name"""
+        row = self._rows_by_name.get(name)
+        return row if row is not None else self.rows[self.code(name)]
+
+    def encode(self, names):
+        """NumPy array of codes for a column of names"""
+        np = ml_loader.numpy()
+        names = names.tolist() if hasattr(names, 'tolist') else list(names)
+        # Each distinct spelling is normalized once per call
+        memo = dict(self.codes)
+
+        def code(name):
+            value = memo.get(name)
+            if value is None:
+                value = memo[name] = self.code(name)
+            return value
+
+        return np.fromiter(map(code, names), dtype=np.intp, count=len(names))
+
+    @functools.cached_property
+    def matrix(self):
+        """Read-only float matrix of the rows, indexed by code"""
+        np = ml_loader.numpy()
+        matrix = np.array(self.rows, dtype=float)
+        matrix.setflags(write=False)
+        return matrix
+
+
+crops = Table(CROP_ROWS, DEFAULT_CROP_ROW)
+storage = Table(STORAGE_ROWS, DEFAULT_STORAGE_ROW)
+weather = Table(WEATHER_ROWS, DEFAULT_WEATHER_ROW)
+
+
+def weather_risk(humidity):
+    """Weather term of the quick loss estimate"""
+    return HUMID_WEATHER_RISK if humidity > HUMIDITY_THRESHOLD else DRY_WEATHER_RISK
@@ -1,30 +1,27 @@
-import sqlite3
 import random
 from datetime import datetime, timedelta
+from buyer_index import add_buyer
+import database as db
+from migrations import migrate
+import risk_tables
+from price_forecast import forecaster
 
 def seed_database():
     """Seed the database with sample buyers and farmers"""
-    conn = sqlite3.connect('harvestlink.db')
-    cursor = conn.cursor()
+    migrate()
     
     # Sample buyers data
     buyers_data = [
-        ('AgriCorp Kenya', '+254700123456', 'maize,wheat,beans', 'Nairobi', '200-250 KES/kg'),
-        ('Fresh Produce Ltd', '+254700234567', 'tomatoes,beans', 'Mombasa', '150-200 KES/kg'),
-        ('Grain Traders Co', '+254700345678', 'maize,rice,wheat', 'Kisumu', '180-220 KES/kg'),
+        ('AgriCorp Kenya', '+254700123456', 'maize,wheat,beans', 'Nairobi', 'KES 3.0-3.6/kg'),
+        ('Fresh Produce Ltd', '+254700234567', 'tomatoes,beans', 'Mombasa', 'KES 7.5-9.0/kg'),
+        ('Grain Traders Co', '+254700345678', 'maize,rice,wheat', 'Kisumu', 'KES 2.8-3.4/kg'),
         ('Farm Fresh Kenya', '+254700456789', 'all', 'Nakuru', 'Market rate'),
-        ('Export Quality Foods', '+254700567890', 'maize,wheat', 'Eldoret', '220-280 KES/kg'),
+        ('Export Quality Foods', '+254700567890', 'maize,wheat', 'Eldoret', 'KES 3.3-4.0/kg'),
         ('Local Market Hub', '+254700678901', 'all', 'Thika', 'Competitive rates'),
         ('Organic Farmers Coop', '+254700789012', 'beans,tomatoes', 'Meru', 'Premium rates'),
         ('Bulk Buyers Kenya', '+254700890123', 'maize,rice', 'Kakamega', 'Wholesale rates')
     ]
     
-    # Insert buyers
-    cursor.executemany('''
-        INSERT OR REPLACE INTO buyers (name, phone, crops_interested, location, price_range)
-        VALUES (?, ?, ?, ?, ?)
-    ''', buyers_data)
-    
     # Sample farmers data
     farmers_data = [
         ('+254700111111', 'John Mwangi', 'Nairobi', 'maize'),
@@ -34,39 +31,32 @@ def seed_database():
         ('+254700555555', 'David Kimani', 'Eldoret', 'beans')
     ]
     
-    # Insert farmers
-    cursor.executemany('''
-        INSERT OR REPLACE INTO farmers (phone, name, location, crops)
-        VALUES (?, ?, ?, ?)
-    ''', farmers_data)
-    
-    # Sample transactions for price forecasting
-    transactions_data = []
+    # Sample transactions for price forecasting (recording them also updates the price models)
     crops = ['maize', 'rice', 'wheat', 'beans', 'tomatoes']
-    base_prices = {'maize': 200, 'rice': 300, 'wheat': 250, 'beans': 400, 'tomatoes': 150}
+    locations = ['Nairobi', 'Mombasa', 'Kisumu', 'Nakuru', 'Eldoret']
     
+    transactions = []
     for i in range(50):  # 50 sample transactions
         crop = random.choice(crops)
-        base_price = base_prices[crop]
+        base_price = risk_tables.crops.row(crop)[risk_tables.FORECAST_PRICE]
         price = base_price + random.randint(-50, 50)
         quantity = random.uniform(10, 100)
-        
-        transactions_data.append((
-            random.randint(1, 5),  # farmer_id
-            random.randint(1, 8),  # buyer_id
-            crop,
-            quantity,
-            price,
-            datetime.now() - timedelta(days=random.randint(1, 90))
-        ))
+        transactions.append((crop, quantity, price, random.choice(locations),
+                             datetime.now() - timedelta(days=random.randint(1, 90)),
+                             random.randint(1, 5), random.randint(1, 8)))
     
-    cursor.executemany('''
-        INSERT INTO transactions (farmer_id, buyer_id, crop_type, quantity, price, transaction_date)
-        VALUES (?, ?, ?, ?, ?, ?)
-    ''', transactions_data)
-    
-    conn.commit()
-    conn.close()
+    with db.transaction() as conn:
+        for name, phone, crop_types, location, price_range in buyers_data:
+            add_buyer(conn, name, phone, location, crop_types, price_range)
+        
+        conn.executemany('''
+            INSERT OR REPLACE INTO farmers (phone_number, name, location, crop_type)
+            VALUES (?, ?, ?, ?)
+        ''', farmers_data)
+        
+        for crop, quantity, price, location, transaction_date, farmer_id, buyer_id in transactions:
+            forecaster.record(conn, crop, quantity, price, location=location, transaction_date=transaction_date,
+                              farmer_id=farmer_id, buyer_id=buyer_id)
     
     print("✅ Database seeded successfully!")
     print("📊 Added 8 buyers and 5 sample farmers")
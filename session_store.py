@@ -0,0 +1,166 @@
+"""USSD session store: in-process TTL cache with optional write-behind to SQLite.
+
+A USSD dialogue is a few menu steps within a couple of minutes, and the
+gateway gives each step a hard deadline of a few seconds. Sessions live in
+an in-process dict ordered by last use, so reading and saving a step is a
+dictionary operation. Sessions idle for USSD_SESSION_TTL seconds expire;
+expired entries at the old end of the order are evicted on every write and
+by the background sweep.
+
+With persistence on, saves and clears are queued and a daemon thread writes
+them to the ussd_sessions table in one transaction every
+USSD_SESSION_FLUSH_INTERVAL seconds, also deleting expired rows; it starts
+with the first save or clear. A process
+that misses a session in memory (after a restart, or on another worker)
+falls back to that table.
+"""
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import database as db
+
+USSD_SESSION_TTL = int(os.getenv('USSD_SESSION_TTL', '300'))
+USSD_SESSION_PERSIST = os.getenv('USSD_SESSION_PERSIST', '1') == '1'
+USSD_SESSION_FLUSH_INTERVAL = float(os.getenv('USSD_SESSION_FLUSH_INTERVAL', '2'))
+
+# Upper bound on sessions held in memory (oldest are dropped first)
+MAX_SESSIONS = 100000
+
+NEW_SESSION = {'step': 'initial'}
+
+
+class SessionStore:
+    """TTL session cache keyed by gateway session id"""
+
+    def __init__(self, ttl=USSD_SESSION_TTL, persist=USSD_SESSION_PERSIST,
+                 flush_interval=USSD_SESSION_FLUSH_INTERVAL, max_sessions=MAX_SESSIONS):
+        self.ttl = ttl
+        self.persist = persist
+        self.flush_interval = flush_interval
+        self.max_sessions = max_sessions
+        self._sessions = OrderedDict()  # session_id -> (data, expires_at), least recently used first
+        self._pending = {}              # session_id -> (json, expires_at), or None to delete
+        self._lock = threading.Lock()
+        self._pid = None
+        self.metrics = {'hits': 0, 'misses': 0, 'loads': 0, 'evictions': 0, 'flushes': 0}
+
+    def get(self, session_id):
+        """Session data (a copy) for an id, a new session if it is unknown or expired"""
+        now = time.time()
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is not None and entry[1] > now:
+                self.metrics['hits'] += 1
+                return dict(entry[0])
+            self.metrics['misses'] += 1
+            pending = self._pending.get(session_id, ())
+
+        if pending is None or not self.persist:
+            return dict(NEW_SESSION)
+        if pending:
+            # Dropped from memory before its write reached SQLite
+            data = json.loads(pending[0]) if pending[1] > now else None
+        else:
+            data = self._load(session_id, now)
+        if data is None:
+            return dict(NEW_SESSION)
+        with self._lock:
+            self.metrics['loads'] += 1
+            self._store(session_id, data, now + self.ttl)
+        return dict(data)
+
+    def save(self, session_id, data):
+        """Store a session and restart its TTL"""
+        self.start()
+        data = dict(data)
+        expires_at = time.time() + self.ttl
+        with self._lock:
+            self._store(session_id, data, expires_at)
+            if self.persist:
+                self._pending[session_id] = (json.dumps(data), expires_at)
+
+    def clear(self, session_id):
+        """End a session"""
+        self.start()
+        with self._lock:
+            self._sessions.pop(session_id, None)
+            if self.persist:
+                self._pending[session_id] = None
+
+    def _store(self, session_id, data, expires_at):
+        self._sessions[session_id] = (data, expires_at)
+        self._sessions.move_to_end(session_id)
+        self._evict(expires_at - self.ttl)
+
+    def _evict(self, now):
+        """Drop expired sessions from the old end, and the oldest beyond max_sessions"""
+        sessions = self._sessions
+        while sessions:
+            session_id, (_, expires_at) = next(iter(sessions.items()))
+            if expires_at > now and len(sessions) <= self.max_sessions:
+                break
+            del sessions[session_id]
+            self.metrics['evictions'] += 1
+
+    def _load(self, session_id, now):
+        with db.connection() as conn:
+            row = conn.execute(
+                'SELECT data FROM ussd_sessions WHERE session_id = ? AND expires_at > ?', (session_id, now)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def flush(self):
+        """Write queued saves and clears to SQLite and delete expired rows"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._evict(time.time())
+        try:
+            with db.transaction() as conn:
+                conn.executemany('''
+                    INSERT OR REPLACE INTO ussd_sessions (session_id, data, expires_at)
+                    VALUES (?, ?, ?)
+                ''', [(session_id, *entry) for session_id, entry in pending.items() if entry is not None])
+                conn.executemany(
+                    'DELETE FROM ussd_sessions WHERE session_id = ?',
+                    [(session_id,) for session_id, entry in pending.items() if entry is None]
+                )
+                conn.execute('DELETE FROM ussd_sessions WHERE expires_at <= ?', (time.time(),))
+        except Exception:
+            # Requeue, keeping anything written since
+            with self._lock:
+                self._pending = {**pending, **self._pending}
+            raise
+        with self._lock:
+            self.metrics['flushes'] += 1
+        return len(pending)
+
+    def start(self):
+        """Start the write-behind/sweep thread once per process (on the first save or clear)"""
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+        threading.Thread(target=self._run, name='ussd-session-flusher', daemon=True).start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                if self.persist:
+                    self.flush()
+                else:
+                    with self._lock:
+                        self._evict(time.time())
+            except Exception as e:
+                print(f"❌ USSD session flush failed: {e}")
+
+    def stats(self):
+        """Return session counters for monitoring"""
+        with self._lock:
+            return dict(self.metrics, sessions=len(self._sessions), pending=len(self._pending))
+
+
+ussd_sessions = SessionStore()
@@ -0,0 +1,263 @@
+"""Single-pass parser for free-text harvest messages (SMS and WhatsApp).
+
+Every crop, location, storage, weather and unit phrase, English and
+Swahili, is compiled at import into one regex alternation (longest phrase
+first) together with the quantity pattern. A message is lowercased once and
+scanned once, and each match is looked up in a phrase -> (field, value)
+dict. Words that match nothing are tried against a trigram index of the
+vocabulary with a bounded edit distance, so 'maze' still reads as maize and
+'nairob' as Nairobi. Common English and Swahili words (STOPWORDS) are never
+matched, and words of five letters or less are never guessed as places.
+In numbers, a comma before exactly three digits groups thousands; any
+other comma is a decimal point. A number followed by a word that is neither
+a unit nor vocabulary ('2 packages') counts something else and is not
+taken as the quantity.
+
+Throughput on a generated corpus of realistic messages:  python sms_parser.py
+"""
+import re
+from functools import lru_cache
+
+import geo
+import risk_tables
+
+# Kilograms per unit; farmers count in 90 kg bags (gunia) and 18 kg tins (debe)
+UNITS = {
+    'kg': 1, 'kgs': 1, 'kilo': 1, 'kilos': 1, 'kilogram': 1, 'kilograms': 1,
+    't': 1000, 'ton': 1000, 'tons': 1000, 'tonne': 1000, 'tonnes': 1000, 'tani': 1000,
+    'bag': 90, 'bags': 90, 'gunia': 90, 'magunia': 90,
+    'debe': 18, 'madebe': 18,
+}
+
+# Canonical value -> phrases (canonical name included automatically)
+CROP_SYNONYMS = {
+    'maize': ('corn', 'mahindi', 'mais'),
+    'rice': ('mchele', 'mpunga'),
+    'wheat': ('ngano',),
+    'beans': ('bean', 'maharage', 'maharagwe'),
+    'tomatoes': ('tomato', 'nyanya'),
+    'millet': ('wimbi', 'ulezi'),
+    'sorghum': ('mtama',),
+    'cassava': ('muhogo', 'mihogo'),
+    'potatoes': ('potato', 'viazi', 'irish potatoes'),
+    'onions': ('onion', 'vitunguu', 'kitunguu'),
+    'groundnuts': ('groundnut', 'peanuts', 'njugu', 'karanga'),
+}
+STORAGE_SYNONYMS = {
+    'traditional': ('open', 'open air', 'kienyeji'),
+    'improved': ('barn', 'store', 'ghala', 'covered'),
+    'cold_storage': ('cold storage', 'cold room', 'fridge', 'friji'),
+    'silo': ('silos',),
+    'hermetic': ('hermetic bags', 'pics', 'pics bags'),
+}
+WEATHER_SYNONYMS = {
+    'dry': ('sunny', 'kavu', 'jua'),
+    'humid': ('damp', 'unyevu', 'unyevunyevu'),
+    'rainy': ('rain', 'wet', 'mvua'),
+    'stormy': ('storm', 'dhoruba'),
+    'drought': ('ukame',),
+}
+
+# Ordinary English and Swahili words that must never be read as vocabulary,
+# fuzzily or (for place names such as Wote, 'all') exactly
+STOPWORDS = frozenset((
+    'what', 'that', 'this', 'with', 'from', 'have', 'need', 'want', 'sell', 'help', 'when', 'will',
+    'your', 'hello', 'please', 'price', 'prices', 'buyer', 'buyers', 'market', 'today',
+    'harvest', 'habari', 'nina', 'nataka', 'kuuza', 'bei', 'mavuno', 'tafadhali', 'asante', 'stored',
+    'nice', 'item', 'items', 'mice', 'dice', 'time', 'fine', 'mine', 'once', 'more', 'made',
+    'make', 'some', 'same', 'sale', 'rate', 'much', 'many', 'good', 'well', 'just', 'also', 'only', 'very',
+    'like', 'know', 'next', 'last', 'week', 'days', 'year', 'here', 'there', 'were', 'they', 'them', 'then',
+    'than', 'cost', 'costs',
+    # Field names ('Storage: silo') must not be read as values ('storage' ~ 'store')
+    'storage', 'weather', 'quantity', 'location',
+    'wote', 'sasa', 'kesho', 'sana', 'hiyo', 'yangu', 'wangu', 'mimi', 'wewe', 'yetu', 'kila', 'bado',
+    'tena', 'hapa', 'pale', 'siku', 'mwaka', 'shamba', 'mzuri', 'nzuri', 'karibu', 'ndiyo', 'hapana',
+    'naomba', 'baada', 'kabla', 'mbele', 'nyuma', 'chini', 'mbili', 'tatu', 'tano', 'kumi', 'elfu',
+    'sawa', 'rafiki', 'pesa', 'kununua', 'mnunuzi', 'wanunuzi',
+))
+
+# Words asking about something other than a harvest: with one of these, a
+# number without a unit ('maize price 2024') is not taken as the quantity
+NON_QUANTITY_WORDS = (
+    'price', 'prices', 'bei', 'cost', 'costs', 'gharama', 'year', 'mwaka', 'date', 'tarehe',
+    'phone', 'simu', 'number', 'namba', 'call', 'piga', 'how much', 'ngapi',
+)
+
+REQUIRED_FIELDS = ('crop', 'quantity')
+
+
+def _vocabulary():
+    phrases = {}
+    for field, synonyms in (('crop', CROP_SYNONYMS), ('storage', STORAGE_SYNONYMS), ('weather', WEATHER_SYNONYMS)):
+        for value, words in synonyms.items():
+            for word in (value.replace('_', ' '),) + words:
+                phrases[word] = (field, value)
+    for crop in risk_tables.crops.names:
+        if crop:
+            phrases.setdefault(crop, ('crop', crop))
+    for place in geo.GAZETTEER:
+        if place not in STOPWORDS:
+            phrases.setdefault(place, ('location', place.title()))
+    return phrases
+
+
+PHRASES = _vocabulary()
+
+
+def _alternation(words):
+    return '|'.join(r'\s+'.join(map(re.escape, word.split())) for word in sorted(words, key=len, reverse=True))
+
+
+# '1,500' groups thousands; any other comma is a decimal point ('1,5')
+_THOUSANDS = r'\d{1,3}(?:,\d{3})+(?![\d,])(?:\.\d+)?'
+_NUMBER = _THOUSANDS + r'|\d+(?:[.,]\d+)?'
+_GROUPED = re.compile(_THOUSANDS)
+
+_SCANNER = re.compile(
+    r'(?P<number>' + _NUMBER + r')\s*(?P<unit>' + _alternation(UNITS) + r')?\b'
+    # Swahili puts the unit first: 'magunia 10'
+    r'|\b(?P<lead_unit>' + _alternation(unit for unit in UNITS if len(unit) > 1) + r')\s*(?P<lead_number>' + _NUMBER + r')'
+    r'|\b(?P<phrase>' + _alternation(PHRASES) + r')\b'
+    r'|(?P<word>[^\W\d_]{4,})'
+)
+
+_NON_QUANTITY = re.compile(r'\b(?:' + _alternation(NON_QUANTITY_WORDS) + r')\b')
+
+# The word right after a number
+_NEXT_WORD = re.compile(r'\s*([^\W\d_]{4,})')
+
+# Trigram index over single-word phrases for typo tolerance
+_FUZZY_WORDS = sorted(word for word in PHRASES if ' ' not in word and len(word) >= 4)
+_TRIGRAMS = {}
+for _word in _FUZZY_WORDS:
+    for _gram in {f' {_word} '[i:i + 3] for i in range(len(_word))}:
+        _TRIGRAMS.setdefault(_gram, []).append(_word)
+
+
+def _amount(number):
+    """Float value of a matched number"""
+    if _GROUPED.fullmatch(number):
+        return float(number.replace(',', ''))
+    return float(number.replace(',', '.'))
+
+
+def _edit_distance(a, b, limit):
+    """Levenshtein distance, or limit + 1 once it is certain to exceed limit"""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b)))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+
+@lru_cache(maxsize=8192)
+def fuzzy_phrase(word):
+    """(field, value) of the vocabulary word closest to a misspelling, or None"""
+    if word in STOPWORDS:
+        return None
+    shared = {}
+    for gram in {f' {word} '[i:i + 3] for i in range(len(word))}:
+        for candidate in _TRIGRAMS.get(gram, ()):
+            shared[candidate] = shared.get(candidate, 0) + 1
+
+    # Short words are too close to ordinary ones ('item' / Iten) to guess a place from
+    short = len(word) <= 5
+    limit = 1 if short else 2
+    best, best_distance = None, limit + 1
+    for candidate in sorted(shared, key=shared.get, reverse=True)[:8]:
+        if short and PHRASES[candidate][0] == 'location':
+            continue
+        distance = _edit_distance(word, candidate, limit)
+        if distance < best_distance:
+            best, best_distance = candidate, distance
+    return PHRASES[best] if best is not None else None
+
+
+def _unknown_unit(text, position):
+    """True if the word at position looks like a unit we cannot convert ('packages', 'crates')"""
+    match = _NEXT_WORD.match(text, position)
+    if match is None:
+        return False
+    word = match.group(1)
+    if word in STOPWORDS or word in PHRASES or any(phrase.startswith(word + ' ') for phrase in PHRASES):
+        return False
+    return fuzzy_phrase(word) is None
+
+
+def parse_message(message):
+    """Extract crop, quantity (kg), location, storage and weather from a message.
+
+    Returns the fields found, or None unless at least a crop and a quantity
+    are present. Exact phrases win over fuzzy matches; the first value found
+    for a field is kept.
+    """
+    parsed = {}
+    fuzzy = []
+    bare_number = None
+    text = message.lower()
+    for match in _SCANNER.finditer(text):
+        number, phrase, word, lead_number = match.group('number', 'phrase', 'word', 'lead_number')
+        if lead_number is not None:
+            number, unit = lead_number, match.group('lead_unit')
+            parsed.setdefault('quantity', _amount(number) * UNITS[unit])
+        elif number is not None:
+            unit = match.group('unit')
+            amount = _amount(number)
+            if unit is not None:
+                parsed.setdefault('quantity', amount * UNITS[re.sub(r'\s+', ' ', unit)])
+            elif bare_number is None and not _unknown_unit(text, match.end()):
+                bare_number = amount
+        elif phrase is not None:
+            field, value = PHRASES[re.sub(r'\s+', ' ', phrase)]
+            parsed.setdefault(field, value)
+        else:
+            fuzzy.append(word)
+
+    for word in fuzzy:
+        found = fuzzy_phrase(word)
+        if found is not None:
+            parsed.setdefault(*found)
+
+    if 'quantity' not in parsed and bare_number is not None and not _NON_QUANTITY.search(text):
+        parsed['quantity'] = bare_number
+    if parsed.get('quantity', 0) <= 0:
+        parsed.pop('quantity', None)
+
+    return parsed if all(field in parsed for field in REQUIRED_FIELDS) else None
+
+
+if __name__ == '__main__':
+    import random
+    import time
+
+    random.seed(7)
+    crops = ['maize', 'maze', 'mahindi', 'beans', 'maharage', 'tomatos', 'nyanya', 'rice', 'wheat', 'potatos', 'cassava']
+    places = ['Nairobi', 'nairob', 'Kisumu', 'Nakuru', 'Eldoret', 'Kitale', 'Homa Bay', 'Uasin Gishu county', 'Kakamega', 'Meru']
+    amounts = ['50kg', '2 tons', '10 bags', '5 gunia', '300 kgs', '1.5t', '20 debe', '120']
+    storages = ['', 'traditional', 'silo', 'hermetic bags', 'ghala', 'cold storage', 'open air']
+    weathers = ['', 'dry', 'rainy', 'mvua', 'humid', 'unyevu']
+    templates = [
+        '{crop} {amount} {place} {storage} {weather}',
+        'Habari, nina {amount} ya {crop} {place}. Storage {storage}, weather {weather}',
+        'I want to sell {amount} of {crop} in {place}',
+        '{amount} {crop} stored in {storage} at {place}, it is {weather}',
+        'hello what is the price of {crop} today',
+    ]
+    corpus = [
+        random.choice(templates).format(crop=random.choice(crops), place=random.choice(places), amount=random.choice(amounts),
+                                        storage=random.choice(storages), weather=random.choice(weathers))
+        for _ in range(20000)
+    ]
+
+    started = time.perf_counter()
+    parsed = [parse_message(message) for message in corpus]
+    elapsed = time.perf_counter() - started
+    complete = sum(result is not None for result in parsed)
+    print(f"✅ Parsed {len(corpus)} messages in {elapsed * 1000:.0f}ms "
+          f"({len(corpus) / elapsed:,.0f} msg/s); {complete} had crop and quantity")
@@ -0,0 +1,37 @@
+"""Shared pytest setup: every test session runs against a scratch database.
+
+Tests marked bench measure throughput at production scale; they are
+skipped unless HARVESTLINK_BENCH=1 (run with -s to see the figures).
+"""
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Must be set before database is first imported
+SCRATCH_DIR = tempfile.mkdtemp(prefix='harvestlink-tests-')
+os.environ['DATABASE_PATH'] = os.path.join(SCRATCH_DIR, 'harvestlink.db')
+
+BENCH = os.getenv('HARVESTLINK_BENCH') == '1'
+
+import pytest
+
+from migrations import migrate
+
+
+@pytest.fixture(scope='session', autouse=True)
+def schema():
+    """Migrate the scratch database once per session"""
+    migrate()
+
+
+def pytest_collection_modifyitems(config, items):
+    """Skip benchmarks unless they were asked for"""
+    if BENCH:
+        return
+    skip = pytest.mark.skip(reason='benchmark (set HARVESTLINK_BENCH=1)')
+    for item in items:
+        if 'bench' in item.keywords:
+            item.add_marker(skip)
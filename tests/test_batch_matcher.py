@@ -0,0 +1,78 @@
+import random
+import time
+from collections import defaultdict
+
+import pytest
+
+import batch_matcher
+import database as db
+import geo
+from buyer_index import add_buyer
+
+# Seconds allowed to match the scale check's lots (it takes well under one)
+SOLVE_BUDGET = 5.0
+
+
+def buyer(town, kg, offer=3.0, crops=('maize',)):
+    return (*geo.locate(town), offer, float(kg), set(crops))
+
+
+def test_lot_is_split_across_buyers_best_offer_first():
+    lots = [(1, 'maize', 300.0, geo.locate('Nairobi'))]
+    buyers = {1: buyer('Nairobi', 200, offer=2.5), 2: buyer('Nairobi', 200, offer=3.5)}
+    assignments = batch_matcher.solve(lots, buyers)
+    assert [(buyer_id, kg) for _, buyer_id, _, kg, _, _ in assignments] == [(2, 200.0), (1, 100.0)]
+
+
+def test_full_nearby_buyers_spill_over_to_farther_ones():
+    lots = [(10, 'maize', 5000.0, geo.locate('Nairobi'))]
+    buyers = {1: buyer('Nairobi', 100), 2: buyer('Nakuru', 10000)}
+    assignments = batch_matcher.solve(lots, buyers)
+    assert [(buyer_id, kg) for _, buyer_id, _, kg, _, _ in assignments] == [(1, 100.0), (2, 4900.0)]
+    assert assignments[1][4] == pytest.approx(137, abs=2)
+
+
+def test_nearer_buyers_win_at_equal_offers_and_wildcards_count():
+    lots = [(1, 'beans', 100.0, geo.locate('Thika'))]
+    buyers = {1: buyer('Mombasa', 1000, crops=('beans',)), 2: buyer('Nairobi', 1000, crops=('all',))}
+    assert [row[1] for row in batch_matcher.solve(lots, buyers)] == [2]
+
+
+def test_matches_for_farmer_reads_the_last_run():
+    with db.transaction() as conn:
+        farmer_id = conn.execute(
+            "INSERT INTO farmers (phone_number, crop_type, location, quantity) VALUES ('+254711000111', 'sorghum', 'Kitui', 900)"
+        ).lastrowid
+        near = add_buyer(conn, 'Kitui Millers', '+254711000222', 'Kitui', 'sorghum', 'KES 2.5/kg', 400)
+        far = add_buyer(conn, 'Machakos Grain', '+254711000333', 'Machakos', 'sorghum', 'KES 2.6/kg', 5000)
+        batch_matcher.run(conn)
+
+    with db.connection() as conn:
+        matches = batch_matcher.matches_for_farmer(conn, farmer_id)
+    assert [(match['id'], match['matched_kg']) for match in matches] == [(near, 400.0), (far, 500.0)]
+    assert matches[0]['distance_km'] == 0 and matches[1]['distance_km'] > 0
+    assert matches[0]['score'] >= matches[1]['score']
+
+
+def test_tens_of_thousands_of_lots():
+    rng = random.Random(1)
+    towns = list(geo.TOWNS.values())
+    crops = ('maize', 'beans', 'rice', 'wheat', 'tomatoes')
+    lots = [(number, rng.choice(crops), float(rng.randint(50, 2000)), rng.choice(towns)) for number in range(30000)]
+    buyers = {
+        number: (*rng.choice(towns), rng.uniform(2, 8), float(rng.randint(1000, 20000)), {rng.choice(crops)})
+        for number in range(3000)
+    }
+
+    started = time.perf_counter()
+    assignments = batch_matcher.solve(lots, buyers)
+    elapsed = time.perf_counter() - started
+    assert elapsed < SOLVE_BUDGET, elapsed
+
+    taken, sold = defaultdict(float), defaultdict(float)
+    for farmer_id, buyer_id, _, kg, _, _ in assignments:
+        taken[buyer_id] += kg
+        sold[farmer_id] += kg
+    assert all(kg <= buyers[buyer_id][3] + 1e-6 for buyer_id, kg in taken.items())
+    assert all(kg <= lots[farmer_id][2] + 1e-6 for farmer_id, kg in sold.items())
+    assert sum(sold.values()) > 0.9 * sum(lot[2] for lot in lots)
@@ -0,0 +1,128 @@
+import json
+import random
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import pytest
+
+import broadcast
+import database as db
+from price_forecast import forecaster
+
+FARMERS = 300
+
+
+class StandInSender:
+    """Delivers on worker threads, dead-lettering a few messages like a flaky provider"""
+
+    def __init__(self):
+        self.delivered = Counter()
+        self.messages = {}
+        self._pool = ThreadPoolExecutor(4)
+        self._futures = []
+        self._lock = threading.Lock()
+
+    def send(self, provider, recipient, body, priority=None, on_done=None):
+        self._futures.append(self._pool.submit(self._deliver, recipient, body, on_done))
+
+    def _deliver(self, recipient, body, on_done):
+        time.sleep(random.uniform(0, 0.002))
+        delivered = not recipient.endswith('7')
+        with self._lock:
+            if delivered:
+                self.delivered[recipient] += 1
+                self.messages[recipient] = body
+        on_done(delivered)
+
+    def drain(self):
+        wait(self._futures)
+
+
+@pytest.fixture(scope='module')
+def phones():
+    """Teff farmers in two towns with prices, and some who never gave a location"""
+    towns = ('Nakuru', 'Kisumu', None)
+    farmers = [(f"+2547990{number:05d}", 'teff', towns[number % 3], 100) for number in range(FARMERS)]
+    with db.transaction() as conn:
+        conn.executemany('INSERT INTO farmers (phone_number, crop_type, location, quantity) VALUES (?, ?, ?, ?)', farmers)
+        for town in towns[:2]:
+            for day in range(1, 30, 3):
+                forecaster.record(conn, 'teff', 100, random.uniform(150, 200), location=town,
+                                  transaction_date=f"{time.strftime('%Y-%m-%d', time.gmtime(time.time() - day * 86400))} 10:00:00")
+    return {phone: town for phone, _, town, _ in farmers}
+
+
+@pytest.fixture(autouse=True)
+def small_chunks(monkeypatch):
+    monkeypatch.setattr(broadcast, 'BROADCAST_CHUNK_SIZE', 20)
+
+
+def test_campaign_reaches_every_priced_segment(phones):
+    sender = StandInSender()
+    progress = broadcast.run_campaign(broadcast.create_campaign('price', 'sms', 'Teff'), sender)
+
+    failed = [phone for phone in phones if phone.endswith('7')]
+    assert progress['status'] == 'done'
+    assert (progress['sent'], progress['failed'], progress['skipped']) == (FARMERS - len(failed), len(failed), 0)
+    assert progress['segments'] == 3    # Nakuru, Kisumu and the farmers without a location
+    assert set(sender.delivered) == set(phones) - set(failed)
+    nakuru = next(phone for phone in sender.messages if phones[phone] == 'Nakuru')
+    assert 'Teff prices in Nakuru' in sender.messages[nakuru] and 'KES/kg' in sender.messages[nakuru]
+    # Farmers who never gave a location get the crop-wide prices
+    nowhere = next(phone for phone in sender.messages if phones[phone] is None)
+    assert sender.messages[nowhere].startswith('🌾 HarvestLink Teff prices\n') and 'KES/kg' in sender.messages[nowhere]
+
+
+def test_campaign_resumes_from_its_checkpoint(phones):
+    class Crash(Exception):
+        pass
+
+    checkpoints = []
+
+    def crash_at_first_checkpoint(progress):
+        checkpoints.append(progress['last_farmer_id'])
+        if len(checkpoints) == 1:
+            raise Crash()
+
+    sender = StandInSender()
+    campaign_id = broadcast.create_campaign('price', 'sms', 'teff', 'nakuru')
+    with pytest.raises(Crash):
+        broadcast.run_campaign(campaign_id, sender, heartbeat=crash_at_first_checkpoint)
+    sender.drain()
+    assert broadcast.campaign_status(campaign_id)['status'] == 'failed'
+
+    progress = broadcast.run_campaign(campaign_id, sender)
+    nakuru = [phone for phone, town in phones.items() if town == 'Nakuru' and not phone.endswith('7')]
+    assert progress['status'] == 'done' and progress['sent'] + progress['failed'] >= len(nakuru)
+    assert set(sender.delivered) == set(nakuru)
+    # Only chunks in flight at the crash are sent twice
+    assert sum(count > 1 for count in sender.delivered.values()) <= broadcast.BROADCAST_WINDOW * 20
+    assert broadcast.run_campaign(campaign_id, sender)['sent'] == progress['sent']
+
+
+def test_weather_campaign_uses_the_snapshot(phones):
+    reading = {'condition': 'Light Rain', 'temperature': 21, 'humidity': 82}
+    with db.transaction() as conn:
+        conn.execute('INSERT OR REPLACE INTO weather_snapshot (location, data, fetched_at) VALUES (?, ?, ?)',
+                     ('Kisumu', json.dumps(reading), time.time()))
+    sender = StandInSender()
+    progress = broadcast.run_campaign(broadcast.create_campaign('weather', 'sms', 'teff', 'Kisumu'), sender)
+    assert progress['sent'] > 0
+    assert all('Rain expected' in body for body in sender.messages.values())
+
+
+def test_weather_campaign_skips_farmers_without_a_location(phones):
+    with db.connection() as conn:
+        readings = broadcast._weather_readings(conn)
+    sender = StandInSender()
+    progress = broadcast.run_campaign(broadcast.create_campaign('weather', 'sms', 'teff'), sender)
+    reached = [phone for phone, town in phones.items() if town in readings]
+    assert reached and progress['sent'] + progress['failed'] == len(reached)
+    assert progress['skipped'] == FARMERS - len(reached)
+
+
+def test_unknown_kind_is_rejected():
+    with pytest.raises(ValueError):
+        broadcast.create_campaign('gossip')
@@ -0,0 +1,144 @@
+import os
+import random
+import time
+
+import pytest
+
+import buyer_index
+import database as db
+import geo
+from conftest import SCRATCH_DIR
+from migrations import migrate
+
+LARGE_MARKET = 100000
+
+
+@pytest.fixture(scope='module')
+def buyers():
+    """Verified quinoa buyers at increasing distance from Nakuru, one unverified, one unplaced"""
+    with db.transaction() as conn:
+        ids = {
+            place: buyer_index.add_buyer(conn, f"Quinoa buyer {place}", '+254700000000', place, 'Quinoa, teff', 'KES 5.0/kg', 1000)
+            for place in ('Nakuru', 'Naivasha', 'Nairobi', 'Mombasa')
+        }
+        ids['unverified'] = buyer_index.add_buyer(conn, 'Pending buyer', '+254700000001', 'Nakuru', 'quinoa',
+                                                  'KES 9.0/kg', 1000, verified=False)
+        ids['unplaced'] = buyer_index.add_buyer(conn, 'Somewhere buyer', '+254700000002', 'Atlantis', 'quinoa', 'KES 5.0/kg')
+    return ids
+
+
+@pytest.fixture(scope='module')
+def large_market():
+    """A separate database with LARGE_MARKET verified buyers spread over the gazetteer towns"""
+    path = os.path.join(SCRATCH_DIR, 'large-market.db')
+    migrate(path)
+    pool = db.ConnectionPool(path, size=1)
+    rng = random.Random(4)
+    towns = list(geo.TOWNS)
+    crops = ('maize', 'beans', 'rice', 'wheat', 'potatoes', 'quinoa', 'teff', 'all')
+    with pool.transaction() as conn:
+        for n in range(LARGE_MARKET):
+            buyer_index.add_buyer(conn, f"Buyer {n}", '+254700000000', rng.choice(towns).title(),
+                                  ', '.join(rng.sample(crops, 2)), f"KES {rng.uniform(2, 6):.1f}/kg",
+                                  rng.randrange(100, 5000), verified=rng.random() < 0.9)
+    yield pool
+    pool.close_all()
+
+
+def _p99(latencies):
+    latencies.sort()
+    return latencies[int(len(latencies) * 0.99)]
+
+
+def test_add_buyer_indexes_every_listed_crop(buyers):
+    with db.connection() as conn:
+        crops = conn.execute('SELECT crop, geo_cell FROM buyer_crops WHERE buyer_id = ? ORDER BY crop',
+                             (buyers['Nakuru'],)).fetchall()
+    assert crops == [('quinoa', geo.cell_of(*geo.locate('Nakuru'))), ('teff', geo.cell_of(*geo.locate('Nakuru')))]
+
+
+def test_sampling_skips_unverified_buyers(buyers):
+    with db.connection() as conn:
+        for _ in range(20):
+            sample = buyer_index.sample_buyer_ids(conn, 'quinoa', limit=10)
+            assert buyers['unverified'] not in sample
+            assert len(sample) == len(set(sample))
+
+
+def test_verification_and_deletes_reach_the_index(buyers):
+    with db.transaction() as conn:
+        conn.execute('UPDATE buyers SET verified = 1 WHERE id = ?', (buyers['unverified'],))
+        assert conn.execute('SELECT verified FROM buyer_crops WHERE buyer_id = ?', (buyers['unverified'],)).fetchone() == (1,)
+        conn.execute('DELETE FROM buyers WHERE id = ?', (buyers['unverified'],))
+        assert conn.execute('SELECT COUNT(*) FROM buyer_crops WHERE buyer_id = ?', (buyers['unverified'],)).fetchone() == (0,)
+
+
+def test_nearest_buyers_rank_by_distance(buyers):
+    with db.connection() as conn:
+        matches = buyer_index.nearest_buyers(conn, 'quinoa', 'Nakuru County', quantity=500, limit=3)
+    assert [match['id'] for match in matches] == [buyers['Nakuru'], buyers['Naivasha'], buyers['Nairobi']]
+    distances = [match['distance_km'] for match in matches]
+    assert distances[0] == 0 and distances == sorted(distances)
+
+
+def test_moved_buyer_is_found_at_its_new_location(buyers):
+    with db.transaction() as conn:
+        buyer_index.locate_buyer(conn, buyers['Mombasa'], 'Nakuru')
+    with db.connection() as conn:
+        matches = buyer_index.nearest_buyers(conn, 'teff', 'Nakuru', limit=2)
+    assert {match['id'] for match in matches} == {buyers['Nakuru'], buyers['Mombasa']}
+
+
+def test_unknown_location_falls_back_to_random_buyers(buyers):
+    with db.connection() as conn:
+        matches = buyer_index.nearest_buyers(conn, 'quinoa', 'Atlantis', limit=3)
+    assert len(matches) == 3
+    assert all(match['distance_km'] is None for match in matches)
+
+
+def test_offer_prices_are_per_kg():
+    assert buyer_index.parse_offer_price('KES 3.0-3.6/kg') == pytest.approx(3.3)
+    assert buyer_index.parse_offer_price('200-250', 'maize,beans') == pytest.approx(225 * 3.2 / 200)
+    assert buyer_index.parse_offer_price('Market rate') is None
+
+
+def test_large_per_kg_offers_are_kept():
+    assert buyer_index.parse_offer_price('KES 80/kg', 'maize') == pytest.approx(80)
+    assert buyer_index.parse_offer_price('60-70 KES per kg', 'maize, beans') == pytest.approx(65)
+    # Unmarked, or marked but near the crop's market reference price: market scale
+    assert buyer_index.parse_offer_price('KES 80', 'maize') == pytest.approx(80 * 3.2 / 200)
+    assert buyer_index.parse_offer_price('KES 380/kg', 'beans') == pytest.approx(380 * 5.5 / 400)
+
+
+def test_locate_reads_towns_and_counties():
+    assert geo.locate('Ruiru, Kiambu') == geo.TOWNS['ruiru']
+    assert geo.locate("Murang'a County") == geo.locate('muranga')
+    assert geo.locate('Atlantis') is None
+    assert geo.distance_km(*geo.locate('Nairobi'), *geo.locate('Mombasa')) == pytest.approx(440, abs=20)
+
+
+@pytest.mark.bench
+def test_sampling_stays_fast_at_100k_buyers(large_market):
+    latencies = []
+    with large_market.connection() as conn:
+        for crop in ('maize', 'teff', 'all', 'unknown') * 250:
+            started = time.perf_counter()
+            sample = buyer_index.sample_buyer_ids(conn, crop, limit=3)
+            latencies.append(time.perf_counter() - started)
+            assert len(sample) == 3
+    print(f"\n✅ sample_buyer_ids over {LARGE_MARKET} buyers: p99 {_p99(latencies) * 1e3:.2f}ms")
+    assert _p99(latencies) < 0.005
+
+
+@pytest.mark.bench
+def test_nearest_buyers_stays_fast_at_100k_buyers(large_market):
+    places = ('Nakuru', 'Eldoret', 'Kisumu County', 'Garissa', 'Lodwar', 'Atlantis')
+    latencies = []
+    with large_market.connection() as conn:
+        for place in places * 100:
+            started = time.perf_counter()
+            matches = buyer_index.nearest_buyers(conn, 'maize', place, quantity=500, limit=3)
+            latencies.append(time.perf_counter() - started)
+            assert len(matches) == 3
+    print(f"\n✅ nearest_buyers over {LARGE_MARKET} buyers: p99 {_p99(latencies) * 1e3:.2f}ms")
+    assert _p99(latencies) < 0.02
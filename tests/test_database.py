@@ -0,0 +1,118 @@
+import os
+import threading
+import time
+
+import pytest
+
+import database as db
+from conftest import SCRATCH_DIR
+
+
+@pytest.fixture
+def pool():
+    pool = db.ConnectionPool(os.path.join(SCRATCH_DIR, 'pool.db'), size=2)
+    with pool.transaction() as conn:
+        conn.execute('CREATE TABLE IF NOT EXISTS counter (id INTEGER PRIMARY KEY, value INTEGER)')
+        conn.execute('INSERT OR REPLACE INTO counter (id, value) VALUES (1, 0)')
+    yield pool
+    pool.close_all()
+
+
+def test_connections_are_tuned(pool):
+    with pool.connection() as conn:
+        assert conn.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+        assert conn.execute('PRAGMA synchronous').fetchone()[0] == 1    # NORMAL
+        assert conn.execute('PRAGMA busy_timeout').fetchone()[0] == 5000
+
+
+def test_connections_are_reused(pool):
+    with pool.connection() as first:
+        pass
+    with pool.connection() as second:
+        assert second is first
+
+
+def test_transaction_commits_or_rolls_back(pool):
+    with pool.transaction() as conn:
+        conn.execute('UPDATE counter SET value = 5 WHERE id = 1')
+    with pytest.raises(RuntimeError):
+        with pool.transaction() as conn:
+            conn.execute('UPDATE counter SET value = 99 WHERE id = 1')
+            raise RuntimeError('abort')
+    with pool.connection() as conn:
+        assert conn.execute('SELECT value FROM counter WHERE id = 1').fetchone()[0] == 5
+        assert not conn.in_transaction
+
+
+def test_threads_share_a_bounded_pool(pool):
+    def work():
+        for _ in range(50):
+            with pool.transaction() as conn:
+                conn.execute('UPDATE counter SET value = value + 1 WHERE id = 1')
+
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    with pool.connection() as conn:
+        assert conn.execute('SELECT value FROM counter WHERE id = 1').fetchone()[0] == 400
+    assert pool._created <= pool.size
+
+
+def test_module_helpers_use_the_shared_pool():
+    with db.connection() as conn:
+        assert conn.execute('PRAGMA database_list').fetchone()[2] == os.path.realpath(db.DB_PATH)
+
+
+def _concurrent_writers(threads, dialogues):
+    """USSD registration dialogues and SMS registrations from many threads at once; (steps/s, registrations/s)"""
+    from messaging import process_ussd_request, register_farmer
+
+    errors = []
+
+    def ussd(worker):
+        try:
+            for n in range(dialogues):
+                phone, session_id = f"+2547{worker:02d}{n:06d}", f"bench-{worker}-{n}"
+                for text in ('', '5', '5*1'):
+                    assert process_ussd_request(text, phone, session_id).startswith(('CON ', 'END '))
+        except Exception as e:
+            errors.append(e)
+
+    def sms(worker):
+        try:
+            for n in range(dialogues):
+                register_farmer(f"+2548{worker:02d}{n:06d}", {'crop': 'maize', 'quantity': 50.0, 'location': 'Nakuru'})
+        except Exception as e:
+            errors.append(e)
+
+    workers = [threading.Thread(target=target, args=(worker,))
+               for worker in range(threads) for target in (ussd, sms)]
+    started = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    assert not errors, errors
+
+    phones = [f"+254{channel}{worker:02d}{n:06d}" for channel in (7, 8) for worker in range(threads) for n in range(dialogues)]
+    with db.connection() as conn:
+        registered = {phone for (phone,) in conn.execute(
+            "SELECT phone_number FROM farmers WHERE phone_number LIKE '+2547%' OR phone_number LIKE '+2548%'")}
+    assert registered.issuperset(phones)
+    registrations = 2 * threads * dialogues
+    return threads * dialogues * 3 / elapsed, registrations / elapsed
+
+
+def test_concurrent_ussd_and_sms_writers():
+    _concurrent_writers(threads=4, dialogues=10)
+
+
+@pytest.mark.bench
+def test_concurrent_writer_throughput():
+    steps, registrations = _concurrent_writers(threads=16, dialogues=200)
+    print(f"\n✅ 16 USSD and 16 SMS writers: {steps:.0f} USSD steps/s, {registrations:.0f} registrations/s")
+    assert registrations > 100
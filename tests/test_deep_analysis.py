@@ -0,0 +1,81 @@
+import threading
+from concurrent.futures import Future
+
+import pytest
+
+import app
+
+SECTIONS = tuple(app.DEEP_ANALYSIS_FALLBACKS)
+
+
+class RecordingJob:
+    """Stands in for jobs.Job, keeping every published update"""
+
+    id = 'test-analysis'
+
+    def __init__(self):
+        self.payload = {'crop_type': 'maize', 'quantity': 100, 'location': 'Nairobi',
+                        'storage_method': 'silo', 'conditions': 'harvested 3 days ago'}
+        self.updates = []
+
+    def update(self, partial):
+        self.updates.append(partial['deep_analysis'])
+
+
+def finish_later(future, seconds, value):
+    timer = threading.Timer(seconds, future.set_result, (value,))
+    timer.start()
+    return timer
+
+
+@pytest.fixture
+def futures(monkeypatch):
+    futures = {section: Future() for section in SECTIONS}
+    monkeypatch.setattr(app.hybrid_ai, 'start_deep_analysis', lambda *args: futures)
+    monkeypatch.setattr(app, 'DEEP_ANALYSIS_BUDGET', 0.1)
+    monkeypatch.setattr(app, 'LLM_TIMEOUT', 0.6)
+    return futures
+
+
+def test_late_sections_are_attached_when_they_finish(futures):
+    first, late, stuck = SECTIONS
+    futures[first].set_result('conditions text')
+    timer = finish_later(futures[late], 0.3, 'late text')
+    job = RecordingJob()
+    app.run_deep_analysis(job)
+    timer.join()
+
+    assert [update['status'] for update in job.updates] == ['partial', 'partial', 'complete']
+    assert job.updates[0]['pending_sections'] == [late, stuck]
+    assert job.updates[1]['sections'] == {first: 'conditions text', late: 'late text'}
+    assert job.updates[2]['sections'][stuck] == app.DEEP_ANALYSIS_FALLBACKS[stuck]
+    assert job.updates[2]['timed_out_sections'] == [stuck]
+    assert not futures[stuck].cancelled()
+
+
+def test_sections_are_published_as_they_finish(futures):
+    first, second, third = SECTIONS
+    timers = [finish_later(futures[second], 0.02, 'second text'), finish_later(futures[third], 0.05, 'third text')]
+    futures[first].set_result('first text')
+    job = RecordingJob()
+    app.run_deep_analysis(job)
+    for timer in timers:
+        timer.join()
+
+    assert [update['status'] for update in job.updates] == ['partial', 'partial', 'complete']
+    assert [update['pending_sections'] for update in job.updates] == [[second, third], [third], []]
+    assert job.updates[-1]['sections'] == {first: 'first text', second: 'second text', third: 'third text'}
+    assert 'timed_out_sections' not in job.updates[-1]
+
+
+def test_failed_section_gets_its_fallback(futures):
+    first, failing, last = SECTIONS
+    futures[first].set_result('first text')
+    futures[failing].set_exception(RuntimeError('model overloaded'))
+    futures[last].set_result('last text')
+    job = RecordingJob()
+    app.run_deep_analysis(job)
+
+    assert [update['status'] for update in job.updates] == ['partial', 'partial', 'complete']
+    assert job.updates[-1]['sections'][failing] == app.DEEP_ANALYSIS_FALLBACKS[failing]
+    assert job.updates[-1]['sections'][last] == 'last text'
@@ -0,0 +1,101 @@
+import threading
+import time
+
+import database as db
+from jobs import JOB_MAX_ATTEMPTS, JobQueue, new_job_id
+
+
+def _wait_for(queue, job_id, status, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = queue.get(job_id)
+        if job is not None and job['status'] == status:
+            return job
+        time.sleep(0.02)
+    raise AssertionError(f"job {job_id} never reached {status}: {queue.get(job_id)}")
+
+
+def _insert(status, attempts, created_at, updated_at, kind='noop'):
+    job_id = new_job_id()
+    with db.transaction() as conn:
+        conn.execute('''
+            INSERT INTO jobs (id, kind, payload, status, result, attempts, created_at, updated_at)
+            VALUES (?, ?, '{}', ?, '{}', ?, ?, ?)
+        ''', (job_id, kind, status, attempts, created_at, updated_at))
+    return job_id
+
+
+# Every started queue's workers share the jobs table, so the tests share one
+queue = JobQueue(workers=2, poll_interval=0.05, stale_after=0.2, sweep_interval=0.05)
+
+
+@queue.handler('double')
+def double(job):
+    job.update({'started': True})
+    return {'value': job.payload['value'] * 2}
+
+
+@queue.handler('boom')
+def boom(job):
+    raise RuntimeError('no luck')
+
+
+@queue.handler('resumable')
+def resumable(job):
+    return {'resumed': True}
+
+
+unserializable_runs = []
+
+
+@queue.handler('unserializable')
+def unserializable(job):
+    unserializable_runs.append(job.id)
+    # The first result cannot be stored as JSON; the retry's can
+    return {'tags': {'maize'}} if len(unserializable_runs) == 1 else {'tags': ['maize']}
+
+
+def test_jobs_run_and_publish_results():
+    job = _wait_for(queue, queue.enqueue('double', {'value': 21}), 'done')
+    assert job['result'] == {'started': True, 'value': 42}
+
+
+def test_failed_handler_is_recorded():
+    job = _wait_for(queue, queue.enqueue('boom', {}), 'failed')
+    assert job['error'] == 'no luck'
+
+
+def _workers():
+    return sum(thread.name.startswith('job-worker-') for thread in threading.enumerate())
+
+
+def test_failed_finish_keeps_the_worker_and_is_retried():
+    queue.start()
+    workers = _workers()
+    job_id = queue.enqueue('unserializable', {})
+    assert _wait_for(queue, job_id, 'done')['result'] == {'tags': ['maize']}
+    assert unserializable_runs == [job_id, job_id]
+    assert _workers() == workers
+
+
+def test_stale_jobs_are_requeued_while_running():
+    queue.start()
+    # Claimed by a worker elsewhere that died after this queue started
+    now = time.time()
+    job_id = _insert('running', 1, now, now, kind='resumable')
+    exhausted = _insert('running', JOB_MAX_ATTEMPTS, now, now, kind='resumable')
+    assert _wait_for(queue, job_id, 'done')['result'] == {'resumed': True}
+    assert _wait_for(queue, exhausted, 'failed')['result'] == {}
+
+
+def test_finished_jobs_are_purged_after_retention():
+    purging = JobQueue(retention=3600)
+    old = time.time() - 7200
+    expired = _insert('done', 1, old, old)
+    # Still running: never stale during the test
+    running = _insert('running', 1, old, time.time() + 3600, kind='double')
+    recent = purging.record('analysis', {'ok': True})
+    assert purging._purge() >= 1
+    assert purging.get(expired) is None
+    assert purging.get(running) is not None
+    assert purging.get(recent)['result'] == {'ok': True}
@@ -0,0 +1,92 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import openai
+import pytest
+
+from llm_gateway import LLMError, LLMGateway
+
+MESSAGES = [{'role': 'user', 'content': 'maize price?'}]
+
+
+@pytest.fixture
+def provider(monkeypatch):
+    """Local stand-in for the OpenAI chat endpoint that tracks how many requests are in flight"""
+    state = {'delay': 0.0, 'in_flight': 0, 'peak': 0, 'requests': 0}
+    lock = threading.Lock()
+
+    class StandIn(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_POST(self):
+            payload = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+            with lock:
+                state['requests'] += 1
+                state['in_flight'] += 1
+                state['peak'] = max(state['peak'], state['in_flight'])
+            try:
+                time.sleep(state['delay'])
+                if payload.get('stream'):
+                    chunks = [{'choices': [{'delta': {'content': token}}]} for token in ('Sell ', 'now')]
+                    body = ''.join(f"data: {json.dumps(chunk)}\n\n" for chunk in chunks) + 'data: [DONE]\n\n'
+                else:
+                    body = json.dumps({'choices': [{'message': {'content': f"  {payload['model']} says hold \n"}}]})
+                body = body.encode()
+                self.send_response(200)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            finally:
+                with lock:
+                    state['in_flight'] -= 1
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StandIn)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setattr(openai, 'api_key', 'test-key')
+    monkeypatch.setattr(openai, 'api_base', f"http://127.0.0.1:{server.server_port}/v1")
+    yield state
+    server.shutdown()
+
+
+def test_complete_returns_the_reply(provider):
+    assert LLMGateway(model='test-model').complete(MESSAGES) == 'test-model says hold'
+
+
+def test_stream_yields_tokens(provider):
+    assert list(LLMGateway().stream(MESSAGES)) == ['Sell ', 'now']
+
+
+def test_in_flight_completions_are_bounded(provider):
+    provider['delay'] = 0.2
+    gateway = LLMGateway(max_in_flight=2)
+    futures = [gateway.submit(MESSAGES) for _ in range(6)]
+    assert all(future.result(timeout=5) for future in futures)
+    assert provider['requests'] == 6
+    assert provider['peak'] == 2
+
+
+def test_slow_completion_raises_llm_error(provider):
+    provider['delay'] = 1.0
+    with pytest.raises(LLMError, match='timed out'):
+        LLMGateway(timeout=0.2).complete(MESSAGES)
+
+
+def test_busy_slots_raise_llm_error(provider):
+    provider['delay'] = 0.5
+    gateway = LLMGateway(max_in_flight=1, queue_timeout=0.1)
+    first = gateway.submit(MESSAGES)
+    time.sleep(0.05)
+    with pytest.raises(LLMError, match='slots are busy'):
+        gateway.complete(MESSAGES)
+    assert first.result(timeout=5)
+
+
+def test_missing_api_key_raises_llm_error(provider, monkeypatch):
+    monkeypatch.setattr(openai, 'api_key', None)
+    with pytest.raises(LLMError, match='not configured'):
+        LLMGateway().complete(MESSAGES)
@@ -0,0 +1,38 @@
+import pytest
+
+import database as db
+import loss_model
+import risk_tables
+from conftest import SCRATCH_DIR
+from price_forecast import forecaster
+
+
+@pytest.fixture(scope='module')
+def bundle():
+    """A small ensemble trained after cassava traded well below its reference price"""
+    with db.transaction() as conn:
+        for price in (40, 60):
+            forecaster.record(conn, 'cassava', 10, price, location='Kitui')
+    with pytest.MonkeyPatch.context() as patch:
+        for name in ('_bundle', '_row_scorer'):
+            patch.setattr(loss_model, name, None)
+        bundle = loss_model.train(f"{SCRATCH_DIR}/loss.joblib", synthetic_rows=600)
+        yield bundle
+    loss_model._predict_rounded.cache_clear()
+
+
+def test_training_prices_are_saved_with_the_model(bundle):
+    with db.connection() as conn:
+        assert bundle['market_prices'] == loss_model.average_prices(conn)
+    assert loss_model.market_price(bundle['market_prices'], ' Cassava') == pytest.approx(50)
+    assert loss_model.market_price(bundle['market_prices'], 'dragonfruit') == risk_tables.DEFAULT_CROP_ROW[risk_tables.FORECAST_PRICE]
+
+
+def test_inference_uses_the_training_prices(bundle):
+    lot = ('cassava', 'traditional', 'humid', 80, 28, 14, 1, 100)
+    X = loss_model.feature_matrix(*[[value] for value in lot], market_prices=[50])
+    expected = loss_model.predict_batch(X)[1][0]
+
+    label, probabilities = loss_model.predict_one(*lot)
+    assert probabilities == pytest.approx(expected.tolist(), abs=1e-6)
+    assert label == loss_model.CLASSES[int(expected.argmax())]
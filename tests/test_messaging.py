@@ -0,0 +1,110 @@
+import uuid
+
+import pytest
+
+import messaging
+import outbound
+from messaging import SMS_HELP_TEXT, meta_text_messages, process_whatsapp_batch
+
+
+def message(message_id, phone_number, body=None, kind='text'):
+    """One message object as Meta nests it under entry[].changes[].value.messages[]"""
+    content = {'text': {'body': body}} if kind == 'text' else {kind: {'id': 'media-1'}}
+    return {'id': message_id, 'from': phone_number, 'type': kind, **content}
+
+
+def payload(*entries):
+    """A Meta webhook body: each entry is a list of changes, each change a list of messages"""
+    return {'object': 'whatsapp_business_account', 'entry': [
+        {'id': f"entry-{number}", 'changes': [{'field': 'messages', 'value': {'messages': messages}} for messages in changes]}
+        for number, changes in enumerate(entries)
+    ]}
+
+
+@pytest.fixture
+def ids():
+    return [f"wamid.{uuid.uuid4().hex}" for _ in range(5)]
+
+
+@pytest.fixture
+def batch(ids):
+    """Two entries, three changes: two lots from one sender, an image, a repeated id, a greeting and another lot"""
+    first, second, third, fourth, fifth = ids
+    return payload(
+        [
+            [message(first, '254711000001', 'maize 50kg Nakuru'), message(second, '254711000002', kind='image')],
+            [message(third, '254711000001', 'beans 20kg Kisumu'), message(first, '254711000001', 'maize 50kg Nakuru')],
+        ],
+        [
+            [message(fourth, '254711000003', 'hello'), message(fifth, '254711000002', 'rice 100kg Mombasa')],
+        ],
+    )
+
+
+@pytest.fixture
+def outbox(monkeypatch):
+    """Replies handed to the dispatcher, and harvest analyses run, instead of the real thing"""
+    state = {'sent': [], 'analysed': [], 'registered': []}
+    register_farmers = messaging.register_farmers
+
+    def analyse(lot, phone_number, farmer_id=None):
+        state['analysed'].append((phone_number, lot['crop']))
+        return f"analysis of {lot['crop']} for {phone_number}"
+
+    def register(lots):
+        state['registered'].append(dict(lots))
+        return register_farmers(lots)
+
+    monkeypatch.setattr(messaging, 'process_harvest_request', analyse)
+    monkeypatch.setattr(messaging, 'register_farmers', register)
+    monkeypatch.setattr(outbound.dispatcher, 'send', lambda provider, recipient, body, **kwargs: state['sent'].append((recipient, body)))
+    return state
+
+
+def test_text_messages_are_read_from_every_entry_and_change(batch, ids):
+    first, _, third, fourth, fifth = ids
+    assert meta_text_messages(batch) == [
+        (first, '254711000001', 'maize 50kg Nakuru'),
+        (third, '254711000001', 'beans 20kg Kisumu'),
+        (first, '254711000001', 'maize 50kg Nakuru'),
+        (fourth, '254711000003', 'hello'),
+        (fifth, '254711000002', 'rice 100kg Mombasa'),
+    ]
+    assert meta_text_messages({'entry': [{'changes': [{'value': {'statuses': [{'id': 'x'}]}}]}]}) == []
+
+
+def test_one_reply_per_sender_for_their_latest_lot(batch, outbox):
+    assert process_whatsapp_batch('meta', meta_text_messages(batch)) == (4, 1)
+    assert sorted(outbox['sent']) == [
+        ('254711000001', 'analysis of beans for 254711000001'),
+        ('254711000002', 'analysis of rice for 254711000002'),
+        ('254711000003', SMS_HELP_TEXT),
+    ]
+    assert sorted(outbox['analysed']) == [('254711000001', 'beans'), ('254711000002', 'rice')]
+    assert len(outbox['registered']) == 1 and set(outbox['registered'][0]) == {'254711000001', '254711000002'}
+
+
+def test_redelivered_batch_writes_and_sends_nothing(batch, outbox):
+    messages = meta_text_messages(batch)
+    process_whatsapp_batch('meta', messages)
+    sent, registered = len(outbox['sent']), len(outbox['registered'])
+
+    assert process_whatsapp_batch('meta', messages) == (0, len(messages))
+    assert len(outbox['sent']) == sent and len(outbox['registered']) == registered
+
+
+def test_claims_are_released_when_processing_fails(batch, outbox, monkeypatch):
+    messages = meta_text_messages(batch)
+
+    def fail(lot, phone_number, farmer_id=None):
+        raise RuntimeError('model down')
+
+    with monkeypatch.context() as broken:
+        broken.setattr(messaging, 'process_harvest_request', fail)
+        with pytest.raises(RuntimeError):
+            process_whatsapp_batch('meta', messages)
+    assert outbox['sent'] == []
+
+    # The provider redelivers and this time it goes through
+    assert process_whatsapp_batch('meta', messages) == (4, 1)
+    assert len(outbox['sent']) == 3
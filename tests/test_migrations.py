@@ -0,0 +1,161 @@
+import os
+import sqlite3
+
+import pytest
+
+from buyer_index import parse_offer_price
+from conftest import SCRATCH_DIR
+from migrations import LATEST_VERSION, migrate
+
+# Schema written by the first app.py init_db, before migrations existed
+BASELINE_SCHEMA = '''
+    CREATE TABLE farmers (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        phone_number TEXT UNIQUE,
+        name TEXT,
+        location TEXT,
+        crop_type TEXT,
+        quantity INTEGER,
+        storage_method TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE TABLE buyers (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT,
+        phone TEXT,
+        location TEXT,
+        crop_types TEXT,
+        price_range TEXT,
+        quantity_needed INTEGER,
+        verified BOOLEAN DEFAULT FALSE,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE TABLE ussd_sessions (
+        session_id TEXT PRIMARY KEY,
+        data TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE TABLE transactions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        farmer_id INTEGER,
+        buyer_id INTEGER,
+        crop_type TEXT,
+        quantity REAL,
+        price REAL,
+        transaction_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+'''
+
+# Farmers and buyers as app_backup.py stored them
+LEGACY_SCHEMA = '''
+    CREATE TABLE farmers (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        phone TEXT UNIQUE NOT NULL,
+        name TEXT,
+        location TEXT,
+        crops TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE TABLE buyers (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL,
+        phone TEXT,
+        crops_interested TEXT,
+        location TEXT,
+        price_range TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+'''
+
+TRADES = [
+    (1, 'Maize', 10, 3000, '2024-03-01 09:00:00'),
+    (1, 'maize', 5, 3200, '2024-03-01 15:00:00'),
+    (2, 'Beans', 20, 8000, '2024-03-02 10:00:00'),
+]
+
+
+def scratch_db(name, schema):
+    path = os.path.join(SCRATCH_DIR, name)
+    if os.path.exists(path):
+        os.remove(path)
+    conn = sqlite3.connect(path)
+    conn.executescript(schema)
+    return path, conn
+
+
+@pytest.fixture
+def baseline_db():
+    """A database as the pre-migration app left it, with farmers, buyers, a session and trades"""
+    path, conn = scratch_db('baseline.db', BASELINE_SCHEMA)
+    conn.executemany(
+        'INSERT INTO farmers (phone_number, name, location, crop_type, quantity, storage_method) VALUES (?, ?, ?, ?, ?, ?)',
+        [('254711000001', 'Wanjiku', 'nakuru', 'maize', 500, 'bags'), ('254711000002', 'Otieno', ' kisumu ', 'beans', 200, None)]
+    )
+    conn.executemany(
+        'INSERT INTO buyers (name, phone, location, crop_types, price_range, quantity_needed, verified) VALUES (?, ?, ?, ?, ?, ?, ?)',
+        [('Rift Millers', '+254700000010', 'Nakuru', 'Maize, beans', 'KES 60-70 per kg', 1000, 1),
+         ('Lake Traders', '+254700000011', 'Kisumu', 'beans', '3000-3500', 300, 0)]
+    )
+    conn.execute("INSERT INTO ussd_sessions (session_id, data) VALUES ('ATUid_old', '{}')")
+    conn.executemany(
+        'INSERT INTO transactions (farmer_id, crop_type, quantity, price, transaction_date) VALUES (?, ?, ?, ?, ?)', TRADES
+    )
+    conn.commit()
+    conn.close()
+    return path
+
+
+def test_baseline_database_is_upgraded_with_its_data(baseline_db):
+    assert migrate(baseline_db) == LATEST_VERSION
+
+    conn = sqlite3.connect(baseline_db)
+    assert conn.execute('SELECT MAX(version) FROM schema_migrations').fetchone()[0] == LATEST_VERSION
+    assert conn.execute('SELECT phone_number, location FROM farmers ORDER BY id').fetchall() == [
+        ('254711000001', 'nakuru'), ('254711000002', ' kisumu ')
+    ]
+    # Existing buyers are kept, so the samples are not seeded
+    buyers = conn.execute('SELECT id, price_range, crop_types, geo_cell, offer_price FROM buyers ORDER BY id').fetchall()
+    assert len(buyers) == 2 and all(geo_cell is not None for _, _, _, geo_cell, _ in buyers)
+    assert [offer for *_, offer in buyers] == [parse_offer_price(price, crops) for _, price, crops, _, _ in buyers]
+    assert buyers[0][4] == 65
+
+    assert conn.execute('SELECT crop, buyer_id, verified FROM buyer_crops ORDER BY buyer_id, crop').fetchall() == [
+        ('beans', 1, 1), ('maize', 1, 1), ('beans', 2, 0)
+    ]
+    assert conn.execute('''
+        SELECT COUNT(*) FROM buyer_crops JOIN buyers ON buyers.id = buyer_crops.buyer_id
+        WHERE buyer_crops.geo_cell = buyers.geo_cell
+    ''').fetchone()[0] == 3
+
+    assert conn.execute('SELECT location FROM transactions ORDER BY id').fetchall() == [('Nakuru',), ('Nakuru',), ('Kisumu',)]
+    assert conn.execute('SELECT crop, location, day, count, total FROM price_aggregates ORDER BY crop').fetchall() == [
+        ('beans', 'Kisumu', '2024-03-02', 1, 8000.0), ('maize', 'Nakuru', '2024-03-01', 2, 6200.0)
+    ]
+    assert conn.execute('SELECT crop, location FROM price_models ORDER BY crop, location').fetchall() == [
+        ('beans', ''), ('beans', 'Kisumu'), ('maize', ''), ('maize', 'Nakuru')
+    ]
+    assert conn.execute('SELECT COUNT(*) FROM ussd_sessions').fetchone()[0] == 0
+    conn.close()
+
+    # Already current: nothing further is applied
+    assert migrate(baseline_db) == LATEST_VERSION
+    conn = sqlite3.connect(baseline_db)
+    assert conn.execute('SELECT COUNT(*) FROM schema_migrations').fetchone()[0] == LATEST_VERSION
+    conn.close()
+
+
+def test_app_backup_database_is_adopted():
+    path, conn = scratch_db('legacy.db', LEGACY_SCHEMA)
+    conn.execute("INSERT INTO farmers (phone, name, location, crops) VALUES ('254711000003', 'Achieng', 'Eldoret', 'wheat')")
+    conn.execute("INSERT INTO buyers (name, crops_interested, location, price_range) VALUES ('Uasin Mills', 'wheat', 'Eldoret', 'KES 40/kg')")
+    conn.commit()
+    conn.close()
+
+    assert migrate(path) == LATEST_VERSION
+    conn = sqlite3.connect(path)
+    assert conn.execute('SELECT phone_number, crop_type FROM farmers').fetchall() == [('254711000003', 'wheat')]
+    assert conn.execute('SELECT crop_types, verified, offer_price FROM buyers').fetchall() == [
+        ('wheat', 1, parse_offer_price('KES 40/kg', 'wheat'))
+    ]
+    assert conn.execute('SELECT crop, verified FROM buyer_crops').fetchall() == [('wheat', 1)]
+    conn.close()
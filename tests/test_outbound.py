@@ -0,0 +1,93 @@
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from outbound import MetaWhatsApp, OutboundDispatcher, Provider, TwilioWhatsApp
+
+
+@pytest.fixture
+def stand_in(monkeypatch):
+    """Local provider API: slow, sometimes overloaded, rejects one recipient outright"""
+    state = {'active': 0, 'peak': 0, 'requests': 0}
+    state_lock = threading.Lock()
+
+    class StandIn(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_POST(self):
+            payload = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            with state_lock:
+                state['active'] += 1
+                state['requests'] += 1
+                state['peak'] = max(state['peak'], state['active'])
+            time.sleep(random.uniform(0.01, 0.05))
+            roll = random.random()
+            if b'reject' in payload:
+                status = 400
+            elif roll < 0.15:
+                status = 503
+            elif roll < 0.2:
+                status = 429
+            else:
+                status = 201 if 'Messages.json' in self.path else 200
+            body = json.dumps({'status': status}).encode()
+            self.send_response(status)
+            self.send_header('Content-Length', str(len(body)))
+            if status == 429:
+                self.send_header('Retry-After', '0.05')
+            self.end_headers()
+            self.wfile.write(body)
+            with state_lock:
+                state['active'] -= 1
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StandIn)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_port}"
+    for name, value in {
+        'TWILIO_ACCOUNT_SID': 'ACtest', 'TWILIO_AUTH_TOKEN': 'token', 'TWILIO_API_BASE': base,
+        'WHATSAPP_PHONE_NUMBER_ID': '123', 'WHATSAPP_ACCESS_TOKEN': 'token', 'META_GRAPH_BASE': base,
+    }.items():
+        monkeypatch.setenv(name, value)
+    yield state
+    server.shutdown()
+
+
+def test_provider_is_abstract():
+    with pytest.raises(TypeError):
+        Provider(1)
+
+
+def test_every_message_is_sent_or_dead_lettered(stand_in):
+    dispatcher = OutboundDispatcher([TwilioWhatsApp(4), MetaWhatsApp(4)], timeout=2, backoff=0.02)
+    total = 400
+    for number in range(total):
+        dispatcher.send('twilio' if number % 2 else 'meta', f"+2547{number:08d}", f"Message {number}" if number % 50 else 'reject me')
+    assert dispatcher.drain(timeout=120), dispatcher.stats()
+
+    stats = dispatcher.stats()
+    assert stats['sent'] + stats['dead'] == total
+    assert stats['dead'] >= total // 50
+    # Concurrency per provider never exceeds its worker count
+    assert stand_in['peak'] <= 8
+
+
+def test_unconfigured_provider_logs_instead_of_sending(monkeypatch):
+    for name in ('WHATSAPP_PHONE_NUMBER_ID', 'WHATSAPP_ACCESS_TOKEN'):
+        monkeypatch.delenv(name, raising=False)
+    done = []
+    dispatcher = OutboundDispatcher([MetaWhatsApp(1)])
+    dispatcher.send('meta', '+254700000000', 'hello', on_done=done.append)
+    stats = dispatcher.stats()
+    assert (stats['logged'], stats['queued'], done) == (1, 0, [True])
+
+
+def test_unknown_provider_is_rejected():
+    with pytest.raises(ValueError):
+        OutboundDispatcher([MetaWhatsApp(1)]).send('pigeon', '+254700000000', 'hello')
@@ -0,0 +1,55 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import database as db
+import price_aggregates
+from buyer_index import parse_offer_price
+from messaging import price_outlook
+from price_forecast import forecaster
+
+
+def _record(conn, crop, price, location, days_ago=1):
+    forecaster.record(conn, crop, 10, price, location=location,
+                      transaction_date=datetime.now() - timedelta(days=days_ago))
+
+
+def test_triggers_match_a_full_backfill():
+    with db.transaction() as conn:
+        for number in range(30):
+            _record(conn, 'sorghum', 150 + number, 'Kitui', days_ago=number % 5 + 1)
+        conn.execute("UPDATE transactions SET price = price + 7 WHERE crop_type = 'sorghum' AND price < 160")
+        conn.execute("DELETE FROM transactions WHERE crop_type = 'sorghum' AND price > 175")
+        live = conn.execute("SELECT * FROM price_aggregates WHERE crop = 'sorghum' ORDER BY day").fetchall()
+        price_aggregates.backfill(conn)
+        rebuilt = conn.execute("SELECT * FROM price_aggregates WHERE crop = 'sorghum' ORDER BY day").fetchall()
+    assert live == rebuilt
+
+
+def test_location_key_is_normalized_on_write():
+    with db.transaction() as conn:
+        for price in (180, 200, 220):
+            _record(conn, 'millet', price, '  machakos ')
+    summary = price_aggregates.market_summary('millet', 'MACHAKOS')
+    assert summary['location'] == 'Machakos'
+    assert (summary['count'], summary['min'], summary['max']) == (3, 180, 220)
+
+
+def test_market_ranges_are_per_kg():
+    with db.transaction() as conn:
+        for price in (150, 200, 250):
+            _record(conn, 'groundnuts', price, 'Busia')
+    low, high = price_aggregates.per_kg_range(price_aggregates.market_summary('groundnuts', 'Busia'), 6.8)
+    assert (low, high) == pytest.approx((6.8 * 0.75, 6.8 * 1.25))
+
+    price, forecast_price, _, price_range = price_outlook('groundnuts', 'Busia')
+    assert price == 6.8
+    assert forecast_price < 20
+    assert price_range == f"Market: {low:.2f}-{high:.2f} KES/kg\n"
+
+
+def test_offers_are_read_in_kes_per_kg():
+    assert parse_offer_price('KES 3.0-3.5/kg') == pytest.approx(3.25)
+    assert parse_offer_price('Market rate') is None
+    # Market-scale quotes are converted with the crop's price ratio (maize: 3.2 KES/kg per 200)
+    assert parse_offer_price('200-250 KES/kg', 'maize,wheat') == pytest.approx(225 * 3.2 / 200)
@@ -0,0 +1,102 @@
+import os
+import random
+from datetime import datetime, timedelta
+
+import pytest
+
+import database as db
+import ml_loader
+import price_forecast
+from conftest import SCRATCH_DIR
+from migrations import migrate
+from price_forecast import DECAY_PER_DAY, RIDGE, PriceForecaster, PriceModel, _features
+
+
+def direct_fit(observations, origin=None):
+    """Closed-form discounted ridge fit of (day, price) pairs, discounted to origin (default: the last day)"""
+    np = ml_loader.numpy()
+    origin = origin or max(day for day, _ in observations)
+    x = np.array([_features(day, origin) for day, _ in observations])
+    w = np.array([DECAY_PER_DAY ** (origin - day) for day, _ in observations])
+    y = np.array([price for _, price in observations])
+    return np.linalg.solve(x.T @ (w[:, None] * x) + np.diag(RIDGE), x.T @ (w * y))
+
+
+def test_incremental_updates_match_a_direct_fit():
+    rng = random.Random(15)
+    observations = [(20000 + day + rng.random(), 40 + 0.1 * day + rng.gauss(0, 2)) for day in range(90)]
+    # Mostly in order, with some back-dated arrivals
+    arrivals = observations[:60] + observations[75:] + observations[60:75]
+
+    model = PriceModel()
+    for day, price in arrivals:
+        model.add(day, price)
+
+    assert model.origin == max(day for day, _ in observations)
+    assert model.params == pytest.approx(direct_fit(observations).tolist(), rel=1e-6)
+
+
+def test_advance_matches_a_fit_discounted_to_the_new_origin():
+    observations = [(20000 + day, 50 + day * 0.2) for day in range(30)]
+    model = PriceModel()
+    for day, price in observations:
+        model.add(day, price)
+    model._advance(20039)
+    model._solve()
+    assert model.origin == 20039
+    assert model.params == pytest.approx(direct_fit(observations, origin=20039).tolist(), rel=1e-6)
+
+
+def test_linear_series_is_extrapolated():
+    model = PriceModel()
+    for day in range(180):
+        model.add(20000 + day, 30 + 0.05 * day)
+    assert model.predict(20179) == pytest.approx(30 + 0.05 * 179, rel=0.01)
+    assert model.predict(20209) > model.predict(20179)
+    assert model.residual_std() < 0.5
+
+
+@pytest.fixture
+def market(monkeypatch):
+    """A separate database with 60 days of rising maize prices in Nakuru and a few in Kitui"""
+    path = os.path.join(SCRATCH_DIR, 'forecast.db')
+    if os.path.exists(path):
+        os.remove(path)
+    migrate(path)
+    pool = db.ConnectionPool(path, size=1)
+    monkeypatch.setattr(price_forecast, 'db', pool)
+    noon = datetime.now().replace(hour=12, minute=0, second=0, microsecond=0)
+
+    recorder = PriceForecaster()
+    with pool.transaction() as conn:
+        for days_ago in range(60, 0, -1):
+            recorder.record(conn, 'Maize', 10, 3000 + 10 * (60 - days_ago), location='nakuru',
+                            transaction_date=noon - timedelta(days=days_ago))
+        recorder.record(conn, 'maize', 10, 2500, location='Kitui', transaction_date=noon - timedelta(days=1))
+    yield pool, recorder
+    pool.close_all()
+
+
+def test_rebuild_matches_recorded_models(market):
+    pool, recorder = market
+    recorded = {key: recorder.model(*key).params for key in [('maize', 'Nakuru'), ('maize', 'Kitui'), ('maize', '')]}
+
+    rebuilt = PriceForecaster()
+    with pool.transaction() as conn:
+        assert rebuilt.rebuild(conn) == 3
+    for key, params in recorded.items():
+        assert rebuilt.model(*key).params == pytest.approx(params, rel=1e-6)
+
+
+def test_forecast_prefers_a_location_with_enough_history(market):
+    _, recorder = market
+    local = recorder.forecast('maize', ' nakuru')
+    assert local['location'] == 'Nakuru'
+    assert local['trend'] == 'increasing'
+    assert local['current'] == pytest.approx(3600, rel=0.02)
+    assert local['forecasts'][30] > local['forecasts'][7] > local['current']
+    assert 0 < local['confidence'] <= 100 and local['observations'] == 60
+
+    thin = recorder.forecast('maize', 'Kitui')
+    assert thin['location'] is None and thin['observations'] == 61
+    assert recorder.forecast('quinoa') is None
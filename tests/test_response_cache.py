@@ -0,0 +1,69 @@
+import threading
+import time
+
+import response_cache
+from response_cache import ChatResponseCache, quantity_bucket
+
+make_key = ChatResponseCache.make_key
+
+
+def test_keys_normalize_the_question_and_bucket_the_quantity():
+    assert make_key('How do I store maize?', 'Maize', 'Nairobi ', '80kg') == make_key('how do i  store MAIZE', 'maize', 'nairobi', 95)
+    assert make_key('store maize', 'maize', 'Nairobi', 80) != make_key('store maize', 'maize', 'Nairobi', 800)
+    assert quantity_bucket('lots') == 'unknown' and quantity_bucket(9000) == '>5000'
+
+
+def test_streamed_and_json_replies_are_cached_apart():
+    assert make_key('store maize', 'maize', 'Nairobi', 80, 'stream') != make_key('store maize', 'maize', 'Nairobi', 80)
+    assert make_key('store maize', 'maize', 'Nairobi', 80) == make_key('store maize', 'maize', 'Nairobi', 80, 'json')
+
+
+def test_hits_and_misses_are_counted():
+    cache = ChatResponseCache(persist=False)
+    assert cache.get('question') is None
+    cache.put('question', 'answer')
+    assert cache.get('question') == 'answer'
+    assert cache.stats() == {'hits': 1, 'misses': 1, 'hit_rate': 0.5, 'entries': 1, 'persistent': False}
+
+
+def test_entries_expire_after_the_ttl():
+    cache = ChatResponseCache(ttl=0.1, persist=False)
+    cache.put('question', 'answer')
+    time.sleep(0.15)
+    assert cache.get('question') is None
+    assert cache.stats()['entries'] == 0
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = ChatResponseCache(max_entries=2, persist=False)
+    cache.put('a', 'first')
+    cache.put('b', 'second')
+    cache.get('a')
+    cache.put('c', 'third')
+    assert cache.get('b') is None
+    assert cache.get('a') == 'first' and cache.get('c') == 'third'
+
+
+def test_answers_survive_a_new_instance():
+    key = make_key('when to sell beans', 'beans', 'Kisumu', 200)
+    ChatResponseCache().put(key, 'Sell in March')
+    restarted = ChatResponseCache()
+    assert restarted.get(key) == 'Sell in March'
+    assert restarted.stats()['entries'] == 1
+    assert ChatResponseCache(ttl=0).get(key) is None
+
+
+def test_concurrent_writes_are_all_counted(monkeypatch):
+    monkeypatch.setattr(response_cache, 'PURGE_EVERY', 7)
+    cache = ChatResponseCache()
+
+    def write(worker):
+        for n in range(25):
+            cache.put(f"concurrent-{worker}-{n}", 'answer')
+
+    threads = [threading.Thread(target=write, args=(worker,)) for worker in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert cache._writes == 200
@@ -0,0 +1,93 @@
+import time
+
+import pytest
+
+import ml_loader
+import risk_engine
+
+LOTS = {
+    'cropType': ['maize', 'tomatoes', 'Beans', 'dragonfruit', 'rice', 'maize'],
+    'quantity': [100, 40, 250, 10, 0, 1000],
+    'humidity': [65, 85, 71, 40, 90, 70],
+    'storageMethod': ['traditional', 'improved', 'hermetic', 'unknown', 'silo', 'traditional'],
+    'storageDays': [1, 3, 12, 0, 30, 7],
+}
+
+
+class ZeroNoise:
+    """Stands in for a NumPy generator with the noise switched off"""
+
+    def uniform(self, low, high, size):
+        return ml_loader.numpy().zeros(size)
+
+
+def test_batch_matches_single_lot_scores(monkeypatch):
+    monkeypatch.setattr(risk_engine.random, 'uniform', lambda low, high: 0.0)
+    scores = risk_engine.score_batch(LOTS['cropType'], LOTS['quantity'], LOTS['humidity'],
+                                     LOTS['storageMethod'], LOTS['storageDays'], rng=ZeroNoise())
+
+    for index, lot in enumerate(zip(*LOTS.values())):
+        loss_percentage, loss_value, urgency = risk_engine.score_lot(*lot)
+        assert scores['loss_percentage'][index] == pytest.approx(loss_percentage)
+        assert scores['estimated_loss_value'][index] == pytest.approx(loss_value)
+        assert scores['urgency'][index] == urgency
+
+
+def test_batch_losses_stay_in_bounds():
+    rng = ml_loader.numpy().random.default_rng(7)
+    scores = risk_engine.score_batch(['maize'] * 1000, [100] * 1000, [95] * 1000, ['traditional'] * 1000,
+                                     [60] * 1000, rng=rng)
+    assert scores['loss_percentage'].min() >= risk_engine.MIN_LOSS_PERCENTAGE
+    assert scores['loss_percentage'].max() <= risk_engine.MAX_LOSS_PERCENTAGE
+
+
+def test_crop_age_days():
+    assert risk_engine.crop_age_days('harvested 4 days ago, sacks in the shed') == 4
+    assert risk_engine.crop_age_days('') == 1
+
+
+@pytest.fixture(scope='module')
+def client():
+    from app import app
+    return app.test_client()
+
+
+def test_batch_endpoint(client):
+    response = client.post('/api/analyze/batch', json={
+        'cropType': LOTS['cropType'], 'quantity': LOTS['quantity'],
+        'storageMethod': LOTS['storageMethod'], 'storageDays': LOTS['storageDays'],
+    })
+    data = response.get_json()
+    assert response.status_code == 200 and data['count'] == len(LOTS['cropType'])
+    assert len(data['loss_percentage']) == len(data['urgency_level']) == data['count']
+    assert set(data['urgency_level']) <= set(risk_engine.URGENCY_LEVELS)
+
+
+def test_batch_endpoint_rejects_ragged_columns(client):
+    response = client.post('/api/analyze/batch', json={'cropType': ['maize', 'beans'], 'quantity': [10]})
+    assert response.status_code == 400
+    assert response.get_json()['status'] == 'error'
+
+
+@pytest.mark.bench
+def test_batch_outpaces_the_per_lot_loop():
+    rows = 100000
+    rng = ml_loader.numpy().random.default_rng(3)
+    crops = rng.choice(['maize', 'beans', 'rice', 'tomatoes', 'potatoes'], rows).tolist()
+    quantities = rng.integers(10, 5000, rows).tolist()
+    humidities = rng.integers(30, 95, rows).tolist()
+    storage = rng.choice(['traditional', 'improved', 'hermetic', 'silo'], rows).tolist()
+    ages = rng.integers(0, 60, rows).tolist()
+
+    started = time.perf_counter()
+    risk_engine.score_batch(crops, quantities, humidities, storage, ages, rng=rng)
+    batch = rows / (time.perf_counter() - started)
+
+    sample = 10000
+    started = time.perf_counter()
+    for lot in zip(crops[:sample], quantities[:sample], humidities[:sample], storage[:sample], ages[:sample]):
+        risk_engine.score_lot(*lot)
+    loop = sample / (time.perf_counter() - started)
+
+    print(f"\n✅ score_batch {batch:,.0f} rows/s vs score_lot loop {loop:,.0f} rows/s ({batch / loop:.0f}x)")
+    assert batch > 2 * loop
@@ -0,0 +1,50 @@
+import timeit
+
+import pytest
+
+import risk_engine
+import risk_tables
+
+
+def test_names_are_interned_case_insensitively():
+    assert risk_tables.crops.code(' Maize ') == risk_tables.crops.code('maize')
+    assert risk_tables.crops.row('MAIZE') == risk_tables.CROP_ROWS['maize']
+
+
+def test_unknown_names_use_the_default_row():
+    assert risk_tables.crops.code('dragonfruit') == risk_tables.crops.unknown
+    assert risk_tables.crops.row('dragonfruit') == risk_tables.DEFAULT_CROP_ROW
+    assert risk_tables.storage.row(None) == risk_tables.DEFAULT_STORAGE_ROW
+
+
+def test_encode_matches_code():
+    names = ['maize', 'Beans', 'dragonfruit', 'maize', ' rice']
+    codes = risk_tables.crops.encode(names)
+    assert codes.tolist() == [risk_tables.crops.code(name) for name in names]
+
+
+def test_matrix_rows_follow_codes_and_are_read_only():
+    matrix = risk_tables.storage.matrix
+    for name, row in risk_tables.STORAGE_ROWS.items():
+        assert tuple(matrix[risk_tables.storage.code(name)]) == row
+    with pytest.raises(ValueError):
+        matrix[0, 0] = 1.0
+
+
+def test_weather_risk_threshold():
+    assert risk_tables.weather_risk(risk_tables.HUMIDITY_THRESHOLD) == risk_tables.DRY_WEATHER_RISK
+    assert risk_tables.weather_risk(risk_tables.HUMIDITY_THRESHOLD + 1) == risk_tables.HUMID_WEATHER_RISK
+
+
+@pytest.mark.bench
+def test_per_request_lookups_are_microseconds():
+    calls = 200000
+    lookups = {
+        'crops.row (exact)': lambda: risk_tables.crops.row('maize'),
+        'crops.row (mixed case)': lambda: risk_tables.crops.row(' Maize '),
+        'score_lot': lambda: risk_engine.score_lot('Maize', 100, 75, 'Traditional', 3),
+    }
+    for name, lookup in lookups.items():
+        per_call = min(timeit.repeat(lookup, number=calls, repeat=3)) / calls
+        print(f"\n✅ {name}: {per_call * 1e9:.0f}ns per call")
+        assert per_call < 20e-6
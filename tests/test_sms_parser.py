@@ -0,0 +1,56 @@
+import pytest
+
+from sms_parser import parse_message
+
+
+@pytest.mark.parametrize('message, expected', [
+    ('maize 50kg Nairobi traditional dry',
+     {'crop': 'maize', 'quantity': 50.0, 'location': 'Nairobi', 'storage': 'traditional', 'weather': 'dry'}),
+    ('Habari, nina magunia 10 ya mahindi Kisumu, mvua', {'crop': 'maize', 'quantity': 900.0, 'location': 'Kisumu', 'weather': 'rainy'}),
+    ('maze 2 tons nairob silo', {'crop': 'maize', 'quantity': 2000.0, 'location': 'Nairobi', 'storage': 'silo'}),
+    ('beans 120 Uasin Gishu county', {'crop': 'beans', 'quantity': 120.0, 'location': 'Uasin Gishu'}),
+])
+def test_parses_harvest_messages(message, expected):
+    assert parse_message(message) == expected
+
+
+@pytest.mark.parametrize('message, quantity', [
+    ('maize 1,000 kg nairobi', 1000.0),
+    ('maize 1,500kg', 1500.0),
+    ('beans 2,000,000kg', 2000000.0),
+    ('maize 1,5 tons', 1500.0),
+    ('maize 2.5t', 2500.0),
+])
+def test_commas(message, quantity):
+    assert parse_message(message)['quantity'] == quantity
+
+
+def test_bare_number_is_not_a_quantity_in_a_question():
+    assert parse_message('maize price 2024') is None
+    assert parse_message('bei ya mahindi 2024') is None
+    assert parse_message('maize 120')['quantity'] == 120.0
+
+
+@pytest.mark.parametrize('message', [
+    'nice day, 50 kg',
+    'hello what is the price of maize today',
+])
+def test_rejects_non_harvest_messages(message):
+    assert parse_message(message) is None
+
+
+def test_ordinary_words_are_not_places():
+    assert 'location' not in parse_message('I have an item: 20 bags maize')
+    assert 'location' not in parse_message('nina magunia 10 ya mahindi wote')
+
+
+def test_field_names_are_not_values():
+    assert 'storage' not in parse_message('maize 50kg storage')
+    assert parse_message('Maize 50kg. Location: Eldoret. Weather?') == {
+        'crop': 'maize', 'quantity': 50.0, 'location': 'Eldoret'}
+
+
+def test_number_with_an_unknown_unit_is_not_a_quantity():
+    assert parse_message('maize 2 packages') is None
+    assert parse_message('maize 2 packages of 50kg')['quantity'] == 50.0
+    assert parse_message('maize 120 please')['quantity'] == 120.0
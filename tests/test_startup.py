@@ -0,0 +1,43 @@
+import json
+import os
+import subprocess
+import sys
+from functools import lru_cache
+
+from conftest import ROOT, SCRATCH_DIR
+
+# Seconds `import app` may take in a fresh interpreter (the pre-lazy-loading import took several)
+STARTUP_BUDGET = float(os.getenv('STARTUP_BUDGET', '2.0'))
+
+# Written to a file: background threads started by the import may still be printing
+_PROBE = '''
+import json, sys, time
+started = time.perf_counter()
+import app
+result = {
+    'seconds': time.perf_counter() - started,
+    'loaded': [name for name in ('pandas', 'sklearn') if name in sys.modules]
+}
+with open(sys.argv[1], 'w') as out:
+    json.dump(result, out)
+'''
+
+
+@lru_cache(maxsize=None)
+def _import_app():
+    # Second run: the scratch database is already migrated, as on a normal boot
+    result = os.path.join(SCRATCH_DIR, 'startup.json')
+    for _ in range(2):
+        subprocess.run([sys.executable, '-c', _PROBE, result], cwd=ROOT, env=dict(os.environ),
+                       capture_output=True, timeout=120, check=True)
+    with open(result) as f:
+        return json.load(f)
+
+
+def test_import_app_stays_under_budget():
+    probe = _import_app()
+    assert probe['seconds'] < STARTUP_BUDGET, probe
+
+
+def test_import_app_leaves_the_ml_stack_unloaded():
+    assert _import_app()['loaded'] == []
@@ -0,0 +1,96 @@
+import json
+import random
+import re
+
+import pytest
+
+import app
+from app import AI_PREFIXES, StreamingFormatter, format_ai_response
+
+WORDS = ('maize', 'store', 'dry', 'the', 'grain', 'below', '13%', 'moisture', 'sacks', 'pallets', 'Tip', 'Note')
+PIECES = ('**', '*', ':', '1.', '2.', '•', '-', ' ', '  ', '\n', '\n\n', '\t')
+
+
+def reference_format(response):
+    """format_ai_response as it was before replies were streamed"""
+    for prefix in AI_PREFIXES:
+        if response.startswith(prefix):
+            response = response[len(prefix):].strip()
+            break
+    response = re.sub(r'\*\*(.*?)\*\*', r'<strong>\1</strong>', response)
+    response = re.sub(r'\*(.*?)\*', r'<em>\1</em>', response)
+    lines = []
+    for line in response.split('\n'):
+        line = line.strip()
+        if line:
+            lines.append(f"\n{line}" if line.startswith(('1.', '2.', '3.', '4.', '5.', '•', '-', '*')) or line.endswith(':') else line)
+    return '\n'.join(lines).strip()
+
+
+def fuzzed_reply(rng):
+    parts = [rng.choice(AI_PREFIXES)] if rng.random() < 0.3 else []
+    for _ in range(rng.randint(0, 80)):
+        parts.append(rng.choice(WORDS) if rng.random() < 0.6 else rng.choice(PIECES))
+        if rng.random() < 0.7:
+            parts.append(' ')
+    return ''.join(parts)
+
+
+def stream(reply, rng):
+    formatter = StreamingFormatter()
+    html, start = [], 0
+    while start < len(reply):
+        end = start + rng.randint(1, 12)
+        html.append(formatter.feed(reply[start:end]))
+        start = end
+    html.append(formatter.flush())
+    return ''.join(html)
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_streamed_html_matches_the_whole_reply(seed):
+    rng = random.Random(seed)
+    for _ in range(100):
+        reply = fuzzed_reply(rng)
+        assert stream(reply, rng) == format_ai_response(reply), repr(reply)
+        assert format_ai_response(reply.strip()) == reference_format(reply.strip()), repr(reply)
+
+
+def test_long_headers_and_unbalanced_emphasis():
+    reply = ("Here is how to protect a large maize harvest from moulds:\n"
+             "Dry the grain **well before storage\n"
+             "1. Use *hermetic* bags\nKeep sacks off the floor")
+    expected = ("how to protect a large maize harvest from moulds:\n"
+                "Dry the grain <em></em>well before storage\n\n"
+                "1. Use <em>hermetic</em> bags\nKeep sacks off the floor")
+    rng = random.Random(1)
+    assert format_ai_response(reply) == expected
+    for _ in range(50):
+        assert stream(reply, rng) == expected
+
+
+def test_partial_lines_are_shown_as_plain_text_until_formatted():
+    formatter = StreamingFormatter()
+    assert formatter.feed('Store **maize** in hermetic bags for at least') == ''
+    assert formatter.open_line() == 'Store **maize** in hermetic bags for at least'
+    assert formatter.feed(' six weeks\nCheck') == 'Store <strong>maize</strong> in hermetic bags for at least six weeks'
+    assert formatter.open_line() == '\nCheck'
+    assert formatter.flush() == '\nCheck'
+    assert formatter.open_line() == ''
+
+
+def test_chat_stream_shows_text_before_the_first_newline(monkeypatch):
+    reply = 'Dry your maize below 13% moisture, then store it in hermetic bags off the floor.'
+    tokens = [word + ' ' for word in reply.split()]
+    monkeypatch.setattr(app.llm_gateway, 'stream', lambda *args, **kwargs: iter(tokens))
+    monkeypatch.setattr(app.chat_cache, 'get', lambda key: None)
+    monkeypatch.setattr(app.chat_cache, 'put', lambda key, value: None)
+
+    response = app.app.test_client().post('/api/chat', json={'message': 'How do I store maize?', 'stream': True})
+    events = [json.loads(chunk[6:]) for chunk in response.get_data(as_text=True).split('\n\n') if chunk.startswith('data: ')]
+
+    previews = [event['pending'] for event in events if event.get('pending')]
+    assert len(previews) > len(tokens) // 2
+    assert previews[0] and reply.startswith(previews[0])
+    assert ''.join(event.get('delta', '') for event in events) == format_ai_response(reply)
+    assert events[-1] == {'done': True, 'cached': False}
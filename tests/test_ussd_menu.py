@@ -0,0 +1,92 @@
+import random
+import time
+
+import pytest
+
+from ussd_menu import BACK, EXIT_TEXT, INVALID_TEXT, UssdMenu, menu_graph, paths
+
+PHONE = '+254700000000'
+
+
+@pytest.fixture(scope='module')
+def menu():
+    handlers = {name: (lambda name: lambda data, phone: f"{name} {sorted(data.items())}")(name)
+                for name in ('loss_report', 'price_forecast', 'buyers', 'register')}
+    return UssdMenu(menu_graph, handlers)
+
+
+def test_missing_handler_is_rejected():
+    with pytest.raises(ValueError):
+        UssdMenu(menu_graph, {})
+
+
+def test_loss_dialogue_collects_every_field(menu):
+    response, step, data, state = menu.respond('1*1*50kg*2*4*1', PHONE)
+    assert response.startswith('END loss_report')
+    assert data == {'crop': 'maize', 'quantity': 50.0, 'location': 'Mombasa', 'storage': 'silo', 'weather': 'dry'}
+    assert state is None
+
+
+def test_prompt_names_collected_fields(menu):
+    response, step, _, state = menu.respond('1*2', PHONE)
+    assert response.startswith('CON Enter quantity for rice')
+    assert state['step'] == step == 'loss_quantity'
+
+
+def test_back_and_exit(menu):
+    assert menu.respond('1*0', PHONE)[0] == menu.respond('', PHONE)[0]
+    assert menu.respond(BACK, PHONE)[0] == f"END {EXIT_TEXT}"
+    assert menu.respond('9', PHONE)[0] == f"END {INVALID_TEXT}"
+
+
+def fuzzed(walks):
+    """Every path with a Back, a junk token or a bad quantity spliced in at every position"""
+    inputs = []
+    for path in walks:
+        tokens = path.split('*') if path else []
+        for position in range(len(tokens) + 1):
+            for junk in (BACK, '9', 'abc', '', '0kg', ' 3 '):
+                inputs.append('*'.join(tokens[:position] + [junk] + tokens[position:]))
+    return inputs
+
+
+def test_every_path_answers(menu):
+    walks = ['*'.join(path) for path in paths(menu.root)]
+    for path in fuzzed(walks):
+        response, step, _, _ = menu.respond(path, PHONE)
+        assert response.startswith(('CON ', 'END '))
+        assert step in menu.nodes or step == 'exit'
+    for path in walks:
+        assert menu.respond(path, PHONE)[0] != f"END {INVALID_TEXT}"
+
+
+def test_resuming_matches_a_full_walk(menu):
+    for path in ['*'.join(path) for path in paths(menu.root)]:
+        tokens = path.split('*') if path else []
+        state = None
+        for hop in range(len(tokens) + 1):
+            hop_path = '*'.join(tokens[:hop])
+            resumed = menu.respond(hop_path, PHONE, state)
+            assert resumed[:3] == menu.respond(hop_path, PHONE)[:3]
+            state = resumed[3]
+
+
+def test_stale_state_is_ignored(menu):
+    state = menu.respond('2', PHONE)[3]
+    assert menu.respond('1*1', PHONE, state)[:3] == menu.respond('1*1', PHONE)[:3]
+
+
+def test_every_hop_answers_within_a_millisecond(menu):
+    walks = ['*'.join(path) for path in paths(menu.root)]
+    inputs = fuzzed(walks)
+    random.Random(20).shuffle(inputs)
+
+    latencies = []
+    for path in walks + inputs:
+        started = time.perf_counter()
+        menu.respond(path, PHONE)
+        latencies.append(time.perf_counter() - started)
+    latencies.sort()
+    p50, p99 = latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.99)]
+    print(f"\n✅ Walked {len(walks)} paths and {len(inputs)} fuzzed inputs: p50 {p50 * 1e6:.1f}µs, p99 {p99 * 1e6:.1f}µs")
+    assert p99 < 0.001
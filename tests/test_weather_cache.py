@@ -0,0 +1,93 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+import requests
+
+import app
+from weather_cache import WeatherCache
+
+
+@pytest.fixture
+def provider(monkeypatch):
+    """Local stand-in for OpenWeather that counts requests per town, read through app.WeatherAPI"""
+    state = {'requests': {}, 'delay': 0.0, 'status': 200}
+    lock = threading.Lock()
+
+    class StandIn(BaseHTTPRequestHandler):
+        def do_GET(self):
+            town = parse_qs(urlparse(self.path).query)['q'][0].split(',')[0]
+            with lock:
+                state['requests'][town] = state['requests'].get(town, 0) + 1
+            time.sleep(state['delay'])
+            body = json.dumps({'main': {'temp': 22.4, 'humidity': 70}, 'weather': [{'description': 'clear sky'}]}).encode()
+            self.send_response(state['status'])
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StandIn)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setenv('OPENWEATHER_API_KEY', 'test-key')
+    monkeypatch.setenv('OPENWEATHER_BASE_URL', f"http://127.0.0.1:{server.server_port}/weather")
+    weather_api = app.WeatherAPI()
+    assert weather_api.live
+    state['fetch'] = weather_api._fetch_weather
+    yield state
+    server.shutdown()
+
+
+def test_entries_expire_after_the_ttl(provider):
+    cache = WeatherCache(provider['fetch'], ttl=0.2)
+    assert cache.get('nairobi') == {'temperature': 22, 'humidity': 70, 'condition': 'Clear Sky',
+                                    'wind_speed': 5, 'pressure': 1013}
+    assert cache.get('  Nairobi ') == cache.get('NAIROBI')
+    assert provider['requests'] == {'Nairobi': 1}
+
+    time.sleep(0.3)
+    cache.get('Nairobi')
+    assert provider['requests'] == {'Nairobi': 2}
+    assert cache.stats()['hits'] == 2
+
+
+def test_concurrent_misses_share_one_fetch(provider):
+    provider['delay'] = 0.3
+    cache = WeatherCache(provider['fetch'])
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get('Kisumu'))) for _ in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(results) == 20 and all(result == results[0] for result in results)
+    assert provider['requests'] == {'Kisumu': 1}
+    assert cache.stats()['coalesced'] == 19
+
+
+def test_provider_errors_fall_back_to_the_last_reading(provider):
+    cache = WeatherCache(provider['fetch'], ttl=0.1, stale_ttl=0.5)
+    fresh = cache.get('Nakuru')
+    provider['status'] = 500
+
+    time.sleep(0.2)
+    assert cache.get('Nakuru') == dict(fresh, stale=True)
+    assert cache.stats()['stale'] == 1
+
+    time.sleep(0.4)
+    with pytest.raises(requests.HTTPError):
+        cache.get('Nakuru')
+
+
+def test_errors_without_a_reading_propagate(provider):
+    provider['status'] = 503
+    cache = WeatherCache(provider['fetch'])
+    with pytest.raises(requests.HTTPError):
+        cache.get('Eldoret')
+    assert cache.peek('Eldoret') is None
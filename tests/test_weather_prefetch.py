@@ -0,0 +1,63 @@
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import database as db
+import ussd_menu
+from sms_parser import parse_message
+from weather_cache import WeatherCache
+from weather_prefetch import KNOWN_LOCATIONS, WeatherPrefetcher
+
+
+def test_known_locations_cover_the_menus_and_sms_places():
+    assert set(ussd_menu.LOCATIONS) - set(KNOWN_LOCATIONS) == {'Other'}
+    for message in ('20 bags of maize in Kiambu county', '5 bags of beans in tana river', 'nina gunia 10 za mahindi Kakamega'):
+        assert parse_message(message)['location'] in KNOWN_LOCATIONS
+    assert len(KNOWN_LOCATIONS) == len(set(KNOWN_LOCATIONS))
+
+
+def _snapshot(location, reading, fetched_at):
+    with db.transaction() as conn:
+        conn.execute('INSERT OR REPLACE INTO weather_snapshot (location, data, fetched_at) VALUES (?, ?, ?)',
+                     (location, json.dumps(reading), fetched_at))
+
+
+def test_snapshot_restores_recent_places_only():
+    reading = {'temperature': 31, 'humidity': 40, 'condition': 'Sunny'}
+    _snapshot('Ruiru, Kiambu', reading, time.time())
+    _snapshot('Atlantis', reading, time.time())
+    _snapshot('Wote', reading, time.time() - 7200)
+
+    prefetcher = WeatherPrefetcher(WeatherCache(lambda location: {}), track_ttl=3600)
+    prefetcher.load_snapshot()
+    assert set(prefetcher.tracked) == {'Ruiru, Kiambu'}
+    assert prefetcher.cache.peek('ruiru, kiambu') == reading
+    assert prefetcher.cache.peek('Atlantis') is None and prefetcher.cache.peek('Wote') is None
+
+
+def test_only_places_the_gazetteer_knows_are_tracked():
+    prefetcher = WeatherPrefetcher(WeatherCache(lambda location: {}))
+    for location in ('wote', 'Nairobi', 'asdfgh', 'my farm'):
+        prefetcher.track(location)
+    assert set(prefetcher.tracked) == {'Wote'}
+    assert 'Asdfgh' not in prefetcher.refresh_set()
+
+
+def test_places_not_looked_up_again_expire():
+    prefetcher = WeatherPrefetcher(WeatherCache(lambda location: {}), locations=('Nairobi',), track_ttl=0.1)
+    prefetcher.track('Wote')
+    assert prefetcher.refresh_set() == {'Nairobi', 'Wote'}
+    time.sleep(0.15)
+    assert prefetcher.refresh_set() == {'Nairobi'}
+    assert prefetcher.tracked == {}
+
+
+def test_refreshes_share_one_rate_limit():
+    calls = []
+    prefetcher = WeatherPrefetcher(WeatherCache(lambda location: calls.append(time.monotonic()) or {'temperature': 20}),
+                                   locations=('Nairobi', 'Nakuru', 'Kisumu', 'Eldoret', 'Mombasa'),
+                                   workers=5, calls_per_minute=600)
+    prefetcher._executor = ThreadPoolExecutor(max_workers=5)
+    assert prefetcher.refresh_all() == 5
+    calls.sort()
+    assert all(later - earlier >= 0.09 for earlier, later in zip(calls, calls[1:]))
@@ -0,0 +1,105 @@
+import threading
+import time
+import uuid
+
+import pytest
+
+import database as db
+from webhook_dedup import WebhookDedup
+
+
+@pytest.fixture
+def ids():
+    return [f"SM{uuid.uuid4().hex}" for _ in range(50)]
+
+
+def test_redeliveries_get_the_stored_reply(ids):
+    dedup = WebhookDedup()
+    for message_id in ids:
+        assert dedup.claim('twilio', message_id) == (True, None)
+        dedup.record('twilio', message_id, f"reply to {message_id}")
+
+    for message_id in ids:
+        assert dedup.claim('twilio', message_id) == (False, f"reply to {message_id}")
+    assert dedup.stats()['cache_hits'] == len(ids)
+
+    # Another worker: nothing in memory, the table answers
+    other = WebhookDedup()
+    for message_id in ids:
+        assert other.claim('twilio', message_id) == (False, f"reply to {message_id}")
+    assert other.stats()['cache_hits'] == 0
+
+
+def test_ids_are_scoped_per_provider(ids):
+    dedup = WebhookDedup()
+    assert dedup.claim('twilio', ids[0])[0]
+    assert dedup.claim('meta', ids[0])[0]
+
+
+def test_in_flight_redelivery_is_not_processed_again(ids):
+    dedup = WebhookDedup()
+    calls = []
+
+    def produce():
+        calls.append(1)
+        # The provider redelivers while the first delivery is still working
+        assert dedup.process('twilio', ids[0], produce) == (None, False)
+        return 'done'
+
+    assert dedup.process('twilio', ids[0], produce) == ('done', True)
+    assert dedup.process('twilio', ids[0], produce) == ('done', False)
+    assert len(calls) == 1
+
+
+def test_failed_processing_releases_the_claim(ids):
+    dedup = WebhookDedup()
+
+    def fail():
+        raise RuntimeError('model down')
+
+    with pytest.raises(RuntimeError):
+        dedup.process('twilio', ids[0], fail)
+    assert dedup.process('twilio', ids[0], lambda: 'retried') == ('retried', True)
+
+
+def test_abandoned_claims_are_taken_over(ids):
+    WebhookDedup().claim('twilio', ids[0])
+    with db.transaction() as conn:
+        conn.execute('UPDATE webhook_messages SET received_at = received_at - 3600 WHERE message_id = ?', (ids[0],))
+    dedup = WebhookDedup(claim_timeout=60)
+    assert dedup.claim('twilio', ids[0]) == (True, None)
+    assert dedup.stats()['takeovers'] == 1
+
+
+def test_batched_claims(ids):
+    dedup = WebhookDedup()
+    dedup.claim('meta', ids[0])
+    dedup.record('meta', ids[0], 'old reply')
+    claims = WebhookDedup().claim_many('meta', ids[:3] + ids[:1])
+    assert claims == {ids[0]: (False, 'old reply'), ids[1]: (True, None), ids[2]: (True, None)}
+
+
+def test_prune_drops_expired_ids(ids):
+    dedup = WebhookDedup(ttl=60)
+    dedup.claim('twilio', ids[0])
+    with db.transaction() as conn:
+        conn.execute('UPDATE webhook_messages SET received_at = ? WHERE message_id = ?', (time.time() - 120, ids[0]))
+    assert dedup.prune() >= 1
+    assert WebhookDedup().claim('twilio', ids[0]) == (True, None)
+
+
+def test_concurrent_workers_claim_each_id_once(ids):
+    workers = [WebhookDedup() for _ in range(8)]
+    won = []
+
+    def deliver(dedup):
+        for message_id in ids:
+            if dedup.claim('twilio', message_id)[0]:
+                won.append(message_id)
+
+    threads = [threading.Thread(target=deliver, args=(dedup,)) for dedup in workers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(won) == sorted(ids)
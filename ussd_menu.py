@@ -0,0 +1,241 @@
+"""Declarative USSD menu graph, compiled once at import.
+
+The gateway sends the whole input path on every hop ('1*2*50kg*3'). The
+menu is a graph of nodes: numbered Menus, free-text Prompts with a parser,
+and Actions that end the dialogue through a named handler. Compiling the
+graph precomputes every screen and a token -> transition dict per node, so
+a request is one split of the path and one dict lookup per hop. '0' goes
+back one screen (or exits from the main menu). Given the state saved after
+the previous hop, only the tokens added since are walked.
+
+Adding a menu is adding a node here; handler names are bound to functions by
+the caller.
+"""
+import re
+
+BACK = '0'
+
+EXIT_TEXT = "Thank you for using HarvestLink!\n\nEmpowering African farmers\nSMS: Send harvest details\nUSSD: Dial *123# anytime"
+INVALID_TEXT = "Invalid selection. Please try again.\n\nDial *123# to restart"
+
+
+class Menu:
+    """Numbered choice screen; options are (label, next node, value stored in field)"""
+
+    def __init__(self, key, title, options, field=None, error=INVALID_TEXT):
+        self.key = key
+        self.title = title
+        self.options = options
+        self.field = field
+        self.error = error
+
+    def children(self):
+        return [option[1] for option in self.options]
+
+    def compile(self, root):
+        lines = [f"{number}. {option[0]}" for number, option in enumerate(self.options, 1)]
+        lines.append(f"{BACK}. {'Exit' if self is root else 'Back'}")
+        self.screen = f"CON {self.title}\n\n" + '\n'.join(lines)
+        self.transitions = {
+            str(number): (option[1], self.field, option[2] if len(option) > 2 else None)
+            for number, option in enumerate(self.options, 1)
+        }
+
+    def step(self, token):
+        return self.transitions.get(token)
+
+
+class Prompt:
+    """Free-text input; parse(text) returns the stored value or None if invalid.
+
+    The prompt text may name fields collected earlier, e.g. '{crop}'.
+    """
+
+    def __init__(self, key, text, field, parse, next_node, error):
+        self.key = key
+        self.text = text
+        self.field = field
+        self.parse = parse
+        self.next_node = next_node
+        self.error = error
+
+    def children(self):
+        return [self.next_node]
+
+    def compile(self, root):
+        self.screen = f"CON {self.text}"
+        self.templated = '{' in self.text
+
+    def step(self, token):
+        value = self.parse(token)
+        return None if value is None else (self.next_node, self.field, value)
+
+
+class Action:
+    """End of a dialogue: the named handler turns the collected fields into the final text"""
+
+    def __init__(self, key, handler):
+        self.key = key
+        self.handler = handler
+
+    def children(self):
+        return []
+
+    def compile(self, root):
+        pass
+
+
+class Text(Action):
+    """End of a dialogue with fixed text"""
+
+    def __init__(self, key, text):
+        super().__init__(key, None)
+        self.text = text
+
+
+def parse_quantity(text):
+    """'50kg' -> 50.0, '2tons' -> 2000.0; None if there is no positive amount"""
+    match = re.search(r'(\d+(?:\.\d+)?)\s*(kgs?|tons?|tonnes?|t)?\b', text.lower())
+    if not match or float(match.group(1)) <= 0:
+        return None
+    amount = float(match.group(1))
+    return amount * 1000 if (match.group(2) or 'kg').startswith('t') else amount
+
+
+LOSS_CROPS = ('maize', 'rice', 'wheat', 'beans', 'tomatoes', 'millet', 'sorghum', 'cassava')
+MARKET_CROPS = ('maize', 'rice', 'wheat', 'beans', 'tomatoes')
+LOCATIONS = ('Nairobi', 'Mombasa', 'Kisumu', 'Nakuru', 'Eldoret', 'Thika', 'Meru', 'Other')
+STORAGE = (
+    ('Traditional (open air)', 'traditional'), ('Improved (covered)', 'improved'),
+    ('Cold Storage', 'cold_storage'), ('Silo', 'silo'), ('Hermetic bags', 'hermetic')
+)
+WEATHER = ('dry', 'humid', 'rainy', 'stormy', 'drought')
+
+ADVICE = (
+    ('Post-harvest storage tips', "STORAGE TIPS\n\n- Dry grain below 13% moisture\n- Use hermetic bags or sealed silos\n- Keep stores off the floor and ventilated"),
+    ('Pest control methods', "PEST CONTROL\n\n- Clean stores before loading\n- Inspect weekly for weevils\n- Use approved grain protectants only"),
+    ('Weather protection', "WEATHER PROTECTION\n\n- Cover produce before rain\n- Raise stacks on pallets\n- Move lots indoors when humid"),
+    ('Market timing', "MARKET TIMING\n\n- Check prices: dial *123# option 2\n- Hold only if storage is safe\n- Sell early when loss risk is high"),
+    ('General farming tips', "FARMING TIPS\n\n- Harvest at full maturity\n- Sort out damaged produce\n- Record quantities and prices"),
+)
+
+
+def _build():
+    """The HarvestLink menu graph"""
+    loss_report = Action('loss_report', 'loss_report')
+    weather = Menu('loss_weather', 'Select weather condition:', [(name.title(), loss_report, name) for name in WEATHER],
+                   field='weather', error="Invalid weather selection.")
+    storage = Menu('loss_storage', 'Select storage method:', [(label, weather, value) for label, value in STORAGE],
+                   field='storage', error="Invalid storage selection.")
+    location = Menu('loss_location', 'Select your location:', [(name, storage, name) for name in LOCATIONS],
+                    field='location', error="Invalid location selection.")
+    quantity = Prompt('loss_quantity', 'Enter quantity for {crop}:\n\nFormat: 50kg or 2tons\nExample: 50kg', 'quantity',
+                      parse_quantity, location, "Invalid quantity format. Please try again.")
+    loss_crop = Menu('loss_crop', 'Select your crop:', [(name.title(), quantity, name) for name in LOSS_CROPS],
+                     field='crop', error="Invalid selection. Please try again.")
+
+    price = Action('price_forecast', 'price_forecast')
+    price_crop = Menu('price_crop', 'Select crop for price forecast:',
+                      [(name.title(), price, name) for name in MARKET_CROPS], field='crop', error="Invalid selection.")
+
+    buyers = Action('buyers', 'buyers')
+    buyers_crop = Menu('buyers_crop', 'Find buyers for:',
+                       [(name.title(), buyers, name) for name in MARKET_CROPS] + [('All crops', buyers, 'all')],
+                       field='crop', error="Invalid selection.")
+
+    advice = Menu('advice', 'Get farming advice:', [
+        (label, Text(f'advice_{number}', text)) for number, (label, text) in enumerate(ADVICE, 1)
+    ])
+
+    register = Menu('register', 'Register as farmer:', [
+        ('Yes, register me', Action('register_farmer', 'register')),
+        ('View benefits', Text('register_benefits', "HARVESTLINK BENEFITS\n\n- Loss risk alerts\n- Price forecasts\n- Verified buyers near you\n\nDial *123# and choose 5 to join")),
+    ])
+
+    return Menu('main', '🌾 Welcome to HarvestLink!', [
+        ('Check Harvest Loss Risk', loss_crop),
+        ('Get Price Forecast', price_crop),
+        ('Find Buyers', buyers_crop),
+        ('Get Farming Advice', advice),
+        ('Register as Farmer', register),
+    ])
+
+
+class UssdMenu:
+    """Compiled menu graph bound to its action handlers"""
+
+    def __init__(self, root, handlers):
+        self.root = root
+        self.handlers = handlers
+        self.nodes = {}
+        pending = [root]
+        while pending:
+            node = pending.pop()
+            if node.key in self.nodes:
+                continue
+            self.nodes[node.key] = node
+            node.compile(root)
+            pending.extend(node.children())
+
+        missing = {node.handler for node in self.nodes.values()
+                   if isinstance(node, Action) and not isinstance(node, Text) and node.handler not in handlers}
+        if missing:
+            raise ValueError(f"No USSD handler for: {', '.join(sorted(missing))}")
+
+    def respond(self, text, phone_number, session=None):
+        """Walk an input path; returns (response, step key, collected fields, state to save).
+
+        session is the state saved after the previous hop of the dialogue;
+        when the path extends that hop's path, only the new tokens are walked.
+        """
+        tokens = text.split('*') if text else []
+        stack = [(self.root, {})]
+        if session and 'stack' in session:
+            walked = session['path'].split('*') if session['path'] else []
+            if tokens[:len(walked)] == walked and all(key in self.nodes for key, _ in session['stack']):
+                stack = [(self.nodes[key], data) for key, data in session['stack']]
+                tokens = tokens[len(walked):]
+
+        for token in tokens:
+            node, data = stack[-1]
+            token = token.strip()
+            if token == BACK:
+                if len(stack) == 1:
+                    return f"END {EXIT_TEXT}", 'exit', data, None
+                stack.pop()
+                continue
+
+            transition = node.step(token)
+            if transition is None:
+                return f"END {node.error}", node.key, data, None
+            next_node, field, value = transition
+            if field is not None:
+                data = {**data, field: value}
+
+            if isinstance(next_node, Text):
+                return f"END {next_node.text}", next_node.key, data, None
+            if isinstance(next_node, Action):
+                return f"END {self.handlers[next_node.handler](data, phone_number)}", next_node.key, data, None
+            stack.append((next_node, data))
+
+        node, data = stack[-1]
+        state = {'step': node.key, 'path': text, 'stack': [[node.key, data] for node, data in stack]}
+        if getattr(node, 'templated', False):
+            return node.screen.format_map(data), node.key, data, state
+        return node.screen, node.key, data, state
+
+
+def paths(node, prefix=(), depth=8):
+    """Every input path through the graph (one sample value for each prompt)"""
+    if depth == 0 or isinstance(node, Action):
+        return [prefix]
+    if isinstance(node, Prompt):
+        return [prefix] + paths(node.next_node, prefix + ('50kg',), depth - 1)
+    result = [prefix]
+    for token in node.transitions:
+        result += paths(node.transitions[token][0], prefix + (token,), depth - 1)
+    return result
+
+
+menu_graph = _build()
+
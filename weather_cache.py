@@ -0,0 +1,145 @@
+"""Weather cache with per-entry TTL, single-flight fetches and stale fallback.
+
+Nearly every weather lookup is for the same handful of towns. Entries are
+keyed on the normalized location and stay fresh for WEATHER_CACHE_TTL
+seconds. When several requests miss on the same location at once, only one
+of them calls the provider and the rest wait for its answer. If the provider
+fails, the last good reading is served (stale) for up to WEATHER_STALE_TTL.
+peek() reads the cache without ever calling the provider, for handlers that
+rely on the background prefetcher to keep entries fresh.
+"""
+import os
+import threading
+import time
+
+WEATHER_CACHE_TTL = int(os.getenv('WEATHER_CACHE_TTL', '900'))
+WEATHER_STALE_TTL = int(os.getenv('WEATHER_STALE_TTL', str(6 * 3600)))
+WEATHER_CACHE_SIZE = 512
+
+# How long a coalesced request waits for the in-flight fetch
+FETCH_WAIT_TIMEOUT = 15
+
+
+def normalize_location(location):
+    """Canonical cache key for a location ('  nairobi ' -> 'Nairobi')"""
+    return ' '.join(str(location).split()).title()
+
+
+class _Flight:
+    """One in-progress upstream fetch that other requests can wait on"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.data = None
+        self.error = None
+
+
+class WeatherCache:
+    """TTL cache in front of a weather fetch function"""
+
+    def __init__(self, fetch, ttl=WEATHER_CACHE_TTL, stale_ttl=WEATHER_STALE_TTL, max_entries=WEATHER_CACHE_SIZE):
+        self.fetch = fetch
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_entries = max_entries
+        self._entries = {}      # key -> (data, fetched_at)
+        self._in_flight = {}    # key -> _Flight
+        self._lock = threading.Lock()
+        self.metrics = {'hits': 0, 'misses': 0, 'coalesced': 0, 'stale': 0, 'errors': 0, 'refreshes': 0}
+
+    def _count(self, metric):
+        with self._lock:
+            self.metrics[metric] += 1
+
+    def get(self, location):
+        """Return weather for a location, fetching upstream at most once per miss"""
+        key = normalize_location(location)
+        entry = self._entries.get(key)
+        if entry is not None and time.time() - entry[1] < self.ttl:
+            self._count('hits')
+            return dict(entry[0])
+
+        self._count('misses')
+        try:
+            return self._fetch_once(key)
+        except Exception:
+            # Upstream failed: fall back to the last good reading if it is recent enough
+            self._count('errors')
+            stale = self.peek(key, count=False)
+            if stale is None:
+                raise
+            self._count('stale')
+            return dict(stale, stale=True)
+
+    def peek(self, location, count=True):
+        """Return the cached reading without ever calling upstream (None if absent).
+
+        Readings older than the TTL are still returned, flagged stale, until
+        they pass WEATHER_STALE_TTL.
+        """
+        key = normalize_location(location)
+        entry = self._entries.get(key)
+        age = time.time() - entry[1] if entry is not None else None
+        if age is None or age >= self.stale_ttl:
+            if count:
+                self._count('misses')
+            return None
+
+        if count:
+            self._count('hits' if age < self.ttl else 'stale')
+        return dict(entry[0]) if age < self.ttl else dict(entry[0], stale=True)
+
+    def refresh(self, location):
+        """Fetch a location now, regardless of freshness, and cache the result"""
+        self._count('refreshes')
+        try:
+            return self._fetch_once(normalize_location(location))
+        except Exception:
+            self._count('errors')
+            raise
+
+    def _fetch_once(self, key):
+        """Call upstream for a key, sharing one fetch between concurrent callers"""
+        with self._lock:
+            flight = self._in_flight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._in_flight[key] = _Flight()
+            else:
+                self.metrics['coalesced'] += 1
+
+        if leader:
+            try:
+                flight.data = self.fetch(key)
+                self.put(key, flight.data)
+            except Exception as e:
+                flight.error = e
+            finally:
+                with self._lock:
+                    del self._in_flight[key]
+                flight.done.set()
+        elif not flight.done.wait(FETCH_WAIT_TIMEOUT):
+            raise TimeoutError(f'Weather fetch for {key} is still running')
+
+        if flight.error is not None:
+            raise flight.error
+        return dict(flight.data)
+
+    def put(self, location, data, fetched_at=None):
+        """Store a reading (also used to warm the cache)"""
+        key = normalize_location(location)
+        with self._lock:
+            if key not in self._entries and len(self._entries) >= self.max_entries:
+                oldest = min(self._entries, key=lambda k: self._entries[k][1])
+                del self._entries[oldest]
+            self._entries[key] = (dict(data), fetched_at or time.time())
+
+    def snapshot(self):
+        """Return [(location, data, fetched_at)] for every cached reading"""
+        with self._lock:
+            return [(key, dict(data), fetched_at) for key, (data, fetched_at) in self._entries.items()]
+
+    def stats(self):
+        """Return cache counters for monitoring"""
+        with self._lock:
+            return dict(self.metrics, entries=len(self._entries))
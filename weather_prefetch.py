@@ -0,0 +1,200 @@
+"""Background weather prefetcher for the towns our farmers come from.
+
+Nearly all traffic names one of a known set of places: the USSD location
+menu (which includes the web UI presets) and every town or county the SMS
+parser recognizes. A daemon thread refreshes all of them on a fixed interval
+in one parallel pass, so request handlers only ever read the weather cache.
+Other places are added when looked up (see track), as long as the gazetteer
+can place them, and dropped again after WEATHER_TRACK_TTL seconds without a
+lookup. Provider calls from all refresh threads share one rate limit, sized
+for OpenWeather's free tier of 60 calls a minute.
+
+After each pass the readings are written to the weather_snapshot table. A
+new process loads that snapshot at start-up, which also restores the places
+looked up recently, so it serves warm data before its first refresh.
+"""
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import database as db
+import geo
+import sms_parser
+import ussd_menu
+from weather_cache import normalize_location
+
+WEATHER_REFRESH_INTERVAL = int(os.getenv('WEATHER_REFRESH_INTERVAL', '600'))
+WEATHER_PREFETCH_WORKERS = int(os.getenv('WEATHER_PREFETCH_WORKERS', '8'))
+WEATHER_CALLS_PER_MINUTE = int(os.getenv('WEATHER_CALLS_PER_MINUTE', '60'))
+WEATHER_TRACK_TTL = int(os.getenv('WEATHER_TRACK_TTL', str(24 * 3600)))
+
+# Upper bound on looked-up locations refreshed each pass on top of the known ones
+MAX_TRACKED_LOCATIONS = 200
+
+
+def _known_locations():
+    """USSD menu towns, then every place name the SMS parser can extract"""
+    places = [place for place in ussd_menu.LOCATIONS if place != 'Other']
+    places += sorted({value for field, value in sms_parser.PHRASES.values() if field == 'location'})
+    return tuple(dict.fromkeys(places))
+
+
+KNOWN_LOCATIONS = _known_locations()
+
+
+class RateLimiter:
+    """Spaces calls evenly so that all threads together stay under a per-minute budget"""
+
+    def __init__(self, calls_per_minute):
+        self.spacing = 60.0 / calls_per_minute if calls_per_minute > 0 else 0.0
+        self._next_slot = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        """Block until this caller's slot comes up"""
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.spacing
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class WeatherPrefetcher:
+    """Keeps a WeatherCache warm for the known locations and recently looked-up ones"""
+
+    def __init__(self, cache, locations=KNOWN_LOCATIONS, interval=WEATHER_REFRESH_INTERVAL,
+                 workers=WEATHER_PREFETCH_WORKERS, calls_per_minute=WEATHER_CALLS_PER_MINUTE,
+                 track_ttl=WEATHER_TRACK_TTL):
+        self.cache = cache
+        self.locations = frozenset(normalize_location(location) for location in locations)
+        self.tracked = {}  # looked-up location -> last lookup time
+        self.interval = interval
+        self.workers = workers
+        self.track_ttl = track_ttl
+        self.limiter = RateLimiter(calls_per_minute)
+        self._executor = None
+        self._wakeup = threading.Event()
+        self._lock = threading.Lock()
+        self._pid = None
+        self.last_refresh = None
+
+    def start(self):
+        """Load the snapshot and start the refresh thread once per process"""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='weather-prefetch')
+        self.load_snapshot()
+        threading.Thread(target=self._run, name='weather-refresher', daemon=True).start()
+
+    def track(self, location):
+        """Record a lookup; a new place the gazetteer knows joins the refresh set and is fetched in the background"""
+        location = normalize_location(location)
+        if location in self.locations or geo.locate(location) is None:
+            return
+        with self._lock:
+            new = location not in self.tracked
+            if new and len(self.tracked) >= MAX_TRACKED_LOCATIONS:
+                return
+            self.tracked[location] = time.time()
+        if new and self._executor is not None:
+            self._executor.submit(self._throttled_refresh, location)
+
+    def refresh_set(self):
+        """Known locations plus those looked up within track_ttl (older lookups are dropped)"""
+        cutoff = time.time() - self.track_ttl
+        with self._lock:
+            for location in [location for location, looked_up in self.tracked.items() if looked_up < cutoff]:
+                del self.tracked[location]
+            return self.locations | set(self.tracked)
+
+    def refresh_all(self):
+        """Refresh every tracked location in parallel and save a snapshot"""
+        locations = sorted(self.refresh_set())
+        started = time.time()
+        futures = []
+        for location in locations:
+            # Slots are taken on the (daemon) refresher thread, so shutdown never waits out a throttled pass
+            self.limiter.wait()
+            futures.append(self._executor.submit(self._refresh_one, location))
+        refreshed = sum(future.result() for future in futures)
+        self.last_refresh = time.time()
+        print(f"🌦️ Refreshed weather for {refreshed}/{len(locations)} locations in {(self.last_refresh - started) * 1000:.0f}ms")
+        self.save_snapshot()
+        return refreshed
+
+    def _throttled_refresh(self, location):
+        self.limiter.wait()
+        return self._refresh_one(location)
+
+    def _refresh_one(self, location):
+        try:
+            self.cache.refresh(location)
+            return True
+        except Exception as e:
+            print(f"Weather refresh error for {location}: {e}")
+            return False
+
+    def _run(self):
+        while True:
+            try:
+                self.refresh_all()
+            except Exception as e:
+                print(f"Weather prefetch error: {e}")
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+
+    def load_snapshot(self):
+        """Warm the cache from the last saved readings of places still worth refreshing"""
+        try:
+            with db.connection() as conn:
+                rows = conn.execute('SELECT location, data, fetched_at FROM weather_snapshot WHERE fetched_at >= ?',
+                                    (time.time() - self.track_ttl,)).fetchall()
+        except Exception as e:
+            print(f"Weather snapshot read error: {e}")
+            return 0
+
+        loaded = 0
+        for location, data, fetched_at in rows:
+            if location not in self.locations:
+                if geo.locate(location) is None:
+                    continue
+                with self._lock:
+                    if location not in self.tracked and len(self.tracked) >= MAX_TRACKED_LOCATIONS:
+                        continue
+                    self.tracked[location] = max(self.tracked.get(location, 0), fetched_at)
+            self.cache.put(location, json.loads(data), fetched_at)
+            loaded += 1
+        return loaded
+
+    def save_snapshot(self):
+        """Persist the readings of the refresh set for the next process, dropping expired places"""
+        locations = self.refresh_set()
+        rows = [(location, json.dumps(data), fetched_at) for location, data, fetched_at in self.cache.snapshot()
+                if location in locations]
+        try:
+            with db.transaction() as conn:
+                conn.executemany(
+                    'INSERT OR REPLACE INTO weather_snapshot (location, data, fetched_at) VALUES (?, ?, ?)',
+                    rows
+                )
+                conn.execute('DELETE FROM weather_snapshot WHERE fetched_at < ?', (time.time() - self.track_ttl,))
+        except Exception as e:
+            print(f"Weather snapshot write error: {e}")
+
+    def stats(self):
+        """Return prefetcher state for monitoring"""
+        with self._lock:
+            return {
+                'locations': len(self.locations) + len(self.tracked),
+                'tracked': len(self.tracked),
+                'calls_per_minute': round(60 / self.limiter.spacing) if self.limiter.spacing else None,
+                'interval': self.interval,
+                'last_refresh': self.last_refresh
+            }
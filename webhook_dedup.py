@@ -0,0 +1,173 @@
+"""Idempotent webhook ingestion keyed on provider message ids.
+
+Twilio (MessageSid) and Meta (messages[].id) redeliver a webhook whenever
+our answer is slow, which used to repeat the AI analysis, the farmer write
+and the reply. The first delivery of an id claims it with an INSERT into the
+webhook_messages table, whose primary key is shared by every worker process;
+the reply is stored against the id once it is generated. A redelivery finds
+the id taken and gets the stored reply (or None while the first delivery is
+still being processed) instead of doing the work again.
+
+Recently seen ids and their replies are also kept in an in-process LRU, so a
+redelivery to the same worker is answered without touching SQLite. Claims
+whose processing never finished (the worker died) can be taken over after
+WEBHOOK_CLAIM_TIMEOUT seconds, and rows older than WEBHOOK_DEDUP_TTL are
+pruned.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import database as db
+
+WEBHOOK_DEDUP_TTL = int(os.getenv('WEBHOOK_DEDUP_TTL', str(2 * 24 * 3600)))
+WEBHOOK_CLAIM_TIMEOUT = int(os.getenv('WEBHOOK_CLAIM_TIMEOUT', '120'))
+
+# Entries held in memory, and claims between prunes of old rows
+MAX_CACHED = 50000
+PRUNE_EVERY = 1000
+
+# Cached value for an id claimed here whose reply is not ready yet
+_PROCESSING = object()
+
+
+class WebhookDedup:
+    """Claims provider message ids and remembers the reply generated for each"""
+
+    def __init__(self, ttl=WEBHOOK_DEDUP_TTL, claim_timeout=WEBHOOK_CLAIM_TIMEOUT, max_cached=MAX_CACHED):
+        self.ttl = ttl
+        self.claim_timeout = claim_timeout
+        self.max_cached = max_cached
+        self._cache = OrderedDict()     # (provider, message_id) -> reply or _PROCESSING
+        self._lock = threading.Lock()
+        self._claims = 0
+        self.metrics = {'claimed': 0, 'duplicates': 0, 'cache_hits': 0, 'takeovers': 0}
+
+    def claim(self, provider, message_id):
+        """(True, None) for a first delivery, or (False, stored reply or None) for a redelivery"""
+        return self.claim_many(provider, [message_id])[message_id]
+
+    def claim_many(self, provider, message_ids):
+        """claim() for every id of a batched webhook, in one transaction; returns {message_id: (first, reply)}"""
+        claims = {}
+        with self._lock:
+            for message_id in message_ids:
+                cached = self._cache.get((provider, message_id))
+                if cached is not None:
+                    self._cache.move_to_end((provider, message_id))
+                    self.metrics['duplicates'] += 1
+                    self.metrics['cache_hits'] += 1
+                    claims[message_id] = (False, None if cached is _PROCESSING else cached)
+        unknown = [message_id for message_id in dict.fromkeys(message_ids) if message_id not in claims]
+        if not unknown:
+            return claims
+
+        now = time.time()
+        takeovers = 0
+        with db.transaction() as conn:
+            for message_id in unknown:
+                inserted = conn.execute('''
+                    INSERT OR IGNORE INTO webhook_messages (provider, message_id, received_at) VALUES (?, ?, ?)
+                ''', (provider, message_id, now)).rowcount
+                if not inserted:
+                    # Take over a claim whose worker never stored a reply
+                    inserted = conn.execute('''
+                        UPDATE webhook_messages SET received_at = ?
+                        WHERE provider = ? AND message_id = ? AND reply IS NULL AND received_at < ?
+                    ''', (now, provider, message_id, now - self.claim_timeout)).rowcount
+                    takeovers += inserted
+                reply = None
+                if not inserted:
+                    reply = conn.execute(
+                        'SELECT reply FROM webhook_messages WHERE provider = ? AND message_id = ?', (provider, message_id)
+                    ).fetchone()[0]
+                claims[message_id] = (bool(inserted), reply)
+
+        with self._lock:
+            self.metrics['takeovers'] += takeovers
+            prune = False
+            for message_id in unknown:
+                first, reply = claims[message_id]
+                if first:
+                    self.metrics['claimed'] += 1
+                    self._cache_put((provider, message_id), _PROCESSING)
+                    self._claims += 1
+                    prune = prune or self._claims % PRUNE_EVERY == 0
+                else:
+                    self.metrics['duplicates'] += 1
+                    if reply is not None:
+                        self._cache_put((provider, message_id), reply)
+        if prune:
+            self.prune()
+        return claims
+
+    def record(self, provider, message_id, reply):
+        """Store the reply generated for a claimed id"""
+        self.record_many(provider, {message_id: reply})
+
+    def record_many(self, provider, replies):
+        """Store {message_id: reply} for claimed ids in one transaction"""
+        with db.transaction() as conn:
+            conn.executemany(
+                'UPDATE webhook_messages SET reply = ? WHERE provider = ? AND message_id = ?',
+                [(reply, provider, message_id) for message_id, reply in replies.items()]
+            )
+        with self._lock:
+            for message_id, reply in replies.items():
+                self._cache_put((provider, message_id), reply)
+
+    def release(self, provider, message_id):
+        """Forget a claim whose processing failed, so a redelivery is processed again"""
+        self.release_many(provider, [message_id])
+
+    def release_many(self, provider, message_ids):
+        """release() for several ids in one transaction"""
+        with db.transaction() as conn:
+            conn.executemany(
+                'DELETE FROM webhook_messages WHERE provider = ? AND message_id = ? AND reply IS NULL',
+                [(provider, message_id) for message_id in message_ids]
+            )
+        with self._lock:
+            for message_id in message_ids:
+                self._cache.pop((provider, message_id), None)
+
+    def process(self, provider, message_id, produce):
+        """Reply for a delivery: produce() on the first one, the stored reply on redeliveries.
+
+        Returns (reply, first). Deliveries without an id are always processed.
+        """
+        if not message_id:
+            return produce(), True
+        first, reply = self.claim(provider, message_id)
+        if not first:
+            return reply, False
+        try:
+            reply = produce()
+        except Exception:
+            self.release(provider, message_id)
+            raise
+        self.record(provider, message_id, reply)
+        return reply, True
+
+    def _cache_put(self, key, value):
+        self._cache[key] = value
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.max_cached:
+            self._cache.popitem(last=False)
+
+    def prune(self):
+        """Delete ids older than the TTL"""
+        with db.transaction() as conn:
+            return conn.execute(
+                'DELETE FROM webhook_messages WHERE received_at < ?', (time.time() - self.ttl,)
+            ).rowcount
+
+    def stats(self):
+        """Return dedup counters for monitoring"""
+        with self._lock:
+            return dict(self.metrics, cached=len(self._cache))
+
+
+webhook_dedup = WebhookDedup()
+